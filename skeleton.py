@@ -1,10 +1,877 @@
+import bisect
+import email.utils
+import functools
+import gzip
+import hashlib
+import html
+import importlib
 import json
+import math
+import mimetypes
+import os
+import queue
+import re
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from datetime import timezone
 from http import HTTPStatus
-from http.server import BaseHTTPRequestHandler
-from typing import Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType
+from typing import BinaryIO, Callable, Deque, Dict, Hashable, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+from urllib.parse import parse_qs, parse_qsl, urlsplit
+
+import with_html_stack
+
+orjson: Optional[ModuleType]
+try:
+    import orjson  # optional, much faster than json for large payloads
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # optional, "br" content encoding
+except ImportError:
+    brotli = None
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+_MAX_BODY_SIZE = 64 * 1024 * 1024
+_MAX_LINE_SIZE = 64 * 1024
+_ACCESS_LOG_BATCH = 1000  # records per write
+_FALSE_VALUES = {"", "0", "false", "no", "off"}
+# seconds, upper bounds of latency histogram buckets (the last one is +Inf)
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_LISTEN_FD_ENV = "SKELETON_LISTEN_FD"  # listening socket inherited by the new process, see serve
+_READY_FD_ENV = "SKELETON_READY_FD"  # pipe to tell the old process the new one is ready
+_UNKNOWN_ROUTE = "<unknown>"  # for 404 responses: do not let random paths blow up number of metrics
+_ID_SEGMENT = re.compile(r"/(?:[0-9]+|[0-9a-fA-F]{16,})(?=/|$)")  # numbers and hashes in paths like /job/12/log
+_COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def encode_chunks(pieces: Iterable[str], coding: str = "UTF-8", size: int = _STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    # Join small pieces (json.JSONEncoder.iterencode yields single tokens) into chunks
+    # of about "size" characters to avoid a system call per token.
+    buffer: List[str] = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield "".join(buffer).encode(coding)
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield "".join(buffer).encode(coding)
+
+
+def dump_json(obj, pretty: bool = True) -> bytes:
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS) if pretty else 0
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            pass  # e.g. non-string keys or integers wider than 64 bits: json can handle them
+    if pretty:
+        return json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False).encode("UTF-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("UTF-8")
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    # "gzip;q=0.8, br" -> {"gzip": 0.8, "br": 1.0}
+    result: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[name] = quality
+    return result
+
+
+def compress(content: bytes, encoding: str, level: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(content, quality=min(level, 11))
+    if encoding == "gzip":
+        return gzip.compress(content, compresslevel=level, mtime=0)
+    if encoding == "deflate":
+        return zlib.compress(content, level)
+    raise RuntimeError(f"unknown content encoding: {encoding}")
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str, level: int, flush: bool = False) -> Iterator[bytes]:
+    # "flush" sends every chunk to the client at once (e.g. for logs of running task) at the cost of ratio.
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=min(level, 11))
+        for chunk in chunks:
+            yield compressor.process(chunk)
+            if flush:
+                yield compressor.flush()
+        yield compressor.finish()
+    elif encoding in ("gzip", "deflate"):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+            if flush:
+                yield compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    else:
+        raise RuntimeError(f"unknown content encoding: {encoding}")
+
+
+def content_digest(content: bytes) -> bytes:
+    return hashlib.blake2b(content, digest_size=20).digest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # weak comparison as RFC 7232 requires for If-None-Match
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag[2:] if etag.startswith("W/") else etag
+    for item in if_none_match.split(","):
+        item = item.strip()
+        if (item[2:] if item.startswith("W/") else item) == etag:
+            return True
+    return False
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Start and end (exclusive) of the "Range: bytes=..." header for content of "size" bytes.
+
+    None means the whole content: no header, a header of unknown form or several ranges (a server may ignore them).
+    ValueError means that the range is not satisfiable.
+    """
+    match = _RANGE.match((header or "").strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":  # the last N bytes
+        suffix = int(match.group(2))
+        if suffix == 0:
+            raise ValueError("empty suffix range")
+        return max(size - suffix, 0), size
+    start = int(match.group(1))
+    if match.group(2) and int(match.group(2)) < start:
+        return None  # invalid, not unsatisfiable
+    if start >= size:
+        raise ValueError(f"range starts after the end: {start} >= {size}")
+    return start, min(int(match.group(2)) + 1 if match.group(2) else size, size)
+
+
+def modified_since(if_modified_since: Optional[str], mtime: float) -> bool:
+    # HTTP dates have whole seconds, unparsable date means modified
+    if not if_modified_since:
+        return True
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return int(mtime) > since.timestamp()
+
+
+class LRUCache:
+    """Thread safe mapping which forgets least recently used items when total size of items exceeds max_size."""
+
+    def __init__(self, max_size: int, on_evict: Optional[Callable[[object, object], None]] = None) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.on_evict = on_evict  # called with key and value of every forgotten item, e.g. to remove a file
+        self._items: "OrderedDict[object, Tuple[object, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size: int = 1) -> None:
+        if size > self.max_size:
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            return
+        evicted = []
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                evicted_key, (evicted_value, evicted_size) = self._items.popitem(last=False)
+                self.size -= evicted_size
+                evicted.append((evicted_key, evicted_value))
+        if self.on_evict is not None:
+            for item in evicted:
+                self.on_evict(*item)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            self.size -= item[1]
+            return item[0]
+
+    def keys(self) -> List:
+        with self._lock:
+            return list(self._items)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class ResponseCache:
+    """Responses of "show_*" methods decorated with cached_response, each one is valid for its own TTL."""
+
+    def __init__(self, max_size: int) -> None:
+        self.lru = LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[tuple]:
+        item = self.lru.get(key)
+        if item is not None:
+            expires, response = item
+            if time.monotonic() < expires:
+                self.hits += 1
+                return response
+            self.lru.pop(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, response: tuple, ttl: float) -> None:
+        self.lru.put(key, (time.monotonic() + ttl, response), len(response[2]))
+
+    def invalidate(self, route: Optional[str] = None) -> None:
+        # forget responses of one route (path without query) or all of them
+        if route is None:
+            self.lru.clear()
+            return
+        for key in self.lru.keys():
+            if key[1] == route:
+                self.lru.pop(key)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "items": len(self.lru),
+            "size": self.lru.size,
+            "max_size": self.lru.max_size,
+        }
+
+
+def cached_response(ttl: float):
+    """Decorator for "show_*" methods: successful response is kept in response_cache for "ttl" seconds.
+
+    Key is method, path and query (plus cache_variant of handler), so pages with the same link are shared
+    between clients. Use response_cache.invalidate(route) when the data behind the page is changed.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = self.response_key()
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return self.return_content(*cached)
+
+            # return_content stores the response before sending it, so that next request finds it for sure
+            self._response_cache_key = (key, ttl)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._response_cache_key = None
+
+        return wrapper
+
+    return decorator
+
+
+class Flight:
+    def __init__(self) -> None:
+        self.landed = threading.Event()  # set when the response (or the error) is there
+        self.response: Optional[tuple] = None  # arguments of return_content
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Computations in progress by key, see single_flight."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Flight] = {}
+        self.leaders = 0  # requests which have computed the response
+        self.followers = 0  # requests which have waited for another one
+
+    def join(self, key: Hashable) -> Tuple[Flight, bool]:
+        # the flight and True if the caller is the first and has to compute the response
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    def land(self, key: Hashable, flight: Flight) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.landed.set()
+
+
+def single_flight(timeout: float = 30.0):
+    """Decorator for "show_*" methods: concurrent identical requests wait for one computation and share its response.
+
+    Key is the same as for cached_response, it can be put under this decorator to keep the response a bit longer.
+    Only responses sent by return_content are shared, the rest compute their own. Waiting requests get the error
+    of the computation too, waiting longer than "timeout" seconds gets 503.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = self.response_key()
+            flight, leader = self.single_flights.join(key)
+            if leader:
+                self._single_flight = flight  # return_content lands it as soon as the response is known
+                try:
+                    return method(self, *args, **kwargs)
+                except BaseException as exc:
+                    flight.error = exc
+                    raise
+                finally:
+                    self._single_flight = None
+                    self.single_flights.land(key, flight)
+
+            if not flight.landed.wait(timeout):
+                raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "timed out waiting for the same request")
+            if isinstance(flight.error, HTTPError):
+                raise HTTPError(flight.error.status, flight.error.message)
+            if flight.error is not None:
+                raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, f"the same request has failed: {flight.error}")
+            if flight.response is None:  # streamed, redirected and so on
+                return method(self, *args, **kwargs)
+            return self.return_content(*flight.response)
+
+        return wrapper
+
+    return decorator
+
+
+def route_label(route: str) -> str:
+    # /job/12/log -> /job/{id}/log: one label for all ids, so the number of metrics stays bounded
+    return _ID_SEGMENT.sub("/{id}", route)
+
+
+def prometheus_labels(**labels) -> str:
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class RouteMetrics:
+    __slots__ = ("statuses", "bytes_sent", "latency_counts", "latency_sum")
+
+    def __init__(self, buckets_number: int) -> None:
+        self.statuses: Dict[int, int] = {}
+        self.bytes_sent = 0
+        self.latency_counts = [0] * (buckets_number + 1)  # the last one is for +Inf
+        self.latency_sum = 0.0
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values())
+
+    def quantile(self, buckets: Tuple[float, ...], level: float) -> float:
+        # upper bound of bucket with requested quantile, good enough for fixed buckets
+        rank = level * self.requests
+        total = 0
+        for bound, count in zip(buckets + (float("inf"),), self.latency_counts):
+            total += count
+            if total >= rank and total:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """Counters of requests per method and route: statuses, bytes sent and latency histogram.
+
+    Recording takes one short lock, so it is safe for ThreadingHTTPServer and costs about a microsecond.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = _LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.in_flight = 0
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._lock = threading.Lock()
+
+    def started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, method: str, route: str, status: int, bytes_sent: int, latency: float) -> None:
+        index = bisect.bisect_left(self.buckets, latency)
+        with self._lock:
+            self.in_flight -= 1
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics(len(self.buckets))
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.bytes_sent += bytes_sent
+            metrics.latency_counts[index] += 1
+            metrics.latency_sum += latency
+
+    def snapshot(self) -> Dict[Tuple[str, str], RouteMetrics]:
+        with self._lock:
+            result = {}
+            for key, metrics in self._routes.items():
+                copied = RouteMetrics(len(self.buckets))
+                copied.statuses = dict(metrics.statuses)
+                copied.bytes_sent = metrics.bytes_sent
+                copied.latency_counts = list(metrics.latency_counts)
+                copied.latency_sum = metrics.latency_sum
+                result[key] = copied
+            return result
+
+    def as_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        snapshot = sorted(self.snapshot().items())
+        lines = [
+            "# HELP http_requests_in_flight Requests being processed now.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_total Processed requests.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in snapshot:
+            for status, count in sorted(metrics.statuses.items()):
+                labels = prometheus_labels(method=method, route=route, status=status)
+                lines.append(f"http_requests_total{labels} {count}")
+        lines += [
+            "# HELP http_response_bytes_total Bytes of response bodies.",
+            "# TYPE http_response_bytes_total counter",
+        ]
+        for (method, route), metrics in snapshot:
+            labels = prometheus_labels(method=method, route=route)
+            lines.append(f"http_response_bytes_total{labels} {metrics.bytes_sent}")
+        lines += [
+            "# HELP http_request_duration_seconds Time from request line to the end of response.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), metrics in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), metrics.latency_counts):
+                cumulative += count
+                labels = prometheus_labels(method=method, route=route, le="+Inf" if bound == float("inf") else bound)
+                lines.append(f"http_request_duration_seconds_bucket{labels} {cumulative}")
+            labels = prometheus_labels(method=method, route=route)
+            lines.append(f"http_request_duration_seconds_sum{labels} {metrics.latency_sum}")
+            lines.append(f"http_request_duration_seconds_count{labels} {cumulative}")
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def as_document(self, gauges: Optional[Dict[str, float]] = None) -> with_html_stack.HTMLDocument:
+        doc = with_html_stack.HTMLDocument()
+        with doc("html", lang="en"):
+            with doc("head"):
+                doc("title", "Server metrics")
+                doc("meta", _http_equiv="Content-type", content="text/html; charset=utf-8")
+                with doc("style"):
+                    doc.raw("table, td, th {border: 1px solid gray; border-collapse: collapse;}")
+            with doc("body"):
+                with doc("p"):
+                    doc("a", "Go to start page", href="/")
+                doc("p", f"Requests in flight: {self.in_flight}")
+                with doc("table"):
+                    doc("caption", "Requests")
+                    with doc("tr"):
+                        columns = ("method", "route", "requests", "statuses", "bytes", "mean, s", "p50, s", "p99, s")
+                        for column in columns:
+                            doc("th", column)
+                    for (method, route), metrics in sorted(self.snapshot().items()):
+                        with doc("tr"):
+                            doc("td", html.escape(method))
+                            doc("td", html.escape(route))
+                            doc("td", str(metrics.requests))
+                            doc("td", ", ".join(f"{k}: {v}" for k, v in sorted(metrics.statuses.items())))
+                            doc("td", str(metrics.bytes_sent))
+                            doc("td", "{:.4f}".format(metrics.latency_sum / max(metrics.requests, 1)))
+                            doc("td", "&le; {}".format(metrics.quantile(self.buckets, 0.5)))
+                            doc("td", "&le; {}".format(metrics.quantile(self.buckets, 0.99)))
+                if gauges:
+                    with doc("table"):
+                        doc("caption", "Other")
+                        for name, value in gauges.items():
+                            with doc("tr"):
+                                doc("td", name)
+                                doc("td", str(value))
+        return doc
+
+
+class AccessLog:
+    """Records of requests as JSON lines, written by a background thread in batches.
+
+    Handler threads only put a record in a bounded queue, so a slow disk or pipe does not add to latency.
+    When the queue is full new records are dropped and counted in "dropped".
+    The file is rotated by size: "path" becomes "path.1", "path.1" becomes "path.2" and so on up to "backups".
+    Without "path" records go to stderr.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_records: int = 10000,
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 3,
+        flush_interval: float = 0.5,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval  # the longest delay of a record
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(max_records)
+        self._stream: TextIO = open(path, "a", encoding="UTF-8") if path is not None else sys.stderr
+        self._writer = threading.Thread(target=self._write_forever, name="access-log", daemon=True)
+        self._writer.start()
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def add(self, record: dict) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self) -> None:
+        # writes what is queued already
+        self._queue.put(None)
+        self._writer.join()
+        if self.path is not None:
+            self._stream.close()
+
+    def _write_forever(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < _ACCESS_LOG_BATCH:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            lines = [json.dumps(x, ensure_ascii=False) + "\n" for x in batch if x is not None]
+            if lines:
+                try:
+                    self._stream.write("".join(lines))
+                    self._stream.flush()
+                    self._rotate()
+                except OSError:  # full disk and so on: nowhere to report, count as dropped
+                    with self._dropped_lock:
+                        self.dropped += len(lines)
+            if closing:
+                return
+
+    def _rotate(self) -> None:
+        if self.path is None or self._stream.tell() < self.max_bytes:
+            return
+        self._stream.close()
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{number}"):
+                os.replace(f"{self.path}.{number}", f"{self.path}.{number + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+        self._stream = open(self.path, "a", encoding="UTF-8")
+
+
+class HTTPError(Exception):
+    """Raise it from "show_*" methods to answer with an error status instead of 500."""
+
+    def __init__(self, status: HTTPStatus, message: Optional[str] = None, headers: Optional[dict] = None) -> None:
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message
+        self.headers = headers  # like Retry-After, sent only if the error is answered by PreHandler itself
+
+
+class Admission:
+    """Rate limits per client and route and fair sharing of busy handlers between clients, see PreHandler.admission.
+
+    Every client may send "rate" requests per second with bursts up to "burst" (token bucket), "routes" adds
+    limits of a client on single routes: {"/sleep": (rate, burst)}. Requests over a limit get 429 with Retry-After.
+    With "max_active" at most that many requests are handled at once. The rest wait in a queue per client
+    (at most "max_waiting" each, 429 over it) and free slots go to the clients in turn, so a busy poller
+    delays the others by its share only. Waiting longer than "timeout" seconds gets 503.
+    A check takes one short lock, like Metrics, waiting happens outside of it.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        routes: Optional[Dict[str, Tuple[float, float]]] = None,
+        max_active: Optional[int] = None,
+        max_waiting: int = 16,
+        timeout: float = 10.0,
+        max_clients: int = 10000,
+    ) -> None:
+        self.rate = rate  # None means no limit per client
+        self.burst = burst if burst is not None else max(rate or 1.0, 1.0)
+        self.routes = routes or {}
+        self.max_active = max_active  # None means no queue
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.max_clients = max_clients  # buckets kept, full ones are forgotten first
+        self.active = 0
+        self.waiting = 0
+        self.limited = 0  # 429 by rate limits
+        self.rejected = 0  # 429 by a full queue of the client and 503 by waiting too long
+        # key -> [tokens, time of update, rate, burst]
+        self._buckets: Dict[Hashable, List[float]] = {}
+        self._queues: "OrderedDict[Hashable, Deque[threading.Event]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def clients(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, client: Hashable, route: str) -> bool:
+        """Raise HTTPError if the request is not admitted, True if it has taken a slot and has to release it."""
+        limits: List[Tuple[Hashable, float, float]] = []
+        if self.rate is not None:
+            limits.append((client, self.rate, self.burst))
+        if route in self.routes:
+            rate, burst = self.routes[route]
+            limits.append(((client, route), rate, burst))
+        now = time.monotonic()
+        with self._lock:
+            wait = self._take(limits, now) if limits else 0.0
+            if wait:
+                self.limited += 1
+            elif self.max_active is None:
+                return False
+            elif self.active < self.max_active and not self._queues:
+                self.active += 1
+                return True
+            else:
+                waiters = self._queues.setdefault(client, deque())
+                if len(waiters) >= self.max_waiting:
+                    self.rejected += 1
+                    wait = 1.0
+                else:
+                    turn = threading.Event()
+                    waiters.append(turn)
+                    self.waiting += 1
+        if wait:
+            retry_after = str(max(math.ceil(wait), 1))
+            raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, f"retry after {retry_after} s", {"Retry-After": retry_after})
+
+        if turn.wait(self.timeout):
+            return True
+        with self._lock:
+            if turn.is_set():  # the slot has been given right after the timeout
+                return True
+            waiters.remove(turn)
+            if not waiters and self._queues.get(client) is waiters:
+                del self._queues[client]
+            self.waiting -= 1
+            self.rejected += 1
+        retry_after = str(max(math.ceil(self.timeout), 1))
+        raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "server is busy", {"Retry-After": retry_after})
+
+    def release(self) -> None:
+        # the slot goes straight to the first waiting request of the next client, so nobody can overtake it
+        with self._lock:
+            if not self._queues:
+                self.active -= 1
+                return
+            client, waiters = next(iter(self._queues.items()))
+            turn = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self.waiting -= 1
+            turn.set()
+
+    def _take(self, limits: List[Tuple[Hashable, float, float]], now: float) -> float:
+        # takes a token from every bucket or nothing, returns seconds until all of them have one
+        buckets = []
+        wait = 0.0
+        for key, rate, burst in limits:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_clients:
+                    self._forget(now)
+                bucket = self._buckets[key] = [burst, now, rate, burst]
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                wait = max(wait, (1 - bucket[0]) / rate)
+            buckets.append(bucket)
+        if not wait:
+            for bucket in buckets:
+                bucket[0] -= 1
+        return wait
+
+    def _forget(self, now: float) -> None:
+        # a full bucket is the same as no bucket, if all of them are in use start from scratch
+        for key, (tokens, updated, rate, burst) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+        if len(self._buckets) >= self.max_clients:
+            self._buckets.clear()
 
 
 class PreHandler(BaseHTTPRequestHandler):
+    max_body_size: Optional[int] = _MAX_BODY_SIZE  # None means no limit
+    # Content-Encoding in order of preference, empty tuple switches compression off.
+    compress_encodings: Tuple[str, ...] = ("br", "gzip", "deflate") if brotli is not None else ("gzip", "deflate")
+    compress_min_size: int = 1024  # smaller responses are not worth compression
+    compress_level: int = 6
+    # Compressed copies of responses by hash of content: the same page is not compressed twice.
+    compress_cache = LRUCache(32 * 1024 * 1024)
+    use_etag: bool = True  # answer 304 to GET with matching If-None-Match
+    response_cache = ResponseCache(32 * 1024 * 1024)  # see cached_response
+    _response_cache_key: Optional[tuple] = None
+    single_flights = SingleFlight()  # see single_flight
+    _single_flight: Optional[Flight] = None
+    metrics = Metrics()  # shared by all handlers of the process, see return_metrics
+    access_log: Optional[AccessLog] = None  # None means synchronous lines to stderr of BaseHTTPRequestHandler
+    admission: Optional[Admission] = None  # None means no rate limits and no queue
+
+    def handle_one_request(self) -> None:
+        self.response_status: Optional[int] = None
+        self.bytes_sent = 0
+        self.request_started: Optional[float] = None
+        self.admitted = False  # True while the request holds a slot of admission
+        try:
+            super().handle_one_request()
+        except HTTPError as exc:
+            self.close_connection = True  # some part of request body may be left unread
+            if self.response_status is None and exc.headers:
+                content = (exc.message or exc.status.phrase).encode("UTF-8") + b"\n"
+                self.return_content(exc.status, "text/plain; charset=utf-8", content, exc.headers)
+            elif self.response_status is None:
+                self.send_error(exc.status, exc.message)
+        finally:
+            if self.admitted and self.admission is not None:
+                self.admission.release()
+            if self.request_started is not None:
+                self.request_finished()
+
+    def parse_request(self) -> bool:
+        # called when request line is already read, so waiting for a keep-alive request is not counted
+        self.request_started = time.perf_counter()
+        self.metrics.started()
+        if not super().parse_request():
+            return False
+        if self.admission is not None:  # time in the queue is a part of latency
+            self.admitted = self.admission.acquire(self.client_key(), self.route)
+        return True
+
+    def client_key(self) -> Hashable:
+        # who is limited and queued by admission: override it behind a proxy, for example to use X-Forwarded-For
+        return self.client_address[0]
+
+    def request_finished(self) -> None:
+        status = self.response_status or HTTPStatus.INTERNAL_SERVER_ERROR
+        path = getattr(self, "path", None)  # not set if the request line is malformed
+        route = self.metrics_route() if path is not None and status != HTTPStatus.NOT_FOUND else _UNKNOWN_ROUTE
+        latency = time.perf_counter() - (self.request_started or 0.0)
+        self.metrics.finished(self.command or "", route, int(status), self.bytes_sent, latency)
+        if self.access_log is not None:
+            self.access_log.add(
+                {
+                    "time": time.time(),
+                    "client": self.client_address[0],
+                    "method": self.command,
+                    "path": path or "",
+                    "status": int(status),
+                    "bytes": self.bytes_sent,
+                    "latency": round(latency, 6),
+                    "thread": threading.current_thread().name,
+                }
+            )
+
+    def metrics_route(self) -> str:
+        # route label of the request in metrics, override it if ids in paths of the handler are not numbers or hashes
+        return route_label(self.route)
+
+    def log_request(self, code="-", size="-") -> None:
+        # with access_log the record is added by request_finished, when bytes and latency are known
+        if self.access_log is None:
+            super().log_request(code, size)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        if self.access_log is None:
+            super().log_message(format, *args)
+            return
+        self.access_log.add(
+            {
+                "time": time.time(),
+                "client": self.client_address[0],
+                "message": format % args,
+                "thread": threading.current_thread().name,
+            }
+        )
+
+    def send_response(self, code, message=None) -> None:
+        self.response_status = code
+        super().send_response(code, message)
+
+    def write(self, data: bytes) -> None:
+        self.bytes_sent += len(data)
+        self.wfile.write(data)
+
     def return_content(
         self,
         status: HTTPStatus,
@@ -12,6 +879,41 @@ class PreHandler(BaseHTTPRequestHandler):
         content: bytes,
         headers: Optional[dict] = None,
     ) -> None:
+        if self._response_cache_key is not None:
+            key, ttl = self._response_cache_key
+            self._response_cache_key = None
+            if status == HTTPStatus.OK:
+                self.response_cache.put(key, (status, content_type, content, headers), ttl)
+        if self._single_flight is not None:
+            # waiting requests are sent the response at the same time as this one
+            self._single_flight.response = (status, content_type, content, headers)
+            self._single_flight.landed.set()
+            self._single_flight = None
+
+        with_etag = (
+            self.use_etag
+            and status == HTTPStatus.OK
+            and self.command in ("GET", "HEAD")
+            and (headers is None or "ETag" not in headers)
+        )
+        digest = content_digest(content) if with_etag or len(content) >= self.compress_min_size else None
+
+        if headers is None or "Content-Encoding" not in headers:
+            content, headers = self.compress_content(content_type, content, headers, digest)
+
+        if with_etag and digest is not None:
+            # strong ETag must differ for every representation, so encoding is a part of it
+            headers = dict(headers or {})
+            encoding = headers.get("Content-Encoding")
+            headers["ETag"] = '"' + digest.hex() + ("-" + encoding if encoding else "") + '"'
+            if etag_matches(self.headers["If-None-Match"], headers["ETag"]):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                for key in ("ETag", "Vary", "Cache-Control"):
+                    if key in headers:
+                        self.send_header(key, headers[key])
+                self.end_headers()
+                return
+
         self.send_response(status)
         self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(content)))
@@ -21,14 +923,278 @@ class PreHandler(BaseHTTPRequestHandler):
                 self.send_header(key, value)
         self.end_headers()
 
-        self.wfile.write(content)
+        self.write(content)
+
+    def choose_encoding(self, content_type: str) -> Optional[str]:
+        if not content_type.startswith(_COMPRESSIBLE_TYPES):
+            return None
+        accepted = parse_accept_encoding(self.headers["Accept-Encoding"])
+        default = accepted.get("*", 0.0)
+        best, best_quality = None, 0.0
+        for encoding in self.compress_encodings:
+            quality = accepted.get(encoding, default)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress_content(
+        self, content_type: str, content: bytes, headers: Optional[dict], digest: Optional[bytes] = None
+    ) -> Tuple[bytes, Optional[dict]]:
+        if not self.compress_encodings or not content_type.startswith(_COMPRESSIBLE_TYPES):
+            return content, headers
+        headers = dict(headers or {})
+        headers.setdefault("Vary", "Accept-Encoding")
+
+        encoding = self.choose_encoding(content_type) if len(content) >= self.compress_min_size else None
+        if encoding is None:
+            return content, headers
+
+        key = (encoding, self.compress_level, digest or content_digest(content))
+        compressed = self.compress_cache.get(key)
+        if compressed is None:
+            compressed = compress(content, encoding, self.compress_level)
+            self.compress_cache.put(key, compressed, len(compressed))
+        if len(compressed) >= len(content):
+            return content, headers
+        headers["Content-Encoding"] = encoding
+        return compressed, headers
+
+    def return_stream(
+        self,
+        status: HTTPStatus,
+        content_type: str,
+        chunks: Iterable[bytes],
+        headers: Optional[dict] = None,
+        flush: bool = False,
+    ) -> None:
+        # Chunked transfer encoding exists since HTTP/1.1 only,
+        # otherwise the end of the body is marked by closing the connection.
+        chunked = self.protocol_version == "HTTP/1.1" and self.request_version == "HTTP/1.1"
+
+        if self.compress_encodings and content_type.startswith(_COMPRESSIBLE_TYPES):
+            headers = dict(headers or {})
+            headers.setdefault("Vary", "Accept-Encoding")
+            encoding = None if "Content-Encoding" in headers else self.choose_encoding(content_type)
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+                chunks = compress_chunks(chunks, encoding, self.compress_level, flush)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+
+        if headers is not None:
+            for key, value in headers.items():
+                self.send_header(key, value)
+        self.end_headers()
+
+        for chunk in chunks:
+            if not chunk:
+                continue  # empty chunk means end of body in chunked encoding
+            if chunked:
+                self.wfile.write(b"%x\r\n" % len(chunk))
+                self.write(chunk)
+                self.wfile.write(b"\r\n")
+            else:
+                self.write(chunk)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def return_file(self, path: str, content_type: Optional[str] = None, headers: Optional[dict] = None) -> None:
+        """Send a file without reading it into memory.
+
+        Answers Range with 206, If-None-Match and If-Modified-Since with 304 and HEAD without the body.
+        """
+        try:
+            file = open(path, "rb")
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError) as error:
+            raise HTTPError(HTTPStatus.NOT_FOUND) from error
+        with file:
+            stat = os.fstat(file.fileno())
+            size = stat.st_size
+            headers = dict(headers or {})
+            headers.setdefault("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+            headers.setdefault("Accept-Ranges", "bytes")
+            if self.use_etag:
+                headers.setdefault("ETag", f'"{stat.st_mtime_ns:x}-{size:x}"')
+
+            # If-None-Match takes precedence over If-Modified-Since
+            if_none_match = self.headers["If-None-Match"]
+            if (
+                etag_matches(if_none_match, headers["ETag"])
+                if if_none_match and "ETag" in headers
+                else not if_none_match and not modified_since(self.headers["If-Modified-Since"], stat.st_mtime)
+            ):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                for key in ("ETag", "Last-Modified", "Cache-Control"):
+                    if key in headers:
+                        self.send_header(key, headers[key])
+                self.end_headers()
+                return
+
+            status, start, end = HTTPStatus.OK, 0, size
+            # If-Range: the range is valid for the same version of the file only, otherwise send the whole file
+            if_range = self.headers["If-Range"]
+            if if_range is None or if_range in (headers.get("ETag"), headers["Last-Modified"]):
+                try:
+                    requested = parse_range(self.headers["Range"], size)
+                except ValueError:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if requested is not None:
+                    status, (start, end) = HTTPStatus.PARTIAL_CONTENT, requested
+                    headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+
+            content_type = content_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(end - start))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                self.send_file(file, start, end - start)
+
+    def send_file(self, file: BinaryIO, offset: int, count: int) -> None:
+        if count == 0:  # socket.sendfile takes 0 as "up to the end of file" and raises ValueError for it
+            return
+        self.wfile.flush()
+        sendfile = getattr(self.connection, "sendfile", None)
+        if sendfile is not None:
+            # socket.sendfile is os.sendfile, it copies by blocks itself for sockets without sendfile (TLS)
+            sent = sendfile(file, offset, count)
+        else:
+            sent = 0
+            file.seek(offset)
+            while sent < count:
+                block = file.read(min(count - sent, _STREAM_CHUNK_SIZE))
+                if not block:
+                    break
+                self.wfile.write(block)
+                sent += len(block)
+        self.bytes_sent += sent
+        if sent < count:  # the file is truncated meanwhile, Content-Length is wrong already
+            self.close_connection = True
+
+    def return_redirect(self, location: str, status: HTTPStatus = HTTPStatus.SEE_OTHER) -> None:
+        # 303 after POST: the browser shows the result by GET, so reloading the page does not repeat the action
+        self.send_response(status)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def metrics_gauges(self) -> Dict[str, float]:
+        # current values shown by return_metrics besides request counters, extend it in subclasses
+        gauges: Dict[str, float] = {
+            "http_response_cache_hits": self.response_cache.hits,
+            "http_response_cache_misses": self.response_cache.misses,
+            "http_response_cache_bytes": self.response_cache.lru.size,
+            "http_compress_cache_hits": self.compress_cache.hits,
+            "http_compress_cache_misses": self.compress_cache.misses,
+            "http_compress_cache_bytes": self.compress_cache.size,
+            "http_single_flight_leaders": self.single_flights.leaders,
+            "http_single_flight_followers": self.single_flights.followers,
+        }
+        if self.admission is not None:
+            gauges["http_admission_active"] = self.admission.active
+            gauges["http_admission_waiting"] = self.admission.waiting
+            gauges["http_admission_limited"] = self.admission.limited
+            gauges["http_admission_rejected"] = self.admission.rejected
+            gauges["http_admission_clients"] = self.admission.clients
+        if self.access_log is not None:
+            gauges["http_access_log_queued"] = self.access_log.queued
+            gauges["http_access_log_dropped"] = self.access_log.dropped
+        return gauges
+
+    def return_metrics(self) -> None:
+        # Prometheus text format for scrapers, HTML page for browsers
+        gauges = self.metrics_gauges()
+        if "text/html" in (self.headers["Accept"] or ""):
+            content = self.metrics.as_document(gauges).content(with_html_stack.DEV_PARAMS)
+            self.return_content(HTTPStatus.OK, "text/html", content, {"Cache-Control": "no-cache"})
+        else:
+            content = self.metrics.as_prometheus(gauges).encode("UTF-8")
+            self.return_content(HTTPStatus.OK, "text/plain; version=0.0.4", content, {"Cache-Control": "no-cache"})
+
+    @property
+    def is_chunked(self) -> bool:
+        return "chunked" in (self.headers["Transfer-Encoding"] or "").lower()
 
     def read_data(self) -> Optional[bytes]:
-        data_size = self.headers["Content-Length"]
-        if data_size:
-            return self.rfile.read(int(data_size))
+        if self.headers["Content-Length"] or self.is_chunked:
+            return b"".join(self.iter_body())
         return None
 
+    def iter_body(self, chunk_size: int = _STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        # Request body by pieces of at most "chunk_size" bytes, use it to process big uploads in constant memory.
+        chunks = self._iter_chunked(chunk_size) if self.is_chunked else self._iter_sized(chunk_size)
+        received = 0
+        for chunk in chunks:
+            received += len(chunk)
+            if self.max_body_size is not None and received > self.max_body_size:
+                raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"body is larger than {self.max_body_size} bytes")
+            yield chunk
+
+    def iter_lines(self, chunk_size: int = _STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        pending: List[bytes] = []
+        for chunk in self.iter_body(chunk_size):
+            start = 0
+            end = chunk.find(b"\n")
+            while end >= 0:
+                pending.append(chunk[start:end])
+                yield b"".join(pending)
+                pending.clear()
+                start = end + 1
+                end = chunk.find(b"\n", start)
+            if start < len(chunk):
+                pending.append(chunk[start:])
+        if pending:
+            yield b"".join(pending)
+
+    def _iter_sized(self, chunk_size: int) -> Iterator[bytes]:
+        try:
+            remaining = int(self.headers["Content-Length"] or 0)
+        except ValueError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "bad Content-Length") from exc
+        if remaining < 0:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "bad Content-Length")
+        if self.max_body_size is not None and remaining > self.max_body_size:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"body is larger than {self.max_body_size} bytes")
+        yield from self._iter_exactly(remaining, chunk_size)
+
+    def _iter_chunked(self, chunk_size: int) -> Iterator[bytes]:
+        while True:
+            line = self.rfile.readline(_MAX_LINE_SIZE)
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError as exc:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "bad chunk size") from exc
+            if size < 0:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "bad chunk size")
+            if size == 0:
+                break
+            yield from self._iter_exactly(size, chunk_size)
+            if self.rfile.readline(_MAX_LINE_SIZE).strip():
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "chunk is longer than its size")
+        # skip trailer fields up to the empty line
+        while self.rfile.readline(_MAX_LINE_SIZE).strip():
+            pass
+
+    def _iter_exactly(self, size: int, chunk_size: int) -> Iterator[bytes]:
+        while size > 0:
+            chunk = self.rfile.read(min(size, chunk_size))
+            if not chunk:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "body is shorter than declared")
+            size -= len(chunk)
+            yield chunk
+
     @property
     def host(self) -> str:
         host = self.headers["Host"]
@@ -36,14 +1202,218 @@ class PreHandler(BaseHTTPRequestHandler):
             host = self.protocol_version.rsplit("/", 1)[0].lower() + "://" + host
         return host
 
+    def cache_variant(self) -> Hashable:
+        # part of response_cache key: whatever else (except path and query) changes the response
+        return None
+
+    def response_key(self) -> Hashable:
+        # the same key means the same response, see cached_response and single_flight
+        query = tuple(sorted(parse_qsl(urlsplit(self.path).query, True)))
+        return (self.command, self.route, query, self.cache_variant())
+
+    @property
+    def route(self) -> str:
+        # path without query string, use it to select "show_*" method
+        return urlsplit(self.path).path
+
+    @property
+    def query(self) -> Dict[str, List[str]]:
+        return parse_qs(urlsplit(self.path).query, keep_blank_values=True)
+
 
 class JSONHandler(PreHandler):
+    def wants_pretty_json(self) -> bool:
+        # explicit "?pretty=1" or "?pretty=0" wins,
+        # otherwise pretty print for browsers only: they ask for HTML navigating to the link
+        pretty = self.query.get("pretty")
+        if pretty:
+            return pretty[-1].lower() not in _FALSE_VALUES
+        return "text/html" in (self.headers["Accept"] or "")
+
+    def cache_variant(self) -> Hashable:
+        return self.wants_pretty_json()
+
     def return_json(self, status: HTTPStatus, obj: dict) -> None:
-        content = json.dumps(obj, indent=2, sort_keys=True, ensure_ascii=False).encode("UTF-8")
+        content = dump_json(obj, pretty=self.wants_pretty_json())
         self.return_content(status, "application/json", content)
 
+    def return_json_stream(self, status: HTTPStatus, obj) -> None:
+        # For really big objects: the whole text is never kept in memory.
+        if self.wants_pretty_json():
+            encoder = json.JSONEncoder(indent=2, sort_keys=True, ensure_ascii=False)
+        else:
+            encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+        self.return_stream(status, "application/json", encode_chunks(encoder.iterencode(obj)))
+
     def read_json(self):
         data = self.read_data()
         if data is not None:
             return json.loads(data)
         return None
+
+    def read_json_lines(self) -> Iterator:
+        # Objects one by one from "application/x-ndjson" body, empty lines are skipped.
+        for line in self.iter_lines():
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, f"bad JSON line: {exc}") from exc
+
+
+def load_handler(spec: str) -> type:
+    # "module:Class" -> the class
+    module_name, _, class_name = spec.partition(":")
+    handler = functools.reduce(getattr, class_name.split("."), importlib.import_module(module_name))
+    if not isinstance(handler, type):
+        raise RuntimeError(f"{spec} is not a class")
+    return handler
+
+
+class Server(ThreadingHTTPServer):
+    """ThreadingHTTPServer which knows its requests in progress, so it can stop without dropping them, see serve."""
+
+    RequestHandlerClass: type  # always a class here, serve passes it to "configure" and "on_stop"
+
+    def __init__(self, address: Tuple[str, int], handler: type, listen_fd: Optional[int] = None) -> None:
+        super().__init__(address, handler, bind_and_activate=listen_fd is None)
+        if listen_fd is not None:  # inherited from the previous process, already listening
+            self.socket.close()
+            self.socket = socket.socket(fileno=listen_fd)
+            host, port = self.socket.getsockname()[:2]
+            self.server_address = (host, port)
+            self.server_name = socket.getfqdn(host)
+            self.server_port = port
+        self.handler_spec = f"{handler.__module__}:{handler.__qualname__}"  # for reload
+        self.configure: Optional[Callable[[type], None]] = None  # called for every (re)loaded handler
+        self.active = 0  # accepted connections not finished yet
+        self.upgraded = False  # a new process has taken the socket over, see upgrade
+        self._idle = threading.Condition()
+
+    def process_request(self, request, client_address) -> None:
+        # counted before the thread starts: drain never misses an accepted connection
+        with self._idle:
+            self.active += 1
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._finished()
+            raise
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._finished()
+
+    def _finished(self) -> None:
+        with self._idle:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for accepted connections to finish, False if some are still going on after "timeout" seconds."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.active == 0, timeout)
+
+    def reload(self) -> type:
+        """Import the module of the handler again, new requests go to the new class, running ones finish as they are."""
+        module_name = self.handler_spec.partition(":")[0]
+        if module_name == "__main__":
+            raise RuntimeError("handler of __main__ cannot be imported again, pass it to serve as 'module:Class'")
+        if module_name in sys.modules:
+            importlib.reload(sys.modules[module_name])
+        handler = load_handler(self.handler_spec)
+        if self.configure is not None:
+            self.configure(handler)
+        self.RequestHandlerClass = handler
+        return handler
+
+    def upgrade(self, timeout: float = 30.0) -> bool:
+        """Start the same command again with the listening socket, True when the new process is ready to accept."""
+        listen_fd = self.socket.fileno()
+        ready_read, ready_write = os.pipe()
+        env = dict(os.environ)
+        env.update({_LISTEN_FD_ENV: str(listen_fd), _READY_FD_ENV: str(ready_write)})
+        try:
+            process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(listen_fd, ready_write))
+        finally:
+            os.close(ready_write)
+        try:
+            # end of file without "ready" if the new process has failed to start
+            ready = bool(select.select([ready_read], [], [], timeout)[0]) and os.read(ready_read, 16) == b"ready"
+        finally:
+            os.close(ready_read)
+        if not ready:
+            process.kill()
+            process.wait()
+        return ready
+
+
+def serve(
+    handler: Union[str, type],
+    address: Tuple[str, int],
+    drain_timeout: float = 30.0,
+    configure: Optional[Callable[[type], None]] = None,
+    on_stop: Optional[Callable[[type], None]] = None,
+) -> Server:
+    """Serve until SIGTERM or Ctrl+C, then finish requests in progress (at most "drain_timeout" seconds).
+
+    "handler" is "module:Class" or the class. SIGHUP imports the module again: new requests go to the new class.
+    SIGUSR2 starts the same command again, the new process inherits the listening socket; once it is ready
+    this one stops accepting, finishes its requests and exits. Connections are not refused meanwhile:
+    they wait in the backlog of the socket shared by both processes.
+    "configure" is called for the handler class after every import, "on_stop" when accepting has stopped.
+    Returns the server: its RequestHandlerClass is the handler in use at the end, "upgraded" is True
+    if a new process serves now, so work of this one (like running jobs) should be finished, not cancelled.
+    """
+    listen_fd = os.environ.pop(_LISTEN_FD_ENV, None)
+    ready_fd = os.environ.pop(_READY_FD_ENV, None)
+    handler_class = load_handler(handler) if isinstance(handler, str) else handler
+    if configure is not None:
+        configure(handler_class)
+    httpd = Server(address, handler_class, int(listen_fd) if listen_fd is not None else None)
+    if isinstance(handler, str):
+        httpd.handler_spec = handler  # the module may be __main__ as well, but it is imported by name
+    httpd.configure = configure
+
+    actions: "queue.Queue[str]" = queue.Queue()
+    previous = {}  # handlers of signals before serve, back after it: nobody takes actions when it has returned
+    if threading.current_thread() is threading.main_thread():
+        for signum, action in ((signal.SIGHUP, "reload"), (signal.SIGUSR2, "upgrade"), (signal.SIGTERM, "stop")):
+            previous[signum] = signal.signal(signum, lambda *_, action=action: actions.put(action))
+
+    def control() -> None:
+        # signal handlers only put actions: serve_forever cannot be shut down from its own thread
+        while True:
+            action = actions.get()
+            if action == "reload":
+                try:
+                    httpd.reload()
+                    print(f"Reloaded {httpd.handler_spec}", file=sys.stderr)
+                except Exception as exc:  # pylint: disable=broad-except
+                    print(f"Not reloaded, the old handler is kept: {exc!r}", file=sys.stderr)
+            elif action == "upgrade" and not httpd.upgrade():
+                print("New process has not started, this one goes on", file=sys.stderr)
+            else:
+                httpd.upgraded = action == "upgrade"
+                httpd.shutdown()
+                return
+
+    threading.Thread(target=control, name="serve control", daemon=True).start()
+    if ready_fd is not None:
+        os.write(int(ready_fd), b"ready")
+        os.close(int(ready_fd))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for signum, signal_handler in previous.items():
+        signal.signal(signum, signal_handler)
+    if on_stop is not None:
+        on_stop(httpd.RequestHandlerClass)
+    if not httpd.drain(drain_timeout):
+        print(f"{httpd.active} connections are dropped after {drain_timeout} s", file=sys.stderr)
+    httpd.server_close()
+    return httpd
@@ -44,6 +44,9 @@ day() {
 make_my_day() {
     [ "$1" == "--help" ] && _help_and_exit "run in parallel: make, my, day" || true
     [ "$1" == "--deps" ] && _deps_and_exit "make" "my" "day" || true
+    [ "$1" == "--resources" ] && _resources_and_exit "cpu=3" || true
+    # "run" has run the dependencies already
+    [ -n "${SKELETON_RUNNER:-}" ] && return 0 || true
 
     make &
     my &
@@ -51,6 +54,15 @@ make_my_day() {
     wait
 }
 
+dependency_graph() {
+    [ "$1" == "--help" ] && _help_and_exit "save dependency graph to dependency_graph.dot (skipped by \"run\" if up to date)" || true
+    [ "$1" == "--deps" ] && return 0 || true
+    [ "$1" == "--inputs" ] && _inputs_and_exit "$SELFNAME" || true
+    [ "$1" == "--outputs" ] && _outputs_and_exit "dependency_graph.dot" || true
+
+    _make_dot_file > dependency_graph.dot
+}
+
 _help_and_exit() {
     printf "%-20s %s\n" "${FUNCNAME[1]}" "$1"
     exit 0
@@ -64,6 +76,21 @@ _deps_and_exit() {
     exit 0
 }
 
+_inputs_and_exit() {
+    printf "%s\n" "$@"
+    exit 0
+}
+
+_outputs_and_exit() {
+    printf "%s\n" "$@"
+    exit 0
+}
+
+_resources_and_exit() {
+    printf "%s\n" "$@"
+    exit 0
+}
+
 print_functions() {
     if [ "$1" == "--help" ]; then
         echo
@@ -78,16 +105,7 @@ print_hidden() {
     [ "$1" == "--help" ] && _help_and_exit "print internal functions names and functions names without help" || true
     [ "$1" == "--deps" ] && _deps_and_exit "print_functions" "usage" || true
 
-    local func_all
-    func_all="$(mktemp)"
-    "$SELFNAME" print_functions | sort > "$func_all"
-
-    local func_help
-    func_help="$(mktemp)"
-    "$SELFNAME" usage | awk '{print $1}' | sort > "$func_help"
-
-    comm -2 -3 "$func_all" "$func_help"
-    rm -f "$func_all" "$func_help"
+    comm -2 -3 <(print_functions | sort) <(usage | awk '{print $1}' | sort)
 }
 
 usage() {
@@ -95,11 +113,12 @@ usage() {
     [ "$1" == "--deps" ] && _deps_and_exit "print_functions" || true
 
     #   treat functions with names starting with "_" as internal functions and skip them
-    #   print help for each function
+    #   print help for each function: subshell is needed because of "exit" in _help_and_exit,
+    #   but unlike "$SELFNAME" it does not read and parse the script again
     print_functions |
         egrep -v '^_' |
         while read n; do
-            "$SELFNAME" "$n" --help
+            ( "$n" --help )
         done
 }
 
@@ -109,7 +128,7 @@ _make_dot_file() {
     print_functions |
         egrep -v '^_' |
         while read n; do
-            "$SELFNAME" "$n" --deps
+            ( "$n" --deps )
         done
     echo "}"
 }
@@ -121,6 +140,28 @@ svg() {
     _make_dot_file | dot -Tpng | feh --fullscreen -
 }
 
+metadata() {
+    [ "$1" == "--help" ] && _help_and_exit "print names, help lines and dependencies of all functions as JSON" || true
+    [ "$1" == "--deps" ] && return 0 || true
+
+    #   one pass over the text of the script instead of running it for every function
+    python3 "$(dirname "$SELFNAME")/skeleton_meta.py" "$SELFNAME"
+}
+
+run() {
+    [ "$1" == "--help" ] && _help_and_exit "run tasks after their dependencies, in parallel: run [-j N] task..." || true
+    [ "$1" == "--deps" ] && return 0 || true
+
+    python3 "$(dirname "$SELFNAME")/skeleton_runner.py" --script "$SELFNAME" "$@"
+}
+
+watch() {
+    [ "$1" == "--help" ] && _help_and_exit "run tasks again when skeleton.sh or their inputs change: watch [-j N] task..." || true
+    [ "$1" == "--deps" ] && return 0 || true
+
+    python3 "$(dirname "$SELFNAME")/skeleton_watch.py" --script "$SELFNAME" "$@"
+}
+
 if [ -z "$1" ] || [ "$1" == "--help" ]; then
     usage
 else
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Outputs of tasks shared between users: the cache is keyed by what the task depends on.
+
+The key is a hash of the task name, its function body, arguments, content of its inputs and results
+of its dependencies (see skeleton_state), so the same task with the same inputs has the same key on every host.
+Outputs are kept as tar.gz blobs in a directory (least recently used ones are removed when the total size
+is too big) or in a cache server, which is the same directory behind HTTP:
+
+    $ ./skeleton_artifacts.py --port 8200 --dir /var/cache/skeleton --max-size 10G
+    $ ./skeleton.sh run --artifacts http://cache-host:8200 dependency_graph
+    $ ./skeleton.sh run --artifacts ~/.cache/skeleton dependency_graph
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import tarfile
+import tempfile
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Union
+
+from skeleton import HTTPError, LRUCache, PreHandler
+from skeleton_meta import Function
+
+_KEY = re.compile(r"^[0-9a-f]{64}$")
+_BLOB_SUFFIX = ".tar.gz"
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+_DIGEST_HEADER = "X-Content-SHA256"  # checked by the server, so a broken upload is not shared
+
+
+def artifact_key(function: Function, record: dict, arguments: Iterable[str] = ()) -> str:
+    # "record" is skeleton_state.current_record: body, hashes of inputs and fingerprints of dependencies
+    source = {
+        "task": function.name,
+        "body": record["body"],
+        "inputs": record["inputs"],
+        "deps": record["deps"],
+        "arguments": list(arguments),
+    }
+    return hashlib.sha256(json.dumps(source, sort_keys=True).encode("UTF-8")).hexdigest()
+
+
+def is_cacheable(function: Function) -> bool:
+    # outputs are restored relative to the current directory
+    return bool(function.outputs) and all(
+        not os.path.isabs(x) and ".." not in os.path.normpath(x).split(os.sep) for x in function.outputs
+    )
+
+
+def pack(paths: List[str]) -> bytes:
+    blob = io.BytesIO()
+    with tarfile.open(fileobj=blob, mode="w:gz") as tar:
+        for path in paths:
+            tar.add(path)
+    return blob.getvalue()
+
+
+def unpack(blob: bytes, destination: str = ".") -> List[str]:
+    """Restore outputs, names are relative to "destination" and may not leave it."""
+    root = os.path.realpath(destination)
+    with tarfile.open(fileobj=io.BytesIO(blob), mode="r:gz") as tar:
+        members = tar.getmembers()
+        for member in members:
+            target = os.path.realpath(os.path.join(root, member.name))
+            if os.path.commonpath([root, target]) != root or not (member.isfile() or member.isdir()):
+                raise RuntimeError(f"unsafe member of artifact: {member.name}")
+        tar.extractall(root, members)
+    return [x.name for x in members]
+
+
+def parse_size(text: str) -> int:
+    # "1024", "512M", "10G"
+    match = re.match(r"^(\d+)([KMGT]?)$", text.strip().upper())
+    if match is None:
+        raise ValueError(f"bad size: {text}")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
+class DirectoryStore:
+    """Blobs in files named by key. The total size is limited, the least recently used blobs are removed.
+
+    The order of use is kept in memory and starts with modification times of the files,
+    which are updated on every read, so several processes sharing the directory agree roughly.
+    """
+
+    def __init__(self, path: str, max_size: int = 1024**3) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lru = LRUCache(max_size, on_evict=lambda key, blob_path: self._remove(str(blob_path)))
+        files = []
+        for name in os.listdir(path):
+            if name.endswith(_BLOB_SUFFIX) and _KEY.match(name[: -len(_BLOB_SUFFIX)]):
+                stat = os.stat(os.path.join(path, name))
+                files.append((stat.st_mtime, name[: -len(_BLOB_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self.lru.put(key, self.blob_path(key), size)
+
+    def blob_path(self, key: str) -> str:
+        return os.path.join(self.path, key + _BLOB_SUFFIX)
+
+    def find(self, key: str) -> Optional[str]:
+        # path of the blob, it becomes the most recently used one
+        path = self.blob_path(key)  # may be put by another process, so the file is checked anyway
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            self.lru.pop(key)
+            return None
+        self.lru.put(key, path, size)
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.find(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as blob:
+                return blob.read()
+        except FileNotFoundError:  # removed by another process just now
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        self.put_chunks(key, [data])
+
+    def put_chunks(self, key: str, chunks: Iterable[bytes], sha256: Optional[str] = None) -> str:
+        """Write the blob piece by piece, returns its sha256. RuntimeError if it differs from "sha256"."""
+        # written to a temporary file and renamed: readers never see a part of the blob
+        descriptor, temporary = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(descriptor, "wb") as blob:
+                for chunk in chunks:
+                    blob.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            if sha256 is not None and digest.hexdigest() != sha256.lower():
+                raise RuntimeError(f"sha256 of the blob is {digest.hexdigest()}, not {sha256}")
+            os.replace(temporary, self.blob_path(key))
+        except BaseException:
+            self._remove(temporary)
+            raise
+        self.lru.put(key, self.blob_path(key), size)
+        return digest.hexdigest()
+
+    def stats(self) -> dict:
+        return {"items": len(self.lru), "size": self.lru.size, "max_size": self.lru.max_size}
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class HTTPStore:
+    """Client of the cache server."""
+
+    def __init__(self, url: str, timeout: float = 30.0) -> None:
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with urllib.request.urlopen(f"{self.url}/artifact/{key}", timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code == HTTPStatus.NOT_FOUND:
+                return None
+            raise
+
+    def put(self, key: str, data: bytes) -> None:
+        headers = {"Content-Type": "application/gzip", _DIGEST_HEADER: hashlib.sha256(data).hexdigest()}
+        request = urllib.request.Request(f"{self.url}/artifact/{key}", data=data, method="PUT", headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def open_store(location: str) -> Union[DirectoryStore, HTTPStore]:
+    if location.startswith(("http://", "https://")):
+        return HTTPStore(location)
+    return DirectoryStore(os.path.expanduser(location))
+
+
+class ArtifactHandler(PreHandler):
+    store: Optional[DirectoryStore] = None
+    max_body_size: Optional[int] = 1024**3  # the biggest artifact, it is streamed to the store, not kept in memory
+
+    def do_GET(self):
+        if self.route.startswith("/artifact/"):
+            self.return_artifact()
+        elif self.route == "/metrics":
+            self.return_metrics()
+        else:
+            self.return_content(HTTPStatus.NOT_FOUND, "text/plain", b"no such path\n")
+
+    def do_HEAD(self):
+        if self.route.startswith("/artifact/"):
+            self.return_artifact()
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
+
+    def do_PUT(self):
+        if not self.route.startswith("/artifact/"):
+            self.return_content(HTTPStatus.NOT_FOUND, "text/plain", b"no such path\n")
+            return
+        key = self.artifact_key()
+        try:
+            digest = self.directory_store().put_chunks(key, self.iter_body(), self.headers[_DIGEST_HEADER])
+        except RuntimeError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(exc)) from exc
+        self.return_content(HTTPStatus.CREATED, "text/plain", f"stored, sha256 {digest}\n".encode("ascii"))
+
+    def return_artifact(self) -> None:
+        # blobs are big: sent from the file, not from memory
+        path = self.directory_store().find(self.artifact_key())
+        if path is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "no such artifact")
+        self.return_file(path, "application/gzip")
+
+    def directory_store(self) -> DirectoryStore:
+        if self.store is None:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "artifact store is not set up")
+        return self.store
+
+    def artifact_key(self) -> str:
+        key = self.route[len("/artifact/") :]
+        if not _KEY.match(key):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "artifact key is sha256 in hex")
+        return key
+
+    def metrics_gauges(self) -> Dict[str, float]:
+        gauges = super().metrics_gauges()
+        if self.store is not None:
+            gauges.update({"artifact_store_" + x: y for x, y in self.store.stats().items()})
+        return gauges
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost", help="address to listen at")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--dir", default=".skeleton_artifacts", help="where to keep artifacts")
+    parser.add_argument("--max-size", default="1G", help="total size of artifacts, like 512M or 10G")
+    parser.add_argument("--max-artifact-size", help="bigger uploads get 413, --max-size by default")
+    args = parser.parse_args()
+
+    try:
+        max_size = parse_size(args.max_size)
+        max_artifact_size = parse_size(args.max_artifact_size) if args.max_artifact_size else max_size
+    except ValueError as exc:
+        parser.error(str(exc))
+    ArtifactHandler.store = DirectoryStore(args.dir, max_size)
+    ArtifactHandler.max_body_size = max_artifact_size
+    print(f"Running on {(args.host, args.port)}", file=sys.stderr)
+    httpd = ThreadingHTTPServer((args.host, args.port), ArtifactHandler)
+    httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
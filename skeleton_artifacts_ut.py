@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import hashlib
+import http.client
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import skeleton
+import skeleton_artifacts
+import skeleton_runner
+import skeleton_state
+from skeleton_meta import Function
+
+_SCRIPT = """\
+#!/usr/bin/env bash
+
+build() {
+    [ "$1" == "--inputs" ] && _inputs_and_exit "source.txt" || true
+    [ "$1" == "--outputs" ] && _outputs_and_exit "built" || true
+    echo build >> out
+    mkdir -p built
+    tr a-z A-Z < source.txt > built/result.txt
+}
+
+_inputs_and_exit() {
+    exit 0
+}
+
+_outputs_and_exit() {
+    exit 0
+}
+
+"$@"
+"""
+
+_RECORD = {"body": "build() { ... }", "inputs": {"source.txt": "1" * 64}, "deps": {}}
+
+
+def make_blob(name, data=b"x", kind=tarfile.REGTYPE):
+    blob = io.BytesIO()
+    with tarfile.open(fileobj=blob, mode="w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        info.type = kind
+        info.size = len(data) if kind == tarfile.REGTYPE else 0
+        tar.addfile(info, io.BytesIO(data) if kind == tarfile.REGTYPE else None)
+    return blob.getvalue()
+
+
+class TestArtifacts(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        function = Function("build", 1, "", outputs=["built"])
+        key = skeleton_artifacts.artifact_key(function, _RECORD)
+        self.assertRegex(key, "^[0-9a-f]{64}$")
+        self.assertEqual(key, skeleton_artifacts.artifact_key(function, dict(_RECORD)))
+        changed = dict(_RECORD, inputs={"source.txt": "2" * 64})
+        self.assertNotEqual(key, skeleton_artifacts.artifact_key(function, changed))
+        self.assertNotEqual(key, skeleton_artifacts.artifact_key(function, _RECORD, ["--verbose"]))
+        self.assertTrue(skeleton_artifacts.is_cacheable(function))
+        self.assertFalse(skeleton_artifacts.is_cacheable(Function("build", 1, "")))
+        self.assertFalse(skeleton_artifacts.is_cacheable(Function("build", 1, "", outputs=["/tmp/built"])))
+        self.assertFalse(skeleton_artifacts.is_cacheable(Function("build", 1, "", outputs=["a/../../built"])))
+
+    def test_pack_unpack(self):
+        os.makedirs("built/deep")
+        with open("built/deep/result.txt", "w") as result:
+            result.write("result\n")
+        blob = skeleton_artifacts.pack(["built"])
+        shutil.rmtree("built")
+        destination = os.path.join(self.tmpdir, "restored")
+        os.mkdir(destination)
+        self.assertIn("built/deep/result.txt", skeleton_artifacts.unpack(blob, destination))
+        with open(os.path.join(destination, "built/deep/result.txt")) as result:
+            self.assertEqual(result.read(), "result\n")
+
+    def test_unsafe(self):
+        with self.assertRaisesRegex(RuntimeError, "unsafe"):
+            skeleton_artifacts.unpack(make_blob("../escaped"))
+        with self.assertRaisesRegex(RuntimeError, "unsafe"):
+            skeleton_artifacts.unpack(make_blob("link", kind=tarfile.SYMTYPE))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "..", "escaped")))
+
+    def test_parse_size(self):
+        self.assertEqual(skeleton_artifacts.parse_size("1024"), 1024)
+        self.assertEqual(skeleton_artifacts.parse_size("10g"), 10 * 1024**3)
+        with self.assertRaises(ValueError):
+            skeleton_artifacts.parse_size("10 parsecs")
+
+    def test_directory_store(self):
+        store = skeleton_artifacts.DirectoryStore("store", max_size=10)
+        store.put("a" * 64, b"12345")
+        store.put("b" * 64, b"12345")
+        self.assertEqual(store.get("a" * 64), b"12345")  # "b" is the least recently used now
+        store.put("c" * 64, b"12345")
+        self.assertIsNone(store.get("b" * 64))
+        self.assertFalse(os.path.exists(store.blob_path("b" * 64)))
+        self.assertEqual(store.stats(), {"items": 2, "size": 10, "max_size": 10})
+        # another process sees what is there already
+        self.assertEqual(skeleton_artifacts.DirectoryStore("store", max_size=10).get("c" * 64), b"12345")
+
+    def test_server(self):
+        skeleton_artifacts.ArtifactHandler.store = skeleton_artifacts.DirectoryStore("served")
+        httpd = ThreadingHTTPServer(("localhost", 0), skeleton_artifacts.ArtifactHandler)
+        httpd.RequestHandlerClass.log_message = lambda *args: None
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            store = skeleton_artifacts.open_store(f"http://localhost:{httpd.server_port}/")
+            self.assertIsNone(store.get("a" * 64))
+            store.put("a" * 64, b"blob")
+            self.assertEqual(store.get("a" * 64), b"blob")
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                store.get("not-a-key")
+            self.assertEqual(error.exception.code, 400)
+            request = urllib.request.Request(f"{store.url}/metrics", headers={"Accept": "text/plain"})
+            with urllib.request.urlopen(request) as response:
+                self.assertIn(b"artifact_store_items 1", response.read())
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+
+    def test_big_upload(self):
+        skeleton_artifacts.ArtifactHandler.store = skeleton_artifacts.DirectoryStore("served")
+        httpd = ThreadingHTTPServer(("localhost", 0), skeleton_artifacts.ArtifactHandler)
+        httpd.RequestHandlerClass.log_message = lambda *args: None
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        size = skeleton.PreHandler.max_body_size + 1
+        with open("big", "wb") as big:
+            big.truncate(size)
+        try:
+            for digest, status in (("0" * 64, 400), (hashlib.sha256(b"\0" * size).hexdigest(), 201)):
+                connection = http.client.HTTPConnection("localhost", httpd.server_port, timeout=30)
+                with open("big", "rb") as body:
+                    headers = {"Content-Length": str(size), "X-Content-SHA256": digest}
+                    connection.request("PUT", "/artifact/" + "a" * 64, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+                self.assertEqual(response.status, status)
+                if status == 400:
+                    self.assertEqual(os.listdir("served"), [])  # the temporary file is removed
+            self.assertEqual(os.path.getsize(os.path.join("served", "a" * 64 + ".tar.gz")), size)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+
+    def test_runner(self):
+        with open("skeleton.sh", "w") as script:
+            script.write(_SCRIPT)
+        os.chmod("skeleton.sh", 0o755)
+        with open("source.txt", "w") as source:
+            source.write("source\n")
+        store = skeleton_artifacts.DirectoryStore("store")
+
+        def run(state_path):
+            state = skeleton_state.State(state_path)
+            try:
+                runner = skeleton_runner.Runner("./skeleton.sh", verbose=False, state=state, artifacts=store)
+                return runner.run(["build"])["build"]
+            finally:
+                state.close()
+
+        self.assertEqual(run("first.sqlite").status, skeleton_runner.OK)
+        self.assertEqual(store.stats()["items"], 1)
+        shutil.rmtree("built")
+        # another user (own state) with the same inputs gets the outputs without running the task
+        restored = run("second.sqlite")
+        self.assertEqual(restored.status, skeleton_runner.RESTORED)
+        self.assertEqual(restored.reason, "restored from cache (was: never succeeded)")
+        with open("built/result.txt") as result:
+            self.assertEqual(result.read(), "SOURCE\n")
+        self.assertEqual(run("second.sqlite").status, skeleton_runner.SKIPPED)
+        with open("out") as out:
+            self.assertEqual(out.read(), "build\n")
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Speed of with_html_stack rendering and of skeleton.py servers, stdlib only.
+
+"render" times as_text (DEV and PROD params), as_code, content and append(deepcopy=True)
+for documents of several shapes: wide (many siblings), deep (nested tags), attrs (many attributes), raw (long text).
+"load" sends requests from several threads with keep-alive connections and reports p50, p99 and requests per second,
+either to a running server (--url) or to an example started in this process (--serve json|html).
+
+Results are saved as JSON (--output) and compared with a saved baseline (--baseline): a result worse by more
+than --threshold (a fraction) is a regression, the exit code is 1 then. Timings depend on the machine,
+compare results of the same one.
+
+    $ ./skeleton_bench.py render --output baseline.json
+    $ ./skeleton_bench.py render --baseline baseline.json --threshold 0.2
+    $ ./skeleton_bench.py load --serve json --path / --concurrency 8 --requests 5000
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import with_html_stack
+
+SHAPES = ("wide", "deep", "attrs", "raw")
+_SIZES = {"small": 100, "large": 2000}
+_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit & so on. "
+
+
+def make_document(shape: str, size: int) -> with_html_stack.HTMLDocument:
+    """A document of "shape" with about "size" elements (lines of text for "raw")."""
+    doc = with_html_stack.HTMLDocument()
+    with doc("html", lang="en"):
+        with doc("body"):
+            if shape == "wide":
+                with doc("ul"):
+                    for number in range(size):
+                        doc("li", f"item {number}")
+            elif shape == "deep":
+                _nest(doc, size)
+            elif shape == "attrs":
+                for number in range(size):
+                    attributes = {f"_data_{x}": str(number * x) for x in range(8)}
+                    doc("input", type="text", _name=f"field{number}", value=str(number), **attributes)
+            elif shape == "raw":
+                with doc("p"):
+                    doc.raw("\n".join(f"    {_TEXT}{x}" for x in range(size)))
+            else:
+                raise RuntimeError(f"unknown document shape: {shape}")
+    return doc
+
+
+def _nest(doc: with_html_stack.HTMLDocument, depth: int) -> None:
+    # a loop instead of nested "with" statements
+    for level in range(depth):
+        doc("div", _class=f"level{level}")
+        doc.__enter__()
+    doc.raw("bottom")
+    for _ in range(depth):
+        doc.__exit__(None, None, None)
+
+
+def measure(function: Callable[[], object], repeat: int = 5, min_time: float = 0.05) -> dict:
+    """Seconds per call: the best and the median of "repeat" rounds, every round is at least "min_time" long."""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, math.ceil(min_time / elapsed)))
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - started) / number)
+    return {"value": min(rounds), "median": statistics.median(rounds), "unit": "s", "better": "lower"}
+
+
+def render_suite(sizes: Optional[Dict[str, int]] = None, repeat: int = 5, min_time: float = 0.05) -> Dict[str, dict]:
+    sizes = sizes if sizes is not None else _SIZES
+    results = {}
+    for shape in SHAPES:
+        for size_name, size in sizes.items():
+            if shape == "deep":
+                size //= 20  # depth of nesting: rendering and deepcopy recurse
+            doc = make_document(shape, size)
+            operations: Dict[str, Callable[[], object]] = {
+                "as_text_dev": lambda: doc.as_text(with_html_stack.DEV_PARAMS),
+                "as_text_prod": lambda: doc.as_text(with_html_stack.PROD_PARAMS),
+                "as_code": doc.as_code,
+                "content": doc.content,
+                "append_deepcopy": lambda: with_html_stack.HTMLDocument().append(doc, deepcopy=True),
+            }
+            for operation, function in operations.items():
+                results[f"render.{shape}.{size_name}.{operation}"] = measure(function, repeat, min_time)
+    return results
+
+
+def percentile(values: List[float], level: float) -> float:
+    # nearest rank
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(level * len(ordered)) - 1, 0)]
+
+
+def load(
+    url: str, concurrency: int = 8, requests: int = 1000, method: str = "GET", timeout: float = 30.0
+) -> Dict[str, float]:
+    """Send "requests" requests from "concurrency" threads, each thread keeps its connection alive.
+
+    Only successful (2xx) responses are timed: fast errors are not a speed-up. The rest are counted in "errors".
+    """
+    parts = urlsplit(url)
+    path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+    remaining = iter(range(requests))
+    remaining_lock = threading.Lock()
+    latencies: List[float] = []
+    errors = [0]
+    results_lock = threading.Lock()
+
+    def client() -> None:
+        connection = http.client.HTTPConnection(parts.hostname or "localhost", parts.port or 80, timeout=timeout)
+        own: List[float] = []
+        failed = 0
+        try:
+            while True:
+                with remaining_lock:
+                    if next(remaining, None) is None:
+                        break
+                started = time.perf_counter()
+                try:
+                    connection.request(method, path)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    failed += 1
+                    connection.close()  # reconnects on the next request
+                    continue
+                if 200 <= response.status < 300:
+                    own.append(time.perf_counter() - started)
+                else:
+                    failed += 1
+        finally:
+            connection.close()
+            with results_lock:
+                latencies.extend(own)
+                errors[0] += failed
+
+    threads = [threading.Thread(target=client, name=f"load-{x}") for x in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies) + errors[0],
+        "errors": errors[0],
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def load_results(name: str, report: Dict[str, float]) -> Dict[str, dict]:
+    # comparable entries of one load run
+    return {
+        f"load.{name}.rps": {"value": report["rps"], "unit": "1/s", "better": "higher"},
+        f"load.{name}.p50": {"value": report["p50"], "unit": "s", "better": "lower"},
+        f"load.{name}.p99": {"value": report["p99"], "unit": "s", "better": "lower"},
+    }
+
+
+class BenchServer(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections of a burst, they come back after a second of SYN retransmission
+    request_queue_size = 128
+
+
+def serve_example(name: str) -> Tuple[ThreadingHTTPServer, threading.Thread]:
+    """One of the example servers on a free port of localhost, requests are not logged."""
+    # no rate limits either: 429 responses would be measured instead of pages
+    attributes: Dict[str, object] = {"log_message": lambda *args: None, "admission": None}
+    handler: type
+    if name == "json":
+        from skeleton_example_json import ExampleHanler as handler
+    elif name == "html":
+        from skeleton_example_html import HTMLHandlerExample as handler
+        from skeleton_example_html import open_state
+
+        # history and logs of jobs of the benchmark are thrown away, removed with the directory at exit
+        state_dir = attributes["state_dir"] = tempfile.TemporaryDirectory(prefix="skeleton_bench_")
+        history_path = os.path.join(state_dir.name, "history.sqlite")
+        attributes.update(open_state(history_path=history_path, log_dir=state_dir.name))
+    else:
+        raise RuntimeError(f"unknown example server: {name}")
+    quiet = type(f"Quiet{handler.__name__}", (handler,), attributes)
+    httpd = BenchServer(("localhost", 0), quiet)
+    thread = threading.Thread(target=httpd.serve_forever, name="bench server", daemon=True)
+    thread.start()
+    return httpd, thread
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Descriptions of results worse than the baseline by more than "threshold", results missing there are skipped."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None or not old.get("value"):
+            continue
+        ratio = result["value"] / old["value"]
+        worse = ratio - 1 if result.get("better", "lower") == "lower" else 1 - ratio
+        if worse > threshold:
+            change = f"{old['value']:.6g} -> {result['value']:.6g} {result.get('unit', '')}"
+            regressions.append(f"{name}: {change} ({worse:+.0%})")
+    return regressions
+
+
+def print_results(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None) -> None:
+    for name, result in sorted(results.items()):
+        line = f"{name:<45} {result['value']:>12.6g} {result.get('unit', ''):<3}"
+        old = (baseline or {}).get(name)
+        if old and old.get("value"):
+            line += f" {result['value'] / old['value'] - 1:>+8.1%}"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=("render", "load"), help="what to measure")
+    parser.add_argument("--output", help="save results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown, 0.1 means 10%%")
+    parser.add_argument("--repeat", type=int, default=5, help="render: rounds of every measurement")
+    parser.add_argument("--quick", action="store_true", help="render: small documents only")
+    parser.add_argument("--url", help="load: server to send requests to")
+    parser.add_argument("--serve", choices=("json", "html"), help="load: start this example server")
+    parser.add_argument("--path", default="/", help="load: path for --serve")
+    parser.add_argument("--concurrency", type=int, default=8, help="load: threads sending requests")
+    parser.add_argument("--requests", type=int, default=1000, help="load: requests to send")
+    parser.add_argument("--name", help="load: name of results, the server or the path by default")
+    args = parser.parse_args()
+
+    if args.suite == "render":
+        sizes = {"small": _SIZES["small"]} if args.quick else _SIZES
+        results = render_suite(sizes, args.repeat)
+    else:
+        if (args.url is None) == (args.serve is None):
+            parser.error("load needs either --url or --serve")
+        httpd = None
+        if args.serve is not None:
+            httpd, _ = serve_example(args.serve)
+            url = f"http://localhost:{httpd.server_port}{args.path}"
+        else:
+            url = args.url
+        try:
+            report = load(url, args.concurrency, args.requests)
+        finally:
+            if httpd is not None:
+                httpd.shutdown()
+                httpd.server_close()
+        print(json.dumps(report), file=sys.stderr)
+        if report["errors"]:
+            # neither saved nor compared: the numbers describe failures, not the server
+            sys.exit(f"{report['errors']} of {report['requests']} requests have failed")
+        results = load_results(args.name or args.serve or urlsplit(url).path or "/", report)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="UTF-8") as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as file:
+            json.dump(results, file, indent=1, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
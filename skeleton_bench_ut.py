@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import threading
+import unittest
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+
+import skeleton_bench
+import with_html_stack
+from skeleton import PreHandler
+
+
+class BenchHandler(PreHandler):
+    def do_GET(self):
+        if self.route == "/missing":
+            self.return_content(HTTPStatus.NOT_FOUND, "text/plain", b"no such path\n")
+        else:
+            self.return_content(HTTPStatus.OK, "text/plain", b"ok\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBench(unittest.TestCase):
+    def test_shapes(self):
+        for shape in skeleton_bench.SHAPES:
+            text = skeleton_bench.make_document(shape, 10).as_text(with_html_stack.PROD_PARAMS)
+            self.assertTrue(text.startswith("<!DOCTYPE html>"), shape)
+        wide = skeleton_bench.make_document("wide", 10).as_text(with_html_stack.PROD_PARAMS)
+        self.assertEqual(wide.count("<li>"), 10)
+        deep = skeleton_bench.make_document("deep", 100).as_text(with_html_stack.PROD_PARAMS)
+        self.assertEqual(deep.count("</div>"), 100)
+        with self.assertRaises(RuntimeError):
+            skeleton_bench.make_document("round", 10)
+
+    def test_measure(self):
+        result = skeleton_bench.measure(lambda: None, repeat=3, min_time=0.001)
+        self.assertLessEqual(result["value"], result["median"])
+        self.assertEqual(result["better"], "lower")
+
+    def test_percentile(self):
+        values = [x / 100 for x in range(100, 0, -1)]
+        self.assertEqual(skeleton_bench.percentile(values, 0.5), 0.5)
+        self.assertEqual(skeleton_bench.percentile(values, 0.99), 0.99)
+        self.assertEqual(skeleton_bench.percentile([], 0.5), 0.0)
+
+    def test_compare(self):
+        baseline = {
+            "fast": {"value": 1.0, "better": "lower"},
+            "slow": {"value": 1.0, "better": "lower"},
+            "rps": {"value": 100.0, "better": "higher"},
+        }
+        results = {
+            "fast": {"value": 0.5, "better": "lower"},
+            "slow": {"value": 1.5, "better": "lower"},
+            "rps": {"value": 70.0, "better": "higher"},
+            "new": {"value": 1.0, "better": "lower"},
+        }
+        regressions = skeleton_bench.compare(results, baseline, 0.2)
+        self.assertEqual([x.split(":")[0] for x in regressions], ["rps", "slow"])
+        self.assertEqual(skeleton_bench.compare(results, baseline, 0.6), [])
+
+    def test_load(self):
+        httpd = ThreadingHTTPServer(("localhost", 0), BenchHandler)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            report = skeleton_bench.load(f"http://localhost:{httpd.server_port}/", concurrency=3, requests=20)
+            self.assertEqual((report["requests"], report["errors"]), (20, 0))
+            self.assertLessEqual(report["p50"], report["p99"])
+            missing = skeleton_bench.load(f"http://localhost:{httpd.server_port}/missing", concurrency=2, requests=4)
+            self.assertEqual((missing["requests"], missing["errors"]), (4, 4))
+            self.assertEqual((missing["rps"], missing["p99"]), (0.0, 0.0))  # failures are not timed
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        results = skeleton_bench.load_results("example", report)
+        self.assertEqual(results["load.example.rps"]["better"], "higher")
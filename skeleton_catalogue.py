@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import hashlib
+import html
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import with_html_stack
+from skeleton_history import History
+from skeleton_meta import Function, read_script
+from skeleton_profile import critical_path
+
+# sizes for fallback layout of dependency graph, pixels
+_CHAR_WIDTH = 8
+_NODE_HEIGHT = 36
+_NODE_PADDING = 24
+_RANK_GAP = 72
+_ROW_GAP = 18
+_MARGIN = 8
+
+
+class Catalogue:
+    """Functions of skeleton.sh with their help lines and dependencies.
+
+    The script is parsed by skeleton_meta (without running it) and the result is kept
+    until the script is changed: modification time and size are checked on every call (one stat),
+    content hash is checked when they differ.
+    """
+
+    def __init__(self, script: str = "./skeleton.sh") -> None:
+        self.script = script
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._digest: Optional[str] = None
+        self._tasks: Dict[str, Function] = {}
+
+    @property
+    def digest(self) -> str:
+        # sha256 of the script content the catalogue is built for
+        self.tasks()
+        return self._digest or ""
+
+    def is_stale(self) -> bool:
+        # True if the script is changed since the last call of "tasks", costs one stat in most cases
+        stat = os.stat(self.script)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+            with open(self.script, "rb") as script:
+                digest = hashlib.sha256(script.read()).hexdigest()
+            if digest != self._digest:
+                return True
+            self._stamp = stamp
+            return False
+
+    def tasks(self) -> Dict[str, Function]:
+        stat = os.stat(self.script)
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp == self._stamp:
+                return self._tasks
+            with open(self.script, "rb") as script:
+                digest = hashlib.sha256(script.read()).hexdigest()
+            if digest != self._digest:
+                self._tasks = self.load()
+                self._digest = digest
+                self.refreshes += 1
+            self._stamp = stamp
+            return self._tasks
+
+    def load(self) -> Dict[str, Function]:
+        return {x.name: x for x in read_script(self.script)}
+
+
+def public_graph(tasks: Dict[str, Function]) -> Dict[str, List[str]]:
+    # what is drawn: tasks with names without underscore at the start and their dependencies
+    return {x.name: x.deps for x in tasks.values() if not x.name.startswith("_")}
+
+
+def critical_parts(
+    tasks: Dict[str, Function], durations: Optional[Dict[str, float]]
+) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+    # nodes and edges (dependent task -> its dependency) of the critical path among the drawn tasks
+    if not durations:
+        return set(), set()
+    graph = public_graph(tasks)
+    drawn = {x for column in rank_tasks(tasks) for x in column}
+    path = critical_path({x: graph.get(x, []) for x in drawn}, durations)
+    return set(path), set(zip(path[1:], path[:-1]))
+
+
+def duration_label(name: str, durations: Optional[Dict[str, float]]) -> Optional[str]:
+    if not durations or name not in durations:
+        return None
+    return f"{durations[name]:.2f} s"
+
+
+def make_dot(tasks: Dict[str, Function], durations: Optional[Dict[str, float]] = None) -> str:
+    """The same graph as "skeleton.sh _make_dot_file" prints.
+
+    With "durations" (of the last runs) nodes are labeled with them and the critical path is red.
+    """
+    lines = ["digraph G {", '  rankdir="RL"']
+    critical_nodes, critical = critical_parts(tasks, durations)
+    for task in tasks.values():
+        if task.name.startswith("_"):
+            continue
+        for dep in task.deps:
+            style = ' [color="red", penwidth=2]' if (task.name, dep) in critical else ""
+            lines.append(f'  "{task.name}" -> "{dep}"{style};')
+    if durations:
+        for node in sorted({x for column in rank_tasks(tasks) for x in column}):
+            label = duration_label(node, durations)
+            attributes = [f'label="{node}\\n{label}"'] if label is not None else []
+            if node in critical_nodes:
+                attributes.append('color="red", penwidth=2')
+            if attributes:
+                lines.append(f'  "{node}" [{", ".join(attributes)}];')
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def rank_tasks(tasks: Dict[str, Function]) -> List[List[str]]:
+    """Nodes of graph with edges grouped by columns: dependent tasks first, their dependencies next."""
+    edges = [(x.name, dep) for x in tasks.values() if not x.name.startswith("_") for dep in x.deps]
+    nodes: List[str] = []
+    for name, dep in edges:
+        for node in (name, dep):
+            if node not in nodes:
+                nodes.append(node)
+
+    # longest path from tasks nobody depends on, back edges of cycles are ignored
+    rank: Dict[str, int] = {}
+    dependents: Dict[str, List[str]] = {x: [] for x in nodes}
+    for name, dep in edges:
+        dependents[dep].append(name)
+    visiting = set()
+
+    def visit(node: str) -> int:
+        if node in rank:
+            return rank[node]
+        visiting.add(node)
+        parents = [visit(x) for x in dependents[node] if x not in visiting]
+        visiting.discard(node)
+        rank[node] = max(parents) + 1 if parents else 0
+        return rank[node]
+
+    for node in nodes:
+        visit(node)
+
+    columns: List[List[str]] = [[] for _ in range(max(rank.values(), default=-1) + 1)]
+    for node in nodes:
+        columns[rank[node]].append(node)
+
+    # one pass of barycenter ordering to reduce edge crossings
+    for index in range(1, len(columns)):
+        position = {x: i for i, x in enumerate(columns[index - 1])}
+
+        def barycenter(node: str) -> float:
+            parents = [position[x] for x in dependents[node] if x in position]
+            return sum(parents) / len(parents) if parents else float(len(position))
+
+        columns[index].sort(key=barycenter)
+    return columns
+
+
+def layout_svg(tasks: Dict[str, Function], durations: Optional[Dict[str, float]] = None) -> bytes:
+    """Pure Python picture of dependency graph for hosts without Graphviz, "rankdir=RL" like make_dot."""
+    columns = rank_tasks(tasks)
+    critical_nodes, critical = critical_parts(tasks, durations)
+
+    def node_width(node: str) -> int:
+        return max(len(node), len(duration_label(node, durations) or "")) * _CHAR_WIDTH + _NODE_PADDING
+
+    widths = [max((node_width(x) for x in column), default=0) for column in columns]
+    height = max((len(x) for x in columns), default=0) * (_NODE_HEIGHT + _ROW_GAP) - _ROW_GAP + 2 * _MARGIN
+    width = sum(widths) + _RANK_GAP * max(len(columns) - 1, 0) + 2 * _MARGIN
+
+    # dependent tasks are on the right side, their dependencies are on the left one
+    centers: Dict[str, Tuple[float, float, float]] = {}
+    right = width - _MARGIN
+    for column, column_width in zip(columns, widths):
+        column_height = len(column) * (_NODE_HEIGHT + _ROW_GAP) - _ROW_GAP
+        top = (height - column_height) / 2
+        for index, node in enumerate(column):
+            y = top + index * (_NODE_HEIGHT + _ROW_GAP) + _NODE_HEIGHT / 2
+            centers[node] = (right - column_width / 2, y, node_width(node) / 2)
+        right -= column_width + _RANK_GAP
+
+    doc = with_html_stack.HTMLDocument(doctype=False)
+    with doc("svg", xmlns="http://www.w3.org/2000/svg", width=f"{width:.0f}pt", height=f"{height:.0f}pt"):
+        with doc("defs"):
+            with doc("marker", _id="arrow", markerWidth="10", markerHeight="8", refX="10", refY="4", orient="auto"):
+                doc("path", d="M0,0 L10,4 L0,8 z", fill="black")
+        for task in tasks.values():
+            if task.name.startswith("_"):
+                continue
+            for dep in task.deps:
+                x1, y1, r1 = centers[task.name]
+                x2, y2, r2 = centers[dep]
+                direction = 1 if x2 >= x1 else -1
+                doc(
+                    "line",
+                    x1=f"{x1 + direction * r1:.1f}",
+                    y1=f"{y1:.1f}",
+                    x2=f"{x2 - direction * r2:.1f}",
+                    y2=f"{y2:.1f}",
+                    stroke="red" if (task.name, dep) in critical else "black",
+                    _stroke_width="2" if (task.name, dep) in critical else "1",
+                    _marker_end="url(#arrow)",
+                )
+        for node, (x, y, radius) in centers.items():
+            label = duration_label(node, durations)
+            with doc("g"):
+                doc("title", html.escape(node))
+                doc(
+                    "ellipse",
+                    cx=f"{x:.1f}",
+                    cy=f"{y:.1f}",
+                    rx=f"{radius:.1f}",
+                    ry=f"{_NODE_HEIGHT / 2:.1f}",
+                    fill="none",
+                    stroke="red" if node in critical_nodes else "black",
+                    _stroke_width="2" if node in critical_nodes else "1",
+                )
+                text_y = y + 5 if label is None else y - 2
+                with doc("text", x=f"{x:.1f}", y=f"{text_y:.1f}", _text_anchor="middle", _font_family="monospace"):
+                    doc.raw(html.escape(node))
+                if label is not None:
+                    with doc("text", x=f"{x:.1f}", y=f"{y + 12:.1f}", _text_anchor="middle", _font_family="monospace"):
+                        doc.raw(label)
+    return doc.content(with_html_stack.PROD_PARAMS, "ascii")
+
+
+def render_svg(tasks: Dict[str, Function], durations: Optional[Dict[str, float]] = None) -> bytes:
+    dot = shutil.which("dot")
+    if dot is None:
+        return layout_svg(tasks, durations)
+    source = make_dot(tasks, durations).encode()
+    return subprocess.run([dot, "-Tsvg"], input=source, stdout=subprocess.PIPE, check=True).stdout
+
+
+class Schema:
+    """SVG picture of dependency graph of catalogue tasks.
+
+    The picture is built once for the script content (and durations of the last runs if there is history).
+    When they are changed, the new picture is built in background thread and the old one is returned meanwhile.
+    """
+
+    def __init__(self, catalogue: Catalogue, history: Optional[History] = None) -> None:
+        self.catalogue = catalogue
+        self.history = history
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+        self._svg: Optional[bytes] = None
+        self._durations: Optional[Dict[str, float]] = None  # the picture is drawn for them
+        self._digest: Optional[str] = None  # and for this script content
+        self._builder: Optional[threading.Thread] = None
+        self.duration_reads = 0
+        self._read_durations: Optional[Dict[str, float]] = None
+        self._read_for: Optional[Tuple[str, int]] = None  # script digest and the last run id of _read_durations
+
+    def durations(self) -> Optional[Dict[str, float]]:
+        # of the last runs of tasks, rounded as they are shown; read again only if the script or history is changed
+        if self.history is None:
+            return None
+        key = (self.catalogue.digest, self.history.last_id())
+        with self._lock:
+            if key == self._read_for:
+                return self._read_durations
+        last = self.history.latest(public_graph(self.catalogue.tasks()))
+        durations = {x: round(y.duration, 2) for x, y in last.items()}
+        with self._lock:
+            self._read_durations, self._read_for = durations, key
+            self.duration_reads += 1
+        return durations
+
+    def svg(self) -> bytes:
+        durations = self.durations()
+        digest = self.catalogue.digest
+        with self._lock:
+            svg = self._svg
+            stale = durations != self._durations or digest != self._digest
+            if svg is not None and self._builder is None and stale:
+                self._builder = threading.Thread(target=self._rebuild, name="schema builder", daemon=True)
+                self._builder.start()
+        if svg is not None:
+            return svg
+        return self.wait()
+
+    def wait(self) -> bytes:
+        # current picture, building it in calling thread if there is nothing to show yet
+        with self._lock:
+            builder = self._builder
+        if builder is not None:
+            builder.join()
+        with self._lock:
+            if self._svg is not None:
+                return self._svg
+        return self._rebuild()
+
+    def _rebuild(self) -> bytes:
+        try:
+            digest = self.catalogue.digest
+            durations = self.durations()
+            svg = render_svg(self.catalogue.tasks(), durations)
+            with self._lock:
+                self._svg = svg
+                self._durations = durations
+                self._digest = digest
+                self.rebuilds += 1
+            return svg
+        finally:
+            with self._lock:
+                if self._builder is threading.current_thread():
+                    self._builder = None
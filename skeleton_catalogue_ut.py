@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import skeleton_catalogue
+import skeleton_history
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "skeleton.sh")
+
+
+class TestCatalogue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "skeleton.sh")
+        shutil.copy(_SCRIPT, self.script)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_tasks(self):
+        catalogue = skeleton_catalogue.Catalogue(self.script)
+        tasks = catalogue.tasks()
+        self.assertEqual(tasks["greetings"].help, "say Hello to arguments")
+        self.assertEqual(tasks["make_my_day"].deps, ["make", "my", "day"])
+        self.assertEqual(tasks["usage"].deps, ["print_functions"])
+        self.assertIsNone(tasks["no_help_example"].help)
+        self.assertIsNone(tasks["_make_dot_file"].help)
+        self.assertEqual(len(catalogue.digest), 64)
+
+    def test_refresh(self):
+        catalogue = skeleton_catalogue.Catalogue(self.script)
+        catalogue.tasks()
+        catalogue.tasks()
+        self.assertEqual(catalogue.refreshes, 1)
+
+        os.utime(self.script, ns=(0, 0))  # the same content
+        catalogue.tasks()
+        self.assertEqual(catalogue.refreshes, 1)
+
+        with open(self.script) as script:
+            text = script.read()
+        with open(self.script, "w") as script:
+            script.write(text.replace('"say Hello to arguments"', '"say Hi to arguments"'))
+        self.assertEqual(catalogue.tasks()["greetings"].help, "say Hi to arguments")
+        self.assertEqual(catalogue.refreshes, 2)
+
+    def test_is_stale(self):
+        catalogue = skeleton_catalogue.Catalogue(self.script)
+        catalogue.tasks()
+        self.assertFalse(catalogue.is_stale())
+        os.utime(self.script, ns=(0, 0))
+        self.assertFalse(catalogue.is_stale())
+        with open(self.script, "a") as script:
+            script.write("\n")
+        self.assertTrue(catalogue.is_stale())
+
+
+class TestSchema(unittest.TestCase):
+    def setUp(self):
+        self.tasks = {
+            "a": skeleton_catalogue.Function("a", 1, "", "first", ["b", "c"]),
+            "b": skeleton_catalogue.Function("b", 5, "", "second", ["c"]),
+            "c": skeleton_catalogue.Function("c", 9, "", "third"),
+            "_d": skeleton_catalogue.Function("_d", 13, "", None, ["a"]),
+        }
+
+    def test_make_dot(self):
+        self.assertEqual(
+            skeleton_catalogue.make_dot(self.tasks),
+            'digraph G {\n  rankdir="RL"\n  "a" -> "b";\n  "a" -> "c";\n  "b" -> "c";\n}\n',
+        )
+
+    def test_make_dot_durations(self):
+        dot = skeleton_catalogue.make_dot(self.tasks, {"a": 1.0, "b": 2.0, "c": 0.5})
+        self.assertIn('  "a" -> "b" [color="red", penwidth=2];\n  "a" -> "c";\n', dot)
+        self.assertIn('  "c" [label="c\\n0.50 s", color="red", penwidth=2];\n', dot)
+
+    def test_rank_tasks(self):
+        self.assertEqual(skeleton_catalogue.rank_tasks(self.tasks), [["a"], ["b"], ["c"]])
+        self.tasks["c"].deps.append("a")  # cycle
+        self.assertEqual(sorted(sum(skeleton_catalogue.rank_tasks(self.tasks), [])), ["a", "b", "c"])
+
+    def test_layout_svg(self):
+        svg = skeleton_catalogue.layout_svg(self.tasks).decode("ascii")
+        self.assertTrue(svg.startswith('<svg xmlns="http://www.w3.org/2000/svg"'))
+        self.assertEqual(svg.count("<ellipse"), 3)
+        self.assertEqual(svg.count("<line"), 3)
+        self.assertNotIn("_d", svg)
+
+        svg = skeleton_catalogue.layout_svg(self.tasks, {"a": 1.0, "b": 2.0, "c": 0.5}).decode("ascii")
+        self.assertIn("2.00 s", svg)
+        self.assertEqual(svg.count('stroke="red"'), 5)  # 3 nodes and 2 edges of a -> b -> c
+
+    def test_durations(self):
+        tmpdir = tempfile.mkdtemp()
+        history = skeleton_history.History(os.path.join(tmpdir, "history.sqlite"))
+        try:
+            script = os.path.join(tmpdir, "skeleton.sh")
+            shutil.copy(_SCRIPT, script)
+            schema = skeleton_catalogue.Schema(skeleton_catalogue.Catalogue(script), history)
+            self.assertEqual(schema.durations(), {})
+            self.assertEqual(schema.durations(), {})
+            self.assertEqual(schema.duration_reads, 1)  # nothing is changed
+
+            history.add(skeleton_history.RunRecord("make", "runner", 10.0, 12.5, 0))
+            self.assertEqual(schema.durations(), {"make": 2.5})
+            with open(script, "a") as source:
+                source.write("\nnew_task() {\n    echo new\n}\n")
+            schema.durations()
+            self.assertEqual(schema.duration_reads, 3)
+        finally:
+            history.close()
+            shutil.rmtree(tmpdir)
+
+    def test_background_rebuild(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            script = os.path.join(tmpdir, "skeleton.sh")
+            shutil.copy(_SCRIPT, script)
+            schema = skeleton_catalogue.Schema(skeleton_catalogue.Catalogue(script))
+            first = schema.svg()
+            self.assertIs(schema.svg(), first)
+            self.assertEqual(schema.rebuilds, 1)
+
+            with open(script) as source:
+                text = source.read()
+            with open(script, "w") as source:
+                source.write(text.replace('_deps_and_exit "make" "my" "day"', '_deps_and_exit "make" "my"'))
+            self.assertIs(schema.svg(), first)  # stale picture while the new one is built
+            self.assertIsNot(schema.wait(), first)
+            self.assertEqual(schema.rebuilds, 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_rebuild_with_history(self):
+        tmpdir = tempfile.mkdtemp()
+        history = skeleton_history.History(os.path.join(tmpdir, "history.sqlite"))
+        try:
+            script = os.path.join(tmpdir, "skeleton.sh")
+            shutil.copy(_SCRIPT, script)
+            schema = skeleton_catalogue.Schema(skeleton_catalogue.Catalogue(script), history)
+            first = schema.svg()
+            self.assertIs(schema.svg(), first)
+
+            with open(script) as source:
+                text = source.read()
+            with open(script, "w") as source:
+                source.write(text.replace('_deps_and_exit "make" "my" "day"', '_deps_and_exit "make" "my"'))
+            schema.svg()
+            self.assertIsNot(schema.wait(), first)
+            self.assertEqual(schema.rebuilds, 2)
+        finally:
+            history.close()
+            shutil.rmtree(tmpdir)
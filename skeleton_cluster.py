@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""Run tasks of skeleton.sh on several hosts: one coordinator and any number of workers.
+
+Workers register at the coordinator, pull ready tasks (all dependencies succeeded), run them
+and report exit code and output. A ready task goes preferably to the worker which has run its dependencies
+(their results are likely on its disk), then to a worker on the same host. A worker which has not been heard of
+for "worker_timeout" seconds is considered dead and its task is given to another one, at most "max_attempts" times.
+Like skeleton_runner, the first failed task stops everything: the next heartbeat of a worker running a task
+tells it to terminate the task. A worker retries calls while the coordinator is unavailable, up to "retry_time" seconds.
+
+    $ ./skeleton_cluster.py coordinator --port 8100 make_my_day
+    $ ./skeleton_cluster.py worker --port 8101 --coordinator http://localhost:8100
+    $ ./skeleton_cluster.py worker --port 8102 --coordinator http://localhost:8100
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from skeleton import HTTPError, JSONHandler, dump_json
+from skeleton_meta import read_script
+from skeleton_runner import CANCELLED, FAILED, NOT_STARTED, OK, RUNNER_ENV, resolve, topological_order
+
+RUNNING = "running"
+
+_OUTPUT_LIMIT = 64 * 1024  # the tail of the output sent to the coordinator
+_QUIET_ROUTES = ("/lease", "/heartbeat")  # workers poll them all the time
+_MAX_RETRY_PAUSE = 10.0  # seconds between calls of an unavailable coordinator grow up to it
+
+
+class ClusterTask:
+    def __init__(self, name: str, deps: List[str]) -> None:
+        self.name = name
+        self.deps = deps
+        self.status = NOT_STARTED
+        self.worker: Optional[str] = None  # the last one which has got the task
+        self.attempts = 0
+        self.returncode: Optional[int] = None
+        self.output = ""
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.reason: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "worker": self.worker,
+            "attempts": self.attempts,
+            "returncode": self.returncode,
+            "started": self.started,
+            "finished": self.finished,
+            "output": self.output,
+        }
+
+
+class WorkerInfo:
+    def __init__(self, url: str) -> None:
+        self.url = url  # the worker is known by its address
+        self.host = urlsplit(url).hostname or ""
+        self.seen = time.monotonic()
+        self.alive = True
+        self.task: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {"alive": self.alive, "task": self.task, "seen": round(time.monotonic() - self.seen, 3)}
+
+
+class Coordinator:
+    def __init__(self, script: str, targets: List[str], worker_timeout: float = 10.0, max_attempts: int = 3) -> None:
+        graph = resolve({x.name: x for x in read_script(script)}, targets)
+        self.order = topological_order(graph)
+        self.tasks = {x: ClusterTask(x, graph[x]) for x in self.order}
+        self.workers: Dict[str, WorkerInfo] = {}
+        self.worker_timeout = worker_timeout
+        self.max_attempts = max_attempts
+        self.finished = threading.Event()  # all tasks succeeded or something failed and nothing runs
+        self._lock = threading.Lock()
+
+    @property
+    def failed(self) -> bool:
+        return any(x.status == FAILED for x in self.tasks.values())
+
+    def register(self, url: str) -> None:
+        with self._lock:
+            worker = self.workers.get(url)
+            if worker is not None and worker.task is not None:
+                # restarted worker has forgotten its task
+                self._release(worker, "worker restarted")
+            self.workers[url] = WorkerInfo(url)
+
+    def heartbeat(self, url: str) -> bool:
+        # False means the task of the worker has to be terminated: the worker is unknown or considered dead
+        # (the task is given to another one) or another task has failed
+        with self._lock:
+            self._expire()
+            worker = self.workers.get(url)
+            if worker is None or not worker.alive:
+                return False
+            worker.seen = time.monotonic()
+            return not self.failed
+
+    def lease(self, url: str) -> dict:
+        with self._lock:
+            self._expire()
+            worker = self.workers.get(url)
+            if worker is None or not worker.alive:
+                return {"task": None, "register": True}
+            worker.seen = time.monotonic()
+            if self.finished.is_set() or self.failed:
+                return {"task": None, "done": True}
+            ready = [
+                x
+                for x in self.order
+                if self.tasks[x].status == NOT_STARTED and all(self.tasks[y].status == OK for y in self.tasks[x].deps)
+            ]
+            if not ready:
+                return {"task": None, "done": False}
+            locality = {x: self._locality(x, worker) for x in ready}
+            task = self.tasks[max(ready, key=locality.__getitem__)]
+            task.status = RUNNING
+            task.worker = url
+            task.attempts += 1
+            task.started = time.time()
+            worker.task = task.name
+            return {"task": task.name, "attempt": task.attempts}
+
+    def report(self, url: str, name: str, attempt: int, returncode: int, output: str) -> bool:
+        # False if the task is given to another worker meanwhile, then the result is ignored
+        with self._lock:
+            task = self.tasks.get(name)
+            worker = self.workers.get(url)
+            if task is None or task.status != RUNNING or task.worker != url or task.attempts != attempt:
+                return False
+            if worker is not None:
+                worker.seen = time.monotonic()
+                worker.task = None
+            task.finished = time.time()
+            task.returncode = returncode
+            task.output = output
+            if returncode == 0:
+                task.status = OK
+            else:
+                task.status = CANCELLED if self.failed else FAILED
+            self._check_finished()
+            return True
+
+    def expire(self) -> None:
+        with self._lock:
+            self._expire()
+
+    def status(self) -> dict:
+        with self._lock:
+            self._expire()
+            return {
+                "finished": self.finished.is_set(),
+                "failed": self.failed,
+                "tasks": {x: self.tasks[x].as_dict() for x in self.order},
+                "workers": {x: y.as_dict() for x, y in self.workers.items()},
+            }
+
+    def summary(self) -> str:
+        lines = []
+        with self._lock:
+            for task in self.tasks.values():
+                duration = f"{task.duration:.2f} s" if task.duration is not None else ""
+                where = f"{task.attempts} x {task.worker}" if task.worker is not None else ""
+                lines.append(f"{task.name:<20} {task.status:<12} {duration:>9} {where} {task.reason or ''}")
+        return "\n".join(lines) + "\n"
+
+    def _locality(self, name: str, worker: WorkerInfo) -> tuple:
+        # dependencies run by this worker, then on the same host
+        deps = [self.tasks[x] for x in self.tasks[name].deps]
+        same_worker = sum(1 for x in deps if x.worker == worker.url)
+        same_host = sum(1 for x in deps if x.worker in self.workers and self.workers[x.worker].host == worker.host)
+        return same_worker, same_host
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.worker_timeout
+        for worker in self.workers.values():
+            if worker.alive and worker.seen < deadline:
+                worker.alive = False
+                if worker.task is not None:
+                    self._release(worker, "worker lost")
+
+    def _release(self, worker: WorkerInfo, reason: str) -> None:
+        # the task of the worker is run again elsewhere, unless it has been tried too many times
+        task = self.tasks[worker.task] if worker.task is not None else None
+        worker.task = None
+        if task is None or task.status != RUNNING:
+            return
+        task.reason = reason
+        if task.attempts < self.max_attempts:
+            task.status = NOT_STARTED
+        else:
+            task.status = FAILED
+            task.finished = time.time()
+        self._check_finished()
+
+    def _check_finished(self) -> None:
+        statuses = [x.status for x in self.tasks.values()]
+        if all(x == OK for x in statuses) or (FAILED in statuses and RUNNING not in statuses):
+            self.finished.set()
+
+
+class CoordinatorHandler(JSONHandler):
+    coordinator: Optional[Coordinator] = None
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        try:
+            if self.route == "/register":
+                self.coordinator.register(self.read_worker()["worker"])
+                self.return_json(HTTPStatus.OK, {"ok": True})
+            elif self.route == "/heartbeat":
+                self.return_json(HTTPStatus.OK, {"ok": self.coordinator.heartbeat(self.read_worker()["worker"])})
+            elif self.route == "/lease":
+                self.return_json(HTTPStatus.OK, self.coordinator.lease(self.read_worker()["worker"]))
+            elif self.route == "/report":
+                body = self.read_worker()
+                try:
+                    arguments = (body["task"], int(body["attempt"]), int(body["returncode"]), str(body["output"]))
+                except (KeyError, TypeError, ValueError) as exc:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, f"bad report: {exc}") from exc
+                self.return_json(HTTPStatus.OK, {"ok": self.coordinator.report(body["worker"], *arguments)})
+            elif self.route in ("/", "/status"):
+                self.return_json(HTTPStatus.OK, self.coordinator.status())
+            elif self.route == "/metrics":
+                self.return_metrics()
+            else:
+                raise HTTPError(HTTPStatus.NOT_FOUND, "No path found on server: " + self.path)
+        except HTTPError as exc:
+            self.close_connection = True  # some part of request body may be left unread
+            self.return_json(exc.status, {"error": {"message": exc.status.phrase, "details": exc.message}})
+
+    def read_worker(self) -> dict:
+        body = self.read_json()
+        if not isinstance(body, dict) or not isinstance(body.get("worker"), str):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'JSON object with "worker" expected')
+        return body
+
+    def log_request(self, code="-", size="-"):
+        if self.route not in _QUIET_ROUTES or code != HTTPStatus.OK:
+            super().log_request(code, size)
+
+
+class Worker:
+    def __init__(
+        self,
+        coordinator: str,
+        url: str,
+        script: str = "./skeleton.sh",
+        heartbeat: float = 2.0,
+        poll: float = 0.5,
+        retry_time: float = 60.0,
+    ) -> None:
+        self.coordinator = coordinator.rstrip("/")
+        self.url = url
+        self.script = script
+        self.heartbeat = heartbeat  # seconds between heartbeats while a task is running
+        self.poll = poll  # seconds between asking for a task when there is nothing ready
+        self.retry_time = retry_time  # seconds the coordinator may be unavailable before the worker gives up
+        self.task: Optional[str] = None
+        self._stopping = threading.Event()
+
+    def call(self, path: str, obj: dict) -> dict:
+        obj = dict(obj, worker=self.url)
+        request = urllib.request.Request(
+            self.coordinator + path, data=dump_json(obj, pretty=False), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+
+    def call_retrying(self, path: str, obj: dict) -> dict:
+        # a restarted coordinator or a network glitch does not stop the worker, pauses between tries grow
+        deadline = time.monotonic() + self.retry_time
+        pause = self.poll
+        while True:
+            try:
+                return self.call(path, obj)
+            except (OSError, ValueError) as exc:
+                if time.monotonic() + pause > deadline or self._stopping.is_set():
+                    raise
+                print(f"Coordinator is not available, retry in {pause:.1f} s: {exc}", file=sys.stderr)
+                self._stopping.wait(pause)
+                pause = min(pause * 2, _MAX_RETRY_PAUSE)
+
+    def run(self) -> None:
+        self.call_retrying("/register", {})
+        while not self._stopping.is_set():
+            reply = self.call_retrying("/lease", {})
+            if reply.get("register"):
+                self.call_retrying("/register", {})
+            elif reply.get("task") is not None:
+                self.execute(reply["task"], reply["attempt"])
+            elif reply.get("done"):
+                break
+            else:
+                self._stopping.wait(self.poll)
+
+    def execute(self, name: str, attempt: int) -> None:
+        self.task = name
+        process = subprocess.Popen(
+            [self.script, name],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            env=dict(os.environ, **{RUNNER_ENV: "1"}),  # the coordinator runs dependencies
+        )
+        beating = threading.Thread(target=self._beat, args=(process,), name="heartbeat", daemon=True)
+        beating.start()
+        output, _ = process.communicate()
+        beating.join()
+        self.task = None
+        text = output[-_OUTPUT_LIMIT:].decode("UTF-8", errors="replace")
+        report = {"task": name, "attempt": attempt, "returncode": process.returncode, "output": text}
+        self.call_retrying("/report", report)
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _beat(self, process: subprocess.Popen) -> None:
+        while process.poll() is None:
+            try:
+                alive = self.call("/heartbeat", {})["ok"]
+            except (OSError, ValueError):
+                alive = True  # coordinator is not available for a moment, keep working
+            if not alive:
+                # the task is given to somebody else already or another task has failed
+                os.killpg(process.pid, signal.SIGTERM)
+                return
+            try:
+                process.wait(self.heartbeat)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+class WorkerHandler(JSONHandler):
+    worker: Optional[Worker] = None
+
+    def do_GET(self):
+        if self.route in ("/", "/status"):
+            self.return_json(HTTPStatus.OK, {"worker": self.worker.url, "task": self.worker.task})
+        elif self.route == "/metrics":
+            self.return_metrics()
+        else:
+            self.return_json(HTTPStatus.NOT_FOUND, {"error": {"message": "No path found on server: " + self.path}})
+
+
+def serve(handler: type, host: str, port: int) -> ThreadingHTTPServer:
+    httpd = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=httpd.serve_forever, name="http", daemon=True).start()
+    return httpd
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost", help="address to listen at")
+    parser.add_argument("--script", default="./skeleton.sh", help="path to skeleton.sh")
+    modes = parser.add_subparsers(dest="mode", required=True)
+    coordinator = modes.add_parser("coordinator", help="keep the graph of tasks and give them to workers")
+    coordinator.add_argument("targets", nargs="+", help="tasks to run")
+    coordinator.add_argument("--port", type=int, default=8100)
+    coordinator.add_argument("--worker-timeout", type=float, default=10.0, help="seconds without heartbeat")
+    coordinator.add_argument("--max-attempts", type=int, default=3, help="runs of a task on lost workers")
+    worker = modes.add_parser("worker", help="run tasks given by coordinator")
+    worker.add_argument("--port", type=int, default=8101, help="port for status, 0 means any free one")
+    worker.add_argument("--coordinator", default="http://localhost:8100", help="URL of coordinator")
+    worker.add_argument("--heartbeat", type=float, default=2.0, help="seconds between heartbeats")
+    worker.add_argument("--poll", type=float, default=0.5, help="seconds between asking for a task")
+    worker.add_argument(
+        "--retry-time", type=float, default=60.0, help="seconds to retry calls while the coordinator is unavailable"
+    )
+    args = parser.parse_args()
+
+    if args.mode == "coordinator":
+        try:
+            state = Coordinator(args.script, args.targets, args.worker_timeout, args.max_attempts)
+        except RuntimeError as exc:  # unknown task or dependency cycle
+            parser.error(str(exc))
+        CoordinatorHandler.coordinator = state
+        httpd = serve(CoordinatorHandler, args.host, args.port)
+        print(f"Coordinator at {httpd.server_address}", file=sys.stderr)
+        while not state.finished.wait(1.0):
+            state.expire()
+        time.sleep(1.0)  # let polling workers hear that everything is done
+        sys.stderr.write(state.summary())
+        sys.exit(1 if state.failed else 0)
+
+    httpd = serve(WorkerHandler, args.host, args.port)
+    url = "http://{}:{}".format(*httpd.server_address[:2])
+    WorkerHandler.worker = Worker(args.coordinator, url, args.script, args.heartbeat, args.poll, args.retry_time)
+    print(f"Worker at {url}", file=sys.stderr)
+    try:
+        WorkerHandler.worker.run()
+    except (OSError, ValueError) as exc:
+        sys.exit(f"coordinator is not available: {exc}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import skeleton_cluster
+
+_SCRIPT = """\
+#!/usr/bin/env bash
+
+base() {
+    echo "base on $PPID"
+}
+
+left() {
+    [ "$1" == "--deps" ] && _deps_and_exit "base" || true
+    sleep 0.2
+}
+
+right() {
+    [ "$1" == "--deps" ] && _deps_and_exit "base" || true
+    sleep 0.2
+}
+
+top() {
+    [ "$1" == "--deps" ] && _deps_and_exit "left" "right" || true
+    echo top
+}
+
+long() {
+    sleep 0.5
+    echo long
+}
+
+broken() {
+    [ "$1" == "--deps" ] && _deps_and_exit "base" || true
+    exit 3
+}
+
+_deps_and_exit() {
+    exit 0
+}
+
+"$@"
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+class ClusterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "skeleton.sh")
+        with open(self.script, "w") as script:
+            script.write(_SCRIPT)
+        os.chmod(self.script, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class TestCoordinator(ClusterTestCase):
+    def test_locality(self):
+        coordinator = skeleton_cluster.Coordinator(self.script, ["left", "right"])
+        coordinator.register("http://one:1")
+        coordinator.register("http://two:2")
+        self.assertEqual(coordinator.lease("http://two:2"), {"task": "base", "attempt": 1})
+        self.assertEqual(coordinator.lease("http://one:1"), {"task": None, "done": False})
+        self.assertTrue(coordinator.report("http://two:2", "base", 1, 0, "base\n"))
+        # both are ready, "left" is the first one, but "two" has run "base" and "one" has not
+        self.assertEqual(coordinator.lease("http://two:2")["task"], "left")
+        self.assertEqual(coordinator.lease("http://one:1")["task"], "right")
+
+    def test_lost_worker(self):
+        coordinator = skeleton_cluster.Coordinator(self.script, ["long"], worker_timeout=0.1, max_attempts=2)
+        coordinator.register("http://one:1")
+        self.assertEqual(coordinator.lease("http://one:1"), {"task": "long", "attempt": 1})
+        time.sleep(0.2)
+        coordinator.register("http://two:2")
+        self.assertEqual(coordinator.lease("http://two:2"), {"task": "long", "attempt": 2})
+        self.assertEqual(coordinator.lease("http://one:1"), {"task": None, "register": True})
+        self.assertFalse(coordinator.heartbeat("http://one:1"))
+        self.assertFalse(coordinator.report("http://one:1", "long", 1, 0, "late"))  # ignored
+        time.sleep(0.2)
+        coordinator.expire()  # the last attempt is lost too
+        self.assertEqual(coordinator.tasks["long"].status, skeleton_cluster.FAILED)
+        self.assertEqual(coordinator.tasks["long"].reason, "worker lost")
+        self.assertTrue(coordinator.finished.is_set())
+
+    def test_failure(self):
+        coordinator = skeleton_cluster.Coordinator(self.script, ["broken", "top"])
+        coordinator.register("http://one:1")
+        lease = coordinator.lease("http://one:1")
+        coordinator.report("http://one:1", lease["task"], lease["attempt"], 0, "")
+        self.assertEqual(coordinator.lease("http://one:1")["task"], "broken")
+        coordinator.report("http://one:1", "broken", 1, 3, "")
+        self.assertTrue(coordinator.failed)
+        self.assertTrue(coordinator.finished.is_set())
+        self.assertEqual(coordinator.lease("http://one:1"), {"task": None, "done": True})
+
+    def test_cancel(self):
+        coordinator = skeleton_cluster.Coordinator(self.script, ["broken", "long"])
+        coordinator.register("http://one:1")
+        coordinator.register("http://two:2")
+        tasks = {}
+        for url in ("http://one:1", "http://two:2"):
+            tasks[coordinator.lease(url)["task"]] = url
+        coordinator.report(tasks["base"], "base", 1, 0, "")
+        self.assertEqual(coordinator.lease(tasks["base"])["task"], "broken")
+        self.assertTrue(coordinator.heartbeat(tasks["long"]))
+        coordinator.report(tasks["base"], "broken", 1, 3, "")
+        self.assertFalse(coordinator.finished.is_set())  # "long" is still running
+        self.assertFalse(coordinator.heartbeat(tasks["long"]))  # so its worker terminates it
+        coordinator.report(tasks["long"], "long", 1, -signal.SIGTERM, "")
+        self.assertEqual(coordinator.tasks["long"].status, skeleton_cluster.CANCELLED)
+        self.assertEqual(coordinator.tasks["broken"].status, skeleton_cluster.FAILED)
+        self.assertTrue(coordinator.finished.is_set())
+
+
+class TestCluster(ClusterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.coordinator = None
+        self.httpd = None
+        self.workers = {}
+
+    def tearDown(self):
+        for process in self.workers.values():
+            process.kill()
+            process.wait()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        super().tearDown()
+
+    def start(self, targets, workers, worker_timeout=10.0, delay=0.0):
+        # workers are started "delay" seconds before the coordinator
+        coordinator_port = free_port()
+        url = f"http://localhost:{coordinator_port}"
+        for _ in range(workers):
+            port = free_port()
+            command = [sys.executable, skeleton_cluster.__file__, "--script", self.script, "--host", "127.0.0.1"]
+            command += ["worker", "--port", str(port), "--coordinator", url, "--heartbeat", "0.1", "--poll", "0.05"]
+            self.workers[f"http://127.0.0.1:{port}"] = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+        time.sleep(delay)
+        self.coordinator = skeleton_cluster.Coordinator(self.script, targets, worker_timeout)
+        handler = type("Handler", (skeleton_cluster.CoordinatorHandler,), {"coordinator": self.coordinator})
+        handler.log_message = lambda *args: None
+        self.httpd = skeleton_cluster.serve(handler, "localhost", coordinator_port)
+        self.httpd.handle_error = lambda *args: None  # killed workers break connections
+
+    def test_run(self):
+        self.start(["top"], workers=2)
+        self.assertTrue(self.coordinator.finished.wait(10))
+        status = self.coordinator.status()
+        self.assertFalse(status["failed"])
+        self.assertEqual(status["tasks"]["top"]["output"], "top\n")
+        self.assertTrue(all(x["worker"] in self.workers for x in status["tasks"].values()))
+        for process in self.workers.values():
+            self.assertEqual(process.wait(5), 0)  # workers exit when everything is done
+
+    def test_late_coordinator(self):
+        self.start(["top"], workers=1, delay=1.0)  # workers wait for it instead of exiting
+        self.assertTrue(self.coordinator.finished.wait(10))
+        self.assertFalse(self.coordinator.failed)
+        for process in self.workers.values():
+            self.assertEqual(process.wait(5), 0)
+
+    def test_retry(self):
+        self.start(["long"], workers=2, worker_timeout=0.5)
+        deadline = time.monotonic() + 10
+        while self.coordinator.tasks["long"].worker is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first = self.coordinator.tasks["long"].worker
+        self.workers[first].send_signal(signal.SIGKILL)
+        self.assertTrue(self.coordinator.finished.wait(10))
+        task = self.coordinator.tasks["long"]
+        self.assertEqual((task.status, task.attempts, task.output), (skeleton_cluster.OK, 2, "long\n"))
+        self.assertNotEqual(task.worker, first)
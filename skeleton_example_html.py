@@ -1,27 +1,61 @@
 #!/usr/bin/env python3
 
-import subprocess
+import argparse
+import json
+import os
 import sys
+import time
 from html import escape
 from http import HTTPStatus
-from http.server import ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlencode
 
 import with_html_stack
-from skeleton import PreHandler
+from skeleton import Admission, HTTPError, PreHandler, cached_response, serve, single_flight
+from skeleton_catalogue import Catalogue, Schema
+from skeleton_history import History
+from skeleton_jobs import Job, JobManager, iter_events, iter_log
+from skeleton_logview import line_html, open_index
+from skeleton_watch import check_report
 
 
 class HTMLHandlerExample(PreHandler):
+    # set from open_state by run: importing the module (tests, skeleton_bench.py, SIGHUP) opens nothing
+    catalogue: Optional[Catalogue] = None
+    history: Optional[History] = None
+    schema: Optional[Schema] = None  # annotated with durations of the last runs
+    jobs: Optional[JobManager] = None
+    history_page_size = 50
+    log_page_size = 100  # lines
+    watch_report: Optional[dict] = None  # the last run of skeleton_watch.py, sent by it
+
     def do_GET(self):
         self.do_POST()
 
     def do_POST(self):
-        if self.path == "/":
+        if self.route == "/":
             self.show_index()
-        elif self.path == "/command/":
+        elif self.route == "/command/":
             self.show_commands()
-        elif self.path == "/schema/":
+        elif self.route == "/schema/":
             self.show_schema()
-        elif self.path == "/favicon.ico":
+        elif self.route == "/job/" and self.command == "POST":
+            self.start_job()
+        elif self.route == "/job/":
+            self.show_jobs()
+        elif self.route.startswith("/job/"):
+            self.show_job()
+        elif self.route == "/history/":
+            self.show_history()
+        elif self.route == "/watch/" and self.command == "POST":
+            self.save_watch_report()
+        elif self.route == "/watch/":
+            self.show_watch_report()
+        elif self.route.startswith("/history/") and self.route.endswith(("/log", "/view")):
+            self.show_history_log()
+        elif self.route == "/metrics":
+            self.return_metrics()
+        elif self.route == "/favicon.ico":
             self.return_content(HTTPStatus.NOT_FOUND, "text/plain", b"")
         else:
             self.show_bad_path()
@@ -37,17 +71,21 @@ class HTMLHandlerExample(PreHandler):
                     doc("a", "View commands", href="/command/")
                 with doc("p"):
                     doc("a", "View dependencies of commands", href="/schema/")
+                with doc("p"):
+                    doc("a", "View started commands", href="/job/")
+                with doc("p"):
+                    doc("a", "View history of runs", href="/history/")
+                with doc("p"):
+                    doc("a", "View the last run of watch mode", href="/watch/")
+                with doc("p"):
+                    doc("a", "View server metrics", href="/metrics")
 
         content = doc.content(with_html_stack.DEV_PARAMS)
         self.return_content(HTTPStatus.OK, "text/html", content)
 
+    @single_flight()
     def show_commands(self):
-        commands = []
-        output = subprocess.check_output(["./skeleton.sh", "usage"]).decode()
-        for item in output.splitlines():
-            cols = item.split(maxsplit=1)
-            if len(cols) == 2:
-                commands.append(cols)
+        commands = [(x.name, x.help) for x in self.catalogue.tasks().values() if x.help and not x.name.startswith("_")]
 
         doc = with_html_stack.HTMLDocument()
         with doc("html", lang="en"):
@@ -64,14 +102,293 @@ class HTMLHandlerExample(PreHandler):
                     for command, description in commands:
                         with doc("tr"):
                             doc("td", command)
-                            doc("td", description)
+                            doc("td", escape(description))
+                            with doc("td"):
+                                with doc("form", method="post", action="/job/"):
+                                    doc("input", type="hidden", _name="task", value=command)
+                                    doc("input", type="submit", value="Run")
 
         content = doc.content(with_html_stack.DEV_PARAMS)
         self.return_content(HTTPStatus.OK, "text/html", content)
 
+    # a burst of dashboards gets one picture: one history query and at most one build of the script
+    @single_flight(timeout=60)
+    @cached_response(ttl=2)
     def show_schema(self):
-        svg = subprocess.check_output("./skeleton.sh _make_dot_file | dot -Tsvg", shell=True)
-        self.return_content(HTTPStatus.OK, "image/svg+xml; charset=us-ascii", svg)
+        self.return_content(HTTPStatus.OK, "image/svg+xml; charset=us-ascii", self.schema.svg())
+
+    def start_job(self):
+        form = parse_qs((self.read_data() or b"").decode("UTF-8", errors="replace"))
+        name = form.get("task", [""])[-1]
+        task = self.catalogue.tasks().get(name)
+        if task is None or task.help is None or name.startswith("_"):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"no such command: {name}")
+        job = self.jobs.start(name)
+        self.return_redirect(f"/job/{job.id}")
+
+    def show_jobs(self):
+        doc = with_html_stack.HTMLDocument()
+        with doc("html", lang="en"):
+            with doc("head"):
+                doc("title", "Started commands")
+                doc("meta", _http_equiv="Content-type", content="text/html; charset=utf-8")
+                doc("meta", _http_equiv="refresh", content="5")
+                with doc("style"):
+                    doc.raw("table, td, th {border: 1px solid gray; border-collapse: collapse;}")
+            with doc("body"):
+                with doc("p"):
+                    doc("a", "Go to start page", href="/")
+                with doc("p"):
+                    doc("a", "Start a command", href="/command/")
+                with doc("table"):
+                    doc("caption", "Started commands, the newest first")
+                    with doc("tr"):
+                        for title in ("Job", "Command", "Status", "Exit code", "Started", "Duration, s"):
+                            doc("th", title)
+                    for job in self.jobs.jobs():
+                        with doc("tr"):
+                            with doc("td"):
+                                doc("a", str(job.id), href=f"/job/{job.id}")
+                            doc("td", job.name)
+                            doc("td", job.status)
+                            doc("td", "" if job.returncode is None else str(job.returncode))
+                            doc("td", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job.started or job.created)))
+                            doc("td", "" if job.duration is None else f"{job.duration:.1f}")
+
+        content = doc.content(with_html_stack.DEV_PARAMS)
+        self.return_content(HTTPStatus.OK, "text/html", content, {"Cache-Control": "no-cache"})
+
+    def show_job(self):
+        # /job/<id> - page, /job/<id>/log - plain text, /job/<id>/events - server-sent events, /job/<id>/stop
+        parts = self.route.split("/")[2:]
+        job = self.jobs.get(int(parts[0])) if parts[0].isdigit() else None
+        action = parts[1] if len(parts) > 1 else ""
+        if job is None or len(parts) > 2:
+            self.show_bad_path()
+        elif action == "":
+            self.show_job_page(job)
+        elif action == "log":
+            headers = {"Cache-Control": "no-cache"}
+            self.return_stream(HTTPStatus.OK, "text/plain; charset=utf-8", iter_log(job), headers, flush=True)
+        elif action == "events":
+            # EventSource reconnects with the id of the last received event, that is offset in the output
+            offset = self.headers["Last-Event-ID"] or "0"
+            offset = int(offset) if offset.isdigit() else 0
+            headers = {"Cache-Control": "no-cache"}
+            self.return_stream(HTTPStatus.OK, "text/event-stream", iter_events(job, offset), headers, flush=True)
+        elif action == "view" and job.log_path is not None:
+            self.show_log_view(job.log_path, f"Job {job.id}: {job.name}", live=not job.done)
+        elif action == "stop" and self.command == "POST":
+            self.jobs.stop(job)
+            self.return_redirect(f"/job/{job.id}")
+        else:
+            self.show_bad_path()
+
+    def show_job_page(self, job: Job):
+        doc = with_html_stack.HTMLDocument()
+        with doc("html", lang="en"):
+            with doc("head"):
+                doc("title", f"Job {job.id}: {job.name}")
+                doc("meta", _http_equiv="Content-type", content="text/html; charset=utf-8")
+            with doc("body"):
+                with doc("p"):
+                    doc("a", "Go to start page", href="/")
+                with doc("p"):
+                    doc("a", "Started commands", href="/job/")
+                with doc("p"):
+                    doc("a", "Plain text output", href=f"/job/{job.id}/log")
+                    if job.log_path is not None:
+                        doc.raw(", ")
+                        doc("a", "pages of output", href=f"/job/{job.id}/view")
+                with doc("h1"):
+                    doc.raw(f"{job.name}: ")
+                    doc("span", job.status, _id="status")
+                with doc("form", method="post", action=f"/job/{job.id}/stop"):
+                    doc("input", type="submit", value="Stop")
+                doc("pre", "", _id="output")
+                with doc("script"):
+                    doc.raw(
+                        "const output = document.getElementById('output');"
+                        "output.textContent = '';"
+                        f"const source = new EventSource('/job/{job.id}/events');"
+                        "source.onmessage = (event) => { output.textContent += JSON.parse(event.data); };"
+                        "source.addEventListener('end', (event) => {"
+                        " const end = JSON.parse(event.data);"
+                        " document.getElementById('status').textContent = end.status + ', exit code ' + end.returncode;"
+                        " source.close(); });"
+                    )
+
+        content = doc.content(with_html_stack.DEV_PARAMS)
+        self.return_content(HTTPStatus.OK, "text/html", content, {"Cache-Control": "no-cache"})
+
+    def show_history(self):
+        # pages by keyset: "?before=<id>" shows runs older than the given one
+        task = self.query.get("task", [None])[-1] or None
+        before = self.query.get("before", [""])[-1]
+        runs = self.history.page(task, int(before) if before.isdigit() else None, limit=self.history_page_size)
+
+        doc = with_html_stack.HTMLDocument()
+        with doc("html", lang="en"):
+            with doc("head"):
+                doc("title", "History of runs")
+                doc("meta", _http_equiv="Content-type", content="text/html; charset=utf-8")
+                with doc("style"):
+                    doc.raw("table, td, th {border: 1px solid gray; border-collapse: collapse;}")
+            with doc("body"):
+                with doc("p"):
+                    doc("a", "Go to start page", href="/")
+                if task is not None:
+                    with doc("p"):
+                        doc("a", "Runs of all commands", href="/history/")
+                with doc("table"):
+                    doc("caption", "Runs" + (f" of {escape(task)}" if task is not None else "") + ", the newest first")
+                    with doc("tr"):
+                        for title in ("Run", "Command", "Started by", "Started", "Duration, s", "Exit code", "Output"):
+                            doc("th", title)
+                    for run in runs:
+                        with doc("tr"):
+                            doc("td", str(run.id))
+                            with doc("td"):
+                                doc("a", escape(run.task), href="/history/?" + urlencode({"task": run.task}))
+                            doc("td", run.source)
+                            doc("td", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run.started)))
+                            doc("td", f"{run.duration:.1f}")
+                            doc("td", run.exit_name)
+                            with doc("td"):
+                                if run.output is not None:
+                                    doc("a", "log", href=f"/history/{run.id}/log")
+                                    doc.raw(" ")
+                                    doc("a", "pages", href=f"/history/{run.id}/view")
+                if len(runs) == self.history_page_size:
+                    query = {"before": runs[-1].id}
+                    if task is not None:
+                        query["task"] = task
+                    with doc("p"):
+                        doc("a", "Older runs", href="/history/?" + urlencode(query))
+
+        content = doc.content(with_html_stack.DEV_PARAMS)
+        self.return_content(HTTPStatus.OK, "text/html", content, {"Cache-Control": "no-cache"})
+
+    def show_history_log(self):
+        # /history/<id>/log - plain text, /history/<id>/view - pages
+        run_id = self.route.split("/")[2]
+        run = self.history.get(int(run_id)) if run_id.isdigit() else None
+        log_dir = os.path.abspath(self.jobs.log_dir or "") + os.sep
+        if run is None or run.output is None or not os.path.abspath(run.output).startswith(log_dir):
+            self.show_bad_path()
+            return
+        try:
+            if self.route.endswith("/view"):
+                self.show_log_view(run.output, f"Run {run.id}: {run.task}")
+            else:
+                self.return_file(run.output, "text/plain; charset=utf-8", {"Cache-Control": "no-cache"})
+        except (HTTPError, FileNotFoundError):  # removed already
+            self.show_bad_path()
+
+    def show_log_view(self, path: str, title: str, live: bool = False):
+        # "?start=N" - page from line N (starts with 1), "?q=text" - search from line "start", no "start" - the tail
+        index = open_index(path)
+        size = self.log_page_size
+        start = self.query.get("start", [""])[-1]
+        needle = self.query.get("q", [""])[-1]
+        if needle:
+            found = index.search(needle.encode("UTF-8"), int(start) - 1 if start.isdigit() else 0, size)
+        elif start.isdigit():
+            found = list(enumerate(index.lines(max(int(start) - 1, 0), size), max(int(start) - 1, 0)))
+        else:
+            first, lines = index.tail(size)
+            found = list(enumerate(lines, first))
+        count = index.count()
+        first = found[0][0] + 1 if found else 1
+
+        doc = with_html_stack.HTMLDocument()
+        with doc("html", lang="en"):
+            with doc("head"):
+                doc("title", escape(title))
+                doc("meta", _http_equiv="Content-type", content="text/html; charset=utf-8")
+                if live and not start and not needle:
+                    doc("meta", _http_equiv="refresh", content="5")
+                with doc("style"):
+                    doc.raw("td {font-family: monospace; white-space: pre-wrap; vertical-align: top;}")
+                    doc.raw("td.number {text-align: right; color: gray; padding-right: 1em;}")
+            with doc("body"):
+                with doc("p"):
+                    doc("a", "Go to start page", href="/")
+                doc("h1", escape(title))
+                with doc("form", method="get"):
+                    doc("input", type="text", _name="q", value=escape(needle, quote=True))
+                    doc("input", type="submit", value="Search")
+                with doc("p"):
+                    doc.raw(f"{count} lines: ")
+                    doc("a", "first", href="?start=1")
+                    doc.raw(" ")
+                    doc("a", "previous", href=f"?start={max(first - size, 1)}")
+                    doc.raw(" ")
+                    doc("a", "next", href=f"?start={first + size}")
+                    doc.raw(" ")
+                    doc("a", "last", href="?")
+                    if needle and len(found) == size:
+                        doc.raw(" ")
+                        more = urlencode({"q": needle, "start": found[-1][0] + 2})
+                        doc("a", "more matches", href=f"?{more}")
+                with doc("table"):
+                    for number, line in found:
+                        with doc("tr", _id=f"L{number + 1}"):
+                            with doc("td", _class="number"):
+                                doc("a", str(number + 1), href=f"?start={max(number + 1 - 10, 1)}#L{number + 1}")
+                            doc("td", line_html(line))
+
+        # the lines are preformatted: no indents added by DEV_PARAMS
+        content = doc.content(with_html_stack.PROD_PARAMS)
+        self.return_content(HTTPStatus.OK, "text/html", content, {"Cache-Control": "no-cache"})
+
+    def save_watch_report(self):
+        try:
+            report = json.loads(self.read_data() or b"")
+        except ValueError as exc:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"bad report: {exc}") from exc
+        try:
+            check_report(report)
+        except ValueError as exc:  # otherwise every page of /watch/ would fail until the next report
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"bad report: {exc}") from exc
+        type(self).watch_report = report
+        self.return_content(HTTPStatus.OK, "text/plain", b"saved\n")
+
+    def show_watch_report(self):
+        report = self.watch_report
+        doc = with_html_stack.HTMLDocument()
+        with doc("html", lang="en"):
+            with doc("head"):
+                doc("title", "Watch mode")
+                doc("meta", _http_equiv="Content-type", content="text/html; charset=utf-8")
+                doc("meta", _http_equiv="refresh", content="2")
+                with doc("style"):
+                    doc.raw("table, td, th {border: 1px solid gray; border-collapse: collapse;}")
+            with doc("body"):
+                with doc("p"):
+                    doc("a", "Go to start page", href="/")
+                if report is None:
+                    doc("p", "No runs yet, start: ./skeleton.sh watch --server http://localhost:8000 task...")
+                else:
+                    finished = time.localtime(report.get("finished") or 0)
+                    targets = escape(" ".join(map(str, report.get("targets", []))))
+                    doc("h1", f"{targets}: finished at {time.strftime('%Y-%m-%d %H:%M:%S', finished)}")
+                    with doc("table"):
+                        with doc("tr"):
+                            for title in ("Command", "Status", "Exit code", "Duration, s", "Reason"):
+                                doc("th", title)
+                        for name, run in report["runs"].items():
+                            with doc("tr"):
+                                with doc("td"):
+                                    doc("a", escape(name), href="/history/?" + urlencode({"task": name}))
+                                doc("td", escape(str(run.get("status"))))
+                                doc("td", "" if run.get("returncode") is None else escape(str(run["returncode"])))
+                                started, ended = run.get("started"), run.get("finished")
+                                doc("td", f"{ended - started:.1f}" if started and ended else "")
+                                doc("td", escape(str(run.get("reason") or "")))
+
+        content = doc.content(with_html_stack.DEV_PARAMS)
+        self.return_content(HTTPStatus.OK, "text/html", content, {"Cache-Control": "no-cache"})
 
     def show_bad_path(self):
         doc = with_html_stack.HTMLDocument()
@@ -88,11 +405,47 @@ class HTMLHandlerExample(PreHandler):
         self.return_content(HTTPStatus.NOT_FOUND, "text/html", content)
 
 
+def open_state(
+    script: str = "./skeleton.sh", history_path: str = ".skeleton_history.sqlite", log_dir: str = ".skeleton_logs"
+) -> Dict[str, object]:
+    """Class attributes of HTMLHandlerExample which keep state, created once per process."""
+    catalogue = Catalogue(script)
+    history = History(history_path)  # shared with skeleton_runner.py
+    return {
+        "catalogue": catalogue,
+        "history": history,
+        "schema": Schema(catalogue, history),
+        "jobs": JobManager(script, max_running=2, history=history, log_dir=log_dir),
+    }
+
+
 def run():
+    parser = argparse.ArgumentParser(description="Example HTML server at localhost:8000.")
+    parser.add_argument("--admission", action="store_true", help="limit requests per client")
+    args = parser.parse_args()
+
     address = ("localhost", 8000)
     print(f"Running on {address}", file=sys.stderr)
-    httpd = ThreadingHTTPServer(address, HTMLHandlerExample)
-    httpd.serve_forever()
+    # the same history, running jobs and so on are given to the handler class imported again on SIGHUP
+    state = open_state()
+    # no max_active: logs and events of jobs are streamed as long as the jobs run and would keep the slots
+    state["admission"] = Admission(rate=50, burst=100, routes={"/schema/": (2.0, 10)}) if args.admission else None
+    configured: List[type] = []
+
+    def configure(handler):
+        for name, value in state.items():
+            setattr(handler, name, value)
+        if configured:
+            handler.watch_report = configured[-1].watch_report
+        configured[:] = [handler]
+
+    httpd = None
+    try:
+        httpd = serve("skeleton_example_html:HTMLHandlerExample", address, configure=configure)
+    finally:
+        # after SIGUSR2 the new process serves pages, jobs started here finish here and get to the history;
+        # otherwise exit waits for the running jobs, so they are stopped
+        state["jobs"].shutdown(stop=httpd is None or not httpd.upgraded)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 
+import argparse
 import datetime
 import random
 import sys
 import threading
 import time
 from http import HTTPStatus
-from http.server import ThreadingHTTPServer
 
-from skeleton import JSONHandler
+from skeleton import AccessLog, Admission, HTTPError, JSONHandler, serve
 
 
 class ExampleHanler(JSONHandler):
@@ -17,12 +17,19 @@ class ExampleHanler(JSONHandler):
 
     def do_POST(self):
         try:
-            if self.path == "/":
+            if self.route == "/":
                 self.show_index()
-            elif self.path == "/sleep":
+            elif self.route == "/sleep":
                 self.show_sleep()
+            elif self.route == "/count":
+                self.show_count()
+            elif self.route == "/metrics":
+                self.return_metrics()
             else:
                 self.show_bad_path()
+        except HTTPError as exc:
+            self.close_connection = True  # some part of request body may be left unread
+            self.show_exception(exc, exc.status)
         except Exception as exc:
             self.show_exception(exc)
 
@@ -39,12 +46,12 @@ class ExampleHanler(JSONHandler):
             },
         )
 
-    def show_exception(self, exc):
+    def show_exception(self, exc, status=HTTPStatus.INTERNAL_SERVER_ERROR):
         return self.return_json(
-            HTTPStatus.INTERNAL_SERVER_ERROR,
+            status,
             {
                 "error": {
-                    "message": "Internal server error",
+                    "message": status.phrase,
                     "details": str(exc),
                 },
                 "nagivation": {
@@ -61,6 +68,29 @@ class ExampleHanler(JSONHandler):
             {
                 "nagivation": {
                     "sleeper": self.host + "/sleep",
+                    "metrics": self.host + "/metrics",
+                },
+            },
+        )
+
+    def show_count(self):
+        # Try it:
+        #   $ seq 1000000 | sed 's/.*/{"n": &}/' | curl --data-binary @- -H "Transfer-Encoding: chunked" localhost:8001/count
+        # Records are processed one by one, so memory consumption doesn't depend on their number.
+        count = 0
+        total = 0
+        for record in self.read_json_lines():
+            count += 1
+            total += record.get("n", 0) if isinstance(record, dict) else 0
+        return self.return_json(
+            HTTPStatus.OK,
+            {
+                "counter": {
+                    "records": count,
+                    "sum of n": total,
+                },
+                "nagivation": {
+                    "index": self.host + "/",
                 },
             },
         )
@@ -86,10 +116,26 @@ class ExampleHanler(JSONHandler):
 
 
 def run():
+    parser = argparse.ArgumentParser(description="Example JSON server at localhost:8001.")
+    parser.add_argument("--admission", action="store_true", help="limit requests per client and queue them fairly")
+    args = parser.parse_args()
+
     address = ("localhost", 8001)
     print(f"Running at {address}", file=sys.stderr)
-    httpd = ThreadingHTTPServer(address, ExampleHanler)
-    httpd.serve_forever()
+    # log_message of show_sleep and lines of requests are written by a background thread,
+    # the same log is kept by the handler class imported again on SIGHUP
+    access_log = AccessLog()
+    # a client polling /sleep in a loop gets 429 instead of taking every thread, the rest wait for slots in turn
+    admission = Admission(rate=50, burst=100, routes={"/sleep": (1.0, 5)}, max_active=16) if args.admission else None
+
+    def configure(handler):
+        handler.access_log = access_log
+        handler.admission = admission
+
+    try:
+        serve("skeleton_example_json:ExampleHanler", address, configure=configure)
+    finally:
+        access_log.close()
 
 
 if __name__ == "__main__":
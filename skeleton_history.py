@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""History of task runs (by skeleton_runner and by the HTML server) in sqlite database.
+
+Rows are only appended, one per finished run. Pages are selected by keyset ("older than run N"),
+not by OFFSET, so every page costs an index lookup however long the history is.
+
+    $ ./skeleton_history.py
+    $ ./skeleton_history.py --task make_my_day --limit 5
+"""
+
+import argparse
+import signal
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+_DEFAULT_LIMIT = 50
+# in order of RunRecord arguments
+_COLUMNS = "task, source, started, finished, returncode, output, cpu_time, max_rss, id"
+
+
+def exit_name(returncode: Optional[int]) -> str:
+    # like "signal_name" of bashrc: SIG<name> for killed processes (negative code) and for shells (128 + number)
+    if returncode is None:
+        return ""
+    number = -returncode if returncode < 0 else returncode - 128 if returncode > 128 else 0
+    if number:
+        try:
+            return signal.Signals(number).name
+        except ValueError:
+            pass
+    return str(returncode)
+
+
+class RunRecord:
+    def __init__(
+        self,
+        task: str,
+        source: str,
+        started: float,
+        finished: float,
+        returncode: Optional[int],
+        output: Optional[str] = None,
+        cpu_time: Optional[float] = None,
+        max_rss: Optional[int] = None,
+        run_id: Optional[int] = None,
+    ) -> None:
+        self.id = run_id
+        self.task = task
+        self.source = source  # "runner" or "server"
+        self.started = started
+        self.finished = finished
+        self.returncode = returncode  # None if the task was not started at all
+        self.output = output  # path of the log file, None if the output is not kept
+        self.cpu_time = cpu_time  # user and system, seconds
+        self.max_rss = max_rss  # peak resident memory, bytes
+
+    def __repr__(self) -> str:
+        return f"RunRecord({self.task!r}, id={self.id}, source={self.source!r}, returncode={self.returncode})"
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+    @property
+    def exit_name(self) -> str:
+        return exit_name(self.returncode)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "task": self.task,
+            "source": self.source,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": self.duration,
+            "returncode": self.returncode,
+            "exit": self.exit_name,
+            "output": self.output,
+            "cpu_time": self.cpu_time,
+            "max_rss": self.max_rss,
+        }
+
+
+class History:
+    def __init__(self, path: str = ".skeleton_history.sqlite") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # the runner and the server write the same file: wait for each other instead of failing
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")  # readers do not block the writer
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " id INTEGER PRIMARY KEY,"
+                " task TEXT NOT NULL,"
+                " source TEXT NOT NULL,"
+                " started REAL NOT NULL,"
+                " finished REAL NOT NULL,"
+                " returncode INTEGER,"
+                " output TEXT,"
+                " cpu_time REAL,"
+                " max_rss INTEGER)"
+            )
+            # databases of older versions
+            columns = {x[1] for x in self._db.execute("PRAGMA table_info(runs)")}
+            for column, kind in (("cpu_time", "REAL"), ("max_rss", "INTEGER")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE runs ADD COLUMN {column} {kind}")
+            self._db.execute("CREATE INDEX IF NOT EXISTS runs_by_task ON runs (task, id)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS runs_by_time ON runs (started)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def add(self, record: RunRecord) -> int:
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                f"INSERT INTO runs ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    record.task,
+                    record.source,
+                    record.started,
+                    record.finished,
+                    record.returncode,
+                    record.output,
+                    record.cpu_time,
+                    record.max_rss,
+                    record.id,
+                ),
+            )
+        assert cursor.lastrowid is not None
+        record.id = cursor.lastrowid
+        return record.id
+
+    def get(self, run_id: int) -> Optional[RunRecord]:
+        with self._lock:
+            row = self._db.execute(f"SELECT {_COLUMNS} FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return RunRecord(*row) if row is not None else None
+
+    def last_id(self) -> int:
+        # changes when a run is recorded by any process, 0 for empty history
+        with self._lock:
+            row = self._db.execute("SELECT MAX(id) FROM runs").fetchone()
+        return row[0] or 0
+
+    def latest(self, tasks: Iterable[str]) -> Dict[str, RunRecord]:
+        # the last run of every task, one index lookup per task
+        result = {}
+        with self._lock:
+            for task in tasks:
+                query = f"SELECT {_COLUMNS} FROM runs WHERE task = ? ORDER BY id DESC LIMIT 1"
+                row = self._db.execute(query, (task,)).fetchone()
+                if row is not None:
+                    result[task] = RunRecord(*row)
+        return result
+
+    def page(
+        self,
+        task: Optional[str] = None,
+        before: Optional[int] = None,
+        since: Optional[float] = None,
+        limit: int = _DEFAULT_LIMIT,
+    ) -> List[RunRecord]:
+        """The newest runs with id less than "before", of one task and started after "since" if given."""
+        conditions: List[str] = []
+        arguments: List[object] = []
+        if task is not None:
+            conditions.append("task = ?")
+            arguments.append(task)
+        if before is not None:
+            conditions.append("id < ?")
+            arguments.append(before)
+        if since is not None:
+            conditions.append("started >= ?")
+            arguments.append(since)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        query = f"SELECT {_COLUMNS} FROM runs{where} ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, arguments + [limit]).fetchall()
+        return [RunRecord(*x) for x in rows]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", default=".skeleton_history.sqlite", help="path to the database")
+    parser.add_argument("--task", help="runs of this task only")
+    parser.add_argument("--before", type=int, help="runs older than this one")
+    parser.add_argument("--limit", type=int, default=_DEFAULT_LIMIT, help="number of runs to show")
+    args = parser.parse_args()
+
+    history = History(args.history)
+    for record in history.page(args.task, args.before, limit=args.limit):
+        started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.started))
+        duration = f"{record.duration:.2f} s"
+        print(f"{record.id:>8} {started} {duration:>11} {record.exit_name:>8} {record.source:<6} {record.task}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import skeleton_history
+
+
+class TestExitName(unittest.TestCase):
+    def test_exit_name(self):
+        self.assertEqual(skeleton_history.exit_name(0), "0")
+        self.assertEqual(skeleton_history.exit_name(3), "3")
+        self.assertEqual(skeleton_history.exit_name(-15), "SIGTERM")
+        self.assertEqual(skeleton_history.exit_name(130), "SIGINT")  # bash reports 128 + signal number
+        self.assertEqual(skeleton_history.exit_name(255), "255")
+        self.assertEqual(skeleton_history.exit_name(None), "")
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.history = skeleton_history.History(os.path.join(self.tmpdir, "history.sqlite"))
+        for number in range(10):
+            task = "even" if number % 2 == 0 else "odd"
+            self.history.add(skeleton_history.RunRecord(task, "runner", 100.0 + number, 101.5 + number, number))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get(self):
+        record = self.history.get(4)
+        self.assertEqual((record.task, record.started, record.duration, record.returncode), ("odd", 103.0, 1.5, 3))
+        self.assertIsNone(self.history.get(100))
+        self.assertEqual(self.history.last_id(), 10)
+
+    def test_pages(self):
+        first = self.history.page(limit=4)
+        self.assertEqual([x.id for x in first], [10, 9, 8, 7])
+        second = self.history.page(before=first[-1].id, limit=4)
+        self.assertEqual([x.id for x in second], [6, 5, 4, 3])
+        self.assertEqual([x.id for x in self.history.page(before=3, limit=4)], [2, 1])
+
+    def test_filters(self):
+        self.assertEqual([x.id for x in self.history.page("odd", before=8)], [6, 4, 2])
+        self.assertEqual([x.id for x in self.history.page(since=107.0)], [10, 9, 8])
+
+    def test_indexes(self):
+        # pages must not scan the whole table
+        plan = self.history._db.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM runs WHERE task = ? AND id < ? ORDER BY id DESC LIMIT 50", ("odd", 8)
+        ).fetchall()
+        self.assertIn("runs_by_task", str(plan))
+        self.assertNotIn("TEMP B-TREE", str(plan))
+
+
+class TestUpgrade(unittest.TestCase):
+    def test_old_database(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "history.sqlite")
+            db = sqlite3.connect(path)
+            db.execute(
+                "CREATE TABLE runs (id INTEGER PRIMARY KEY, task TEXT NOT NULL, source TEXT NOT NULL,"
+                " started REAL NOT NULL, finished REAL NOT NULL, returncode INTEGER, output TEXT)"
+            )
+            db.execute("INSERT INTO runs (task, source, started, finished) VALUES ('old', 'runner', 1.0, 2.0)")
+            db.commit()
+            db.close()
+
+            history = skeleton_history.History(path)
+            history.add(skeleton_history.RunRecord("new", "runner", 3.0, 4.0, 0, cpu_time=0.5, max_rss=1024))
+            records = history.page()
+            history.close()
+            self.assertEqual([(x.task, x.cpu_time) for x in records], [("new", 0.5), ("old", None)])
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""Tasks of skeleton.sh started from the HTML server and run in background.
+
+At most "max_running" jobs are run at once, the rest wait in queue. Output (stdout and stderr together)
+of every job is kept in a ring buffer of limited size, readers follow it by absolute offsets
+and wait for new data, so any number of browsers can watch the same job.
+"""
+
+import codecs
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Deque, Iterator, List, Optional, Tuple
+
+from skeleton_history import History, RunRecord
+from skeleton_runner import exit_code
+
+QUEUED = "queued"
+RUNNING = "running"
+OK = "ok"
+FAILED = "failed"
+STOPPED = "stopped"
+
+_READ_SIZE = 64 * 1024
+
+
+class RingBuffer:
+    """The last "max_size" bytes of a growing stream, addressed by offset from the stream start."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.start = 0  # offset of the first kept byte
+        self.end = 0  # offset after the last byte
+        self._chunks: Deque[bytes] = deque()
+
+    def append(self, data: bytes) -> None:
+        if not data:
+            return
+        self._chunks.append(data)
+        self.end += len(data)
+        while self.end - self.start > self.max_size:
+            dropped = self._chunks.popleft()
+            extra = self.end - self.start - self.max_size
+            if len(dropped) > extra:
+                self._chunks.appendleft(dropped[extra:])
+                dropped = dropped[:extra]
+            self.start += len(dropped)
+
+    def read(self, offset: int) -> Tuple[bytes, int]:
+        # data from "offset" (or from the first kept byte if it is dropped already) and offset after it
+        skip = max(offset - self.start, 0)
+        pieces = []
+        for chunk in self._chunks:
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            pieces.append(chunk[skip:] if skip else chunk)
+            skip = 0
+        return b"".join(pieces), self.end
+
+
+class Job:
+    def __init__(self, job_id: int, name: str, command: List[str], buffer_size: int) -> None:
+        self.id = job_id
+        self.name = name
+        self.command = command
+        self.status = QUEUED
+        self.returncode: Optional[int] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.output = RingBuffer(buffer_size)
+        self.process: Optional[subprocess.Popen] = None
+        self.log_path: Optional[str] = None  # file with the whole output, see JobManager.log_dir
+        self.stopping = False
+        self.cpu_time: Optional[float] = None
+        self.max_rss: Optional[int] = None
+        self.changed = threading.Condition()  # notified on new output and on the end
+
+    @property
+    def done(self) -> bool:
+        return self.status in (OK, FAILED, STOPPED)
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "returncode": self.returncode,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "output_size": self.output.end,
+            "cpu_time": self.cpu_time,
+            "max_rss": self.max_rss,
+        }
+
+    def wait_output(self, offset: int, timeout: Optional[float] = None) -> Tuple[bytes, int]:
+        # output from "offset", waits until there is something new or the job is done
+        with self.changed:
+            self.changed.wait_for(lambda: self.output.end > offset or self.done, timeout)
+            return self.output.read(offset)
+
+    def iter_output(self, offset: int = 0, keepalive: Optional[float] = None) -> Iterator[Tuple[bytes, int]]:
+        """Pieces of output with offsets after them until the job is done, empty piece every "keepalive" seconds."""
+        while True:
+            data, offset = self.wait_output(offset, keepalive)
+            if not data and self.done:
+                return
+            yield data, offset
+
+
+def iter_log(job: Job, offset: int = 0) -> Iterator[bytes]:
+    # raw output for chunked response
+    for data, _ in job.iter_output(offset):
+        yield data
+
+
+def iter_events(job: Job, offset: int = 0, keepalive: float = 15.0) -> Iterator[bytes]:
+    """Output as server-sent events: "id" is the offset to resume from (Last-Event-ID), "end" event at the end."""
+    decoder = codecs.getincrementaldecoder("UTF-8")(errors="replace")
+    for data, offset in job.iter_output(offset, keepalive):
+        if not data:
+            yield b": keepalive\n\n"  # proxies and browsers drop silent connections
+            continue
+        text = json.dumps(decoder.decode(data))
+        yield f"id: {offset}\ndata: {text}\n\n".encode("UTF-8")
+    end = json.dumps({"status": job.status, "returncode": job.returncode})
+    yield f"event: end\ndata: {end}\n\n".encode("UTF-8")
+
+
+class JobManager:
+    def __init__(
+        self,
+        script: str = "./skeleton.sh",
+        max_running: int = 2,
+        buffer_size: int = 1024 * 1024,
+        keep: int = 100,
+        history: Optional[History] = None,
+        log_dir: Optional[str] = None,
+    ) -> None:
+        self.script = script
+        self.buffer_size = buffer_size
+        self.keep = keep  # finished jobs to remember
+        self.history = history  # where to record finished jobs
+        self.log_dir = log_dir  # where to keep the whole output of jobs, None means the ring buffer only
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[int, Job]" = OrderedDict()
+        self._last_id = 0
+        self._pool = ThreadPoolExecutor(max_workers=max(max_running, 1), thread_name_prefix="job")
+
+    def start(self, name: str) -> Job:
+        with self._lock:
+            self._last_id += 1
+            job = Job(self._last_id, name, [self.script, name], self.buffer_size)
+            self._jobs[job.id] = job
+            self._forget_old()
+        self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        # the newest first
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def stop(self, job: Job) -> None:
+        with job.changed:
+            if job.status == QUEUED:
+                self._finish(job, STOPPED)
+            elif job.status == RUNNING:
+                job.stopping = True
+                if job.process is not None:
+                    try:
+                        os.killpg(job.process.pid, signal.SIGTERM)
+                    except ProcessLookupError:
+                        pass
+
+    def shutdown(self, stop: bool = True) -> None:
+        # stop=False lets queued and running jobs finish, like when another process takes over the server
+        if stop:
+            for job in self.jobs():
+                self.stop(job)
+        self._pool.shutdown(wait=True)
+
+    def _forget_old(self) -> None:
+        finished = [x for x in self._jobs.values() if x.done]
+        for job in finished[: max(len(finished) - self.keep, 0)]:
+            del self._jobs[job.id]
+
+    def _finish(self, job: Job, status: str) -> None:
+        # job.changed is locked by caller
+        job.status = status
+        job.finished = time.time()
+        job.changed.notify_all()
+
+    def _run(self, job: Job) -> None:
+        with job.changed:
+            if job.status != QUEUED:
+                return  # stopped while waiting
+            job.status = RUNNING
+            job.started = time.time()
+            job.changed.notify_all()
+
+        log = None
+        if self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(job.started))
+            job.log_path = os.path.join(self.log_dir, f"{stamp}-{job.id}-{job.name}.log")
+            log = open(job.log_path, "ab")
+        try:
+            self._execute(job, log)
+        finally:
+            if log is not None:
+                log.close()
+        if self.history is not None:
+            finished = job.finished or time.time()
+            record = RunRecord(
+                job.name, "server", job.started, finished, job.returncode, job.log_path, job.cpu_time, job.max_rss
+            )
+            self.history.add(record)
+
+    def _execute(self, job: Job, log: Optional[BinaryIO]) -> None:
+        try:
+            # own process group: stop terminates the whole tree of the task
+            process = subprocess.Popen(
+                job.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True
+            )
+        except OSError as exc:
+            with job.changed:
+                job.output.append(f"{exc}\n".encode("UTF-8"))
+                self._finish(job, FAILED)
+            return
+        with job.changed:
+            job.process = process
+            if job.stopping:  # stopped before the process is started
+                os.killpg(process.pid, signal.SIGTERM)
+
+        assert process.stdout is not None
+        while True:
+            data = os.read(process.stdout.fileno(), _READ_SIZE)  # returns as soon as something is there
+            if not data:
+                break
+            if log is not None:
+                log.write(data)
+                log.flush()  # for readers of the file while the job is running
+            with job.changed:
+                job.output.append(data)
+                job.changed.notify_all()
+        process.stdout.close()
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        returncode = exit_code(wait_status)
+
+        with job.changed:
+            job.returncode = returncode
+            job.cpu_time = usage.ru_utime + usage.ru_stime
+            job.max_rss = usage.ru_maxrss * 1024  # KiB on Linux
+            if returncode == 0:
+                status = OK
+            else:
+                status = STOPPED if returncode == -signal.SIGTERM else FAILED
+            self._finish(job, status)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import skeleton_history
+import skeleton_jobs
+
+_SCRIPT = """\
+#!/usr/bin/env bash
+
+hello() {
+    echo "Hello"
+    echo "to stderr" >&2
+}
+
+slow() {
+    echo "started"
+    sleep 0.3
+    echo "finished"
+}
+
+forever() {
+    echo "started"
+    sleep 30
+}
+
+broken() {
+    exit 3
+}
+
+"$@"
+"""
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_read(self):
+        buffer = skeleton_jobs.RingBuffer(8)
+        buffer.append(b"abc")
+        buffer.append(b"def")
+        self.assertEqual(buffer.read(0), (b"abcdef", 6))
+        self.assertEqual(buffer.read(4), (b"ef", 6))
+        self.assertEqual(buffer.read(6), (b"", 6))
+
+    def test_drop_old(self):
+        buffer = skeleton_jobs.RingBuffer(8)
+        buffer.append(b"abcdef")
+        buffer.append(b"ghijk")
+        self.assertEqual((buffer.start, buffer.end), (3, 11))
+        self.assertEqual(buffer.read(0), (b"defghijk", 11))  # dropped part is skipped
+        self.assertEqual(buffer.read(7), (b"hijk", 11))
+        buffer.append(b"0123456789")
+        self.assertEqual(buffer.read(0), (b"23456789", 21))
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "skeleton.sh")
+        with open(self.script, "w") as script:
+            script.write(_SCRIPT)
+        os.chmod(self.script, 0o755)
+        self.manager = skeleton_jobs.JobManager(self.script, max_running=2)
+
+    def tearDown(self):
+        self.manager.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_output(self):
+        job = self.manager.start("hello")
+        self.assertEqual(b"".join(skeleton_jobs.iter_log(job)), b"Hello\nto stderr\n")
+        self.assertEqual(job.status, skeleton_jobs.OK)
+        self.assertEqual(job.returncode, 0)
+        self.assertIs(self.manager.get(job.id), job)
+
+    def test_failure(self):
+        job = self.manager.start("broken")
+        list(skeleton_jobs.iter_log(job))
+        self.assertEqual((job.status, job.returncode), (skeleton_jobs.FAILED, 3))
+
+    def test_follow(self):
+        job = self.manager.start("slow")
+        pieces = list(skeleton_jobs.iter_log(job))
+        self.assertGreater(len(pieces), 1)  # "started" is read before the task is finished
+        self.assertEqual(b"".join(pieces), b"started\nfinished\n")
+
+    def test_limit_and_stop(self):
+        jobs = [self.manager.start("forever") for _ in range(3)]
+        jobs[0].wait_output(0, timeout=5)
+        jobs[1].wait_output(0, timeout=5)
+        self.assertEqual([x.status for x in jobs], [skeleton_jobs.RUNNING, skeleton_jobs.RUNNING, skeleton_jobs.QUEUED])
+        self.assertEqual(self.manager.jobs(), list(reversed(jobs)))
+
+        self.manager.stop(jobs[2])
+        self.assertEqual(jobs[2].status, skeleton_jobs.STOPPED)
+        started = time.monotonic()
+        self.manager.stop(jobs[0])
+        self.assertEqual(b"".join(skeleton_jobs.iter_log(jobs[0])), b"started\n")
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual((jobs[0].status, jobs[0].returncode), (skeleton_jobs.STOPPED, -15))
+
+    def test_drain(self):
+        jobs = [self.manager.start("slow") for _ in range(3)]
+        self.manager.shutdown(stop=False)
+        self.assertEqual([x.status for x in jobs], [skeleton_jobs.OK] * 3)
+
+    def test_events(self):
+        job = self.manager.start("hello")
+        events = b"".join(skeleton_jobs.iter_events(job)).decode().split("\n\n")
+        self.assertEqual(events[-1], "")
+        data = "".join(json.loads(x.split("data: ", 1)[1]) for x in events[:-2])
+        self.assertEqual(data, "Hello\nto stderr\n")
+        self.assertTrue(events[0].startswith("id: "))
+        self.assertEqual(events[-2], 'event: end\ndata: {"status": "ok", "returncode": 0}')
+
+        # resume after reconnection
+        events = b"".join(skeleton_jobs.iter_events(job, offset=6)).decode()
+        self.assertIn('data: "to stderr\\n"', events)
+
+    def test_history(self):
+        history = skeleton_history.History(os.path.join(self.tmpdir, "history.sqlite"))
+        self.manager.history = history
+        self.manager.log_dir = os.path.join(self.tmpdir, "logs")
+        try:
+            job = self.manager.start("hello")
+            list(skeleton_jobs.iter_log(job))
+            self.manager.shutdown()  # waits until the job is recorded
+            record = history.page()[0]
+        finally:
+            history.close()
+        self.assertEqual((record.task, record.source, record.returncode), ("hello", "server", 0))
+        self.assertEqual(record.output, job.log_path)
+        with open(record.output, "rb") as log:
+            self.assertEqual(log.read(), b"Hello\nto stderr\n")
+
+    def test_keep(self):
+        self.manager.keep = 1
+        first = self.manager.start("hello")
+        list(skeleton_jobs.iter_log(first))
+        second = self.manager.start("hello")
+        list(skeleton_jobs.iter_log(second))
+        self.manager.start("hello")
+        self.assertIsNone(self.manager.get(first.id))
+        self.assertIs(self.manager.get(second.id), second)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Pages of big log files: lines by number without reading the whole file.
+
+The file is mapped into memory and offsets of line starts are kept in an array, which is extended by the new part
+of the file only, so a log of a running task stays indexed correctly. A page of lines costs O(page size),
+search scans the mapped bytes (bytes.find in C) without decoding them.
+The offsets of a big log are saved to an index file next to it (appended as the log grows), so the next process
+showing the log does not scan it again. Logs are expected to be appended to only: a log replaced by another file
+or truncated is indexed anew.
+
+    $ ./skeleton_logview.py .skeleton_logs/20240101-120000-1-make_my_day.log --tail 20
+    $ ./skeleton_logview.py .skeleton_logs/20240101-120000-1-make_my_day.log --search error
+"""
+
+import argparse
+import bisect
+import html
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from typing import List, Optional, Tuple
+
+from skeleton import LRUCache
+
+_INDEX_HEADER = "QQ"  # device and inode of the log, then offsets of line starts
+_INDEX_SUFFIX = ".index"
+
+
+class LineIndex:
+    """Line numbers start with 0. The last line may be incomplete (no newline yet), it is a line too.
+
+    With "index_path" the offsets of logs of at least "save_min_size" bytes are kept in that file between processes.
+    """
+
+    save_min_size = 1024 * 1024  # smaller logs are scanned faster than an index file is written
+
+    def __init__(self, path: str, index_path: Optional[str] = None) -> None:
+        self.path = path
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        self._identity: Optional[Tuple[int, int]] = None  # device and inode: a rotated log is another file
+        self._offsets = array("Q", [0])  # starts of lines, the last one is the end of the last complete line
+        self._saved = 0  # offsets in the index file, 0 means it has to be written anew
+
+    def close(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._map = None
+        self._identity = None
+        self._offsets = array("Q", [0])
+        self._saved = 0
+
+    @property
+    def _size(self) -> int:
+        return len(self._map) if self._map is not None else 0
+
+    def _refresh(self) -> None:
+        # lock is held by caller
+        stat = os.stat(self.path)
+        if (stat.st_dev, stat.st_ino) != self._identity or stat.st_size < self._size:  # replaced or truncated
+            self._reset()
+            self._identity = (stat.st_dev, stat.st_ino)
+            self._load(stat.st_size)
+        if stat.st_size == self._size:
+            return
+        with open(self.path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # the whole file, it may be bigger already
+        if self._map is not None:
+            self._map.close()
+        self._map = mapped
+
+        position = self._offsets[-1]
+        while True:
+            newline = mapped.find(b"\n", position)
+            if newline < 0:
+                break
+            position = newline + 1
+            self._offsets.append(position)
+        if self.index_path is not None and stat.st_size >= self.save_min_size and len(self._offsets) > self._saved:
+            self._save(self.index_path)
+
+    def _load(self, size: int) -> None:
+        # offsets saved for the same file, unless they do not end at a line end within it
+        if self.index_path is None or size < self.save_min_size:
+            return
+        try:
+            with open(self.index_path, "rb") as index:
+                data = index.read()
+            header_size = struct.calcsize(_INDEX_HEADER)
+            if len(data) <= header_size or struct.unpack_from(_INDEX_HEADER, data) != self._identity:
+                return
+            end = header_size + (len(data) - header_size) // 8 * 8  # an append may be cut off by a crash
+            offsets = array("Q")
+            offsets.frombytes(data[header_size:end])
+            if offsets[0] != 0 or offsets[-1] > size:
+                return
+            if offsets[-1]:
+                with open(self.path, "rb") as file:
+                    file.seek(offsets[-1] - 1)
+                    if file.read(1) != b"\n":
+                        return
+        except OSError:
+            return
+        self._offsets = offsets
+        self._saved = len(offsets) if end == len(data) else 0
+
+    def _save(self, index_path: str) -> None:
+        # the new offsets are appended, the file is written anew for another log
+        try:
+            if self._saved == 0:
+                temporary = index_path + ".tmp"
+                with open(temporary, "wb") as index:
+                    index.write(struct.pack(_INDEX_HEADER, *(self._identity or (0, 0))))
+                    self._offsets.tofile(index)
+                os.replace(temporary, index_path)
+            else:
+                with open(index_path, "ab") as index:
+                    self._offsets[self._saved :].tofile(index)
+            self._saved = len(self._offsets)
+        except OSError:  # like a read-only directory: the offsets are kept in memory only
+            pass
+
+    def _count(self) -> int:
+        complete = len(self._offsets) - 1
+        return complete + 1 if self._size > self._offsets[-1] else complete
+
+    def _line(self, number: int) -> bytes:
+        assert self._map is not None
+        start = self._offsets[number]
+        if number + 1 < len(self._offsets):
+            return self._map[start : self._offsets[number + 1] - 1]
+        return self._map[start:]  # incomplete
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._count()
+
+    def lines(self, start: int, count: int) -> List[bytes]:
+        """Lines from "start" without newlines, fewer at the end of file."""
+        with self._lock:
+            self._refresh()
+            return [self._line(x) for x in range(max(start, 0), min(start + count, self._count()))]
+
+    def tail(self, count: int) -> Tuple[int, List[bytes]]:
+        # number of the first line and the last "count" lines
+        with self._lock:
+            self._refresh()
+            start = max(self._count() - count, 0)
+            return start, [self._line(x) for x in range(start, self._count())]
+
+    def search(self, needle: bytes, start: int = 0, limit: int = 100) -> List[Tuple[int, bytes]]:
+        """Numbers and text of lines containing "needle", from line "start", at most "limit" of them."""
+        result: List[Tuple[int, bytes]] = []
+        with self._lock:
+            self._refresh()
+            if not needle or self._map is None or start >= self._count():
+                return result
+            position = self._offsets[max(start, 0)]
+            while len(result) < limit:
+                found = self._map.find(needle, position)
+                if found < 0:
+                    break
+                number = bisect.bisect_right(self._offsets, found) - 1
+                result.append((number, self._line(number)))
+                if number + 1 >= len(self._offsets):
+                    break  # the incomplete line
+                position = self._offsets[number + 1]
+        return result
+
+
+def line_html(line: bytes) -> str:
+    # leading whitespace would be taken for indent by TextParams.text, so the first symbol of it is a reference
+    text = html.escape(line.decode("UTF-8", errors="replace").rstrip("\r"))
+    if text[:1].isspace():
+        text = f"&#{ord(text[0])};" + text[1:]
+    return text
+
+
+def _close_index(path: object, index: object) -> None:
+    if isinstance(index, LineIndex):
+        index.close()
+
+
+_indexes = LRUCache(16, on_evict=_close_index)
+_indexes_lock = threading.Lock()
+
+
+def open_index(path: str) -> LineIndex:
+    # indexes are kept between requests and saved next to the logs: a page of a big log does not scan it again
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = LineIndex(path, path + _INDEX_SUFFIX)
+            _indexes.put(path, index)
+        return index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="log file")
+    parser.add_argument("--start", type=int, default=0, help="the first line to show, starts with 1")
+    parser.add_argument("--count", type=int, default=50, help="number of lines to show")
+    parser.add_argument("--tail", type=int, help="show the last lines")
+    parser.add_argument("--search", help="show lines containing this text")
+    parser.add_argument("--save-index", action="store_true", help=f"keep offsets of lines in PATH{_INDEX_SUFFIX}")
+    args = parser.parse_args()
+
+    index = LineIndex(args.path, args.path + _INDEX_SUFFIX if args.save_index else None)
+    if args.search is not None:
+        found = index.search(args.search.encode("UTF-8"), max(args.start - 1, 0), args.count)
+    elif args.tail is not None:
+        first, lines = index.tail(args.tail)
+        found = list(enumerate(lines, first))
+    else:
+        found = list(enumerate(index.lines(max(args.start - 1, 0), args.count), max(args.start - 1, 0)))
+    for number, line in found:
+        sys.stdout.write(f"{number + 1:>8} {line.decode('UTF-8', errors='replace')}\n")
+
+
+if __name__ == "__main__":
+    main()
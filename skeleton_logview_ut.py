@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import skeleton_logview
+
+
+class TestLineIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "task.log")
+        self.write(b"".join(b"line %d\n" % x for x in range(1000)), "wb")
+        self.index = skeleton_logview.LineIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data, mode="ab"):
+        with open(self.path, mode) as log:
+            log.write(data)
+
+    def test_pages(self):
+        self.assertEqual(self.index.count(), 1000)
+        self.assertEqual(self.index.lines(0, 2), [b"line 0", b"line 1"])
+        self.assertEqual(self.index.lines(998, 10), [b"line 998", b"line 999"])
+        self.assertEqual(self.index.lines(2000, 10), [])
+        self.assertEqual(self.index.tail(2), (998, [b"line 998", b"line 999"]))
+
+    def test_growing(self):
+        self.assertEqual(self.index.count(), 1000)
+        self.write(b"incomplete")
+        self.assertEqual(self.index.count(), 1001)
+        self.assertEqual(self.index.tail(1), (1000, [b"incomplete"]))
+        self.write(b" line\n\nlast")
+        self.assertEqual(self.index.tail(3), (1000, [b"incomplete line", b"", b"last"]))
+        self.assertEqual(self.index.lines(999, 2), [b"line 999", b"incomplete line"])
+
+    def test_replaced(self):
+        self.index.count()
+        self.write(b"short\n", "wb")  # truncated
+        self.assertEqual(self.index.tail(5), (0, [b"short"]))
+        os.unlink(self.path)
+        self.write(b"new file\nwith two lines\n", "wb")
+        self.assertEqual(self.index.count(), 2)
+        self.write(b"", "wb")
+        self.assertEqual(self.index.count(), 0)
+        self.assertEqual(self.index.tail(5), (0, []))
+        self.assertEqual(self.index.search(b"line"), [])
+
+    def test_search(self):
+        expected = [(99, b"line 99")] + [(x, b"line %d" % x) for x in range(990, 1000)]
+        self.assertEqual(self.index.search(b"line 99"), expected)
+        self.assertEqual(self.index.search(b"line 99", start=100, limit=2), [(990, b"line 990"), (991, b"line 991")])
+        # a match across lines belongs to the line where it starts
+        self.assertEqual(self.index.search(b"9\nline"), [(x, b"line %d" % x) for x in range(9, 999, 10)])
+        self.assertEqual(self.index.search(b"nothing"), [])
+        self.write(b"tail")
+        self.assertEqual(self.index.search(b"tail"), [(1000, b"tail")])
+
+    def test_saved_index(self):
+        index_path = self.path + ".index"
+        first = skeleton_logview.LineIndex(self.path, index_path)
+        first.save_min_size = 0
+        self.assertEqual(first.count(), 1000)
+        self.write(b"more\n")
+        self.assertEqual(first.count(), 1001)
+        first.close()
+        self.assertEqual(os.path.getsize(index_path), 16 + 8 * 1002)  # the new offsets are appended
+
+        # offsets are taken from the file, not found again: an index without the end of line 0 joins lines 0 and 1
+        stat = os.stat(self.path)
+        with open(index_path, "wb") as index:
+            index.write(struct.pack("QQQQ", stat.st_dev, stat.st_ino, 0, 14))
+        second = skeleton_logview.LineIndex(self.path, index_path)
+        second.save_min_size = 0
+        self.assertEqual(second.lines(0, 2), [b"line 0\nline 1", b"line 2"])
+        second.close()
+        self.assertEqual(os.path.getsize(index_path), 16 + 8 * 1001)
+
+        # an index of another file is not used
+        with open(index_path, "wb") as index:
+            index.write(struct.pack("QQQQ", stat.st_dev, stat.st_ino + 1, 0, 14))
+        third = skeleton_logview.LineIndex(self.path, index_path)
+        third.save_min_size = 0
+        self.assertEqual(third.lines(0, 2), [b"line 0", b"line 1"])
+        third.close()
+
+        small = skeleton_logview.LineIndex(self.path, os.path.join(self.tmpdir, "small.index"))
+        self.assertEqual(small.count(), 1001)
+        self.assertFalse(os.path.exists(small.index_path))  # not worth saving
+        small.close()
+
+    def test_open_index(self):
+        self.assertIs(skeleton_logview.open_index(self.path), skeleton_logview.open_index(self.path))
+
+    def test_line_html(self):
+        self.assertEqual(skeleton_logview.line_html(b"    <indented>\r"), "&#32;   &lt;indented&gt;")
+        self.assertEqual(skeleton_logview.line_html(b"\xff"), "\ufffd")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Names, help lines and dependencies of all functions of skeleton.sh in one pass over the text.
+
+"skeleton.sh usage" and "skeleton.sh _make_dot_file" run the script once per function,
+here the script is only read. Recognized are literal calls in function body:
+
+    [ "$1" == "--help" ] && _help_and_exit "some help" || true
+    [ "$1" == "--deps" ] && _deps_and_exit "dep1" "dep2" || true
+    [ "$1" == "--inputs" ] && _inputs_and_exit "file1" "dir2" || true
+    [ "$1" == "--outputs" ] && _outputs_and_exit "file3" || true
+    [ "$1" == "--resources" ] && _resources_and_exit "cpu=2" "memory=1G" || true
+
+Of variables only $SELFNAME and $(basename "$SELFNAME") are substituted in help line and file names.
+
+    $ ./skeleton_meta.py skeleton.sh
+    $ ./skeleton.sh metadata
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shlex
+import sys
+from typing import Dict, List, Optional
+
+_FUNCTION_START = re.compile(r"^([a-zA-Z_0-9]+)\(\) {$")  # the same as "print_functions" looks for
+_FUNCTION_END = "}"
+_HELP_CALL = "_help_and_exit"
+_DEPS_CALL = "_deps_and_exit"
+_INPUTS_CALL = "_inputs_and_exit"
+_OUTPUTS_CALL = "_outputs_and_exit"
+_RESOURCES_CALL = "_resources_and_exit"
+_BASENAME_SELFNAME = re.compile(r"\$\(basename \$(SELFNAME|\{SELFNAME\})\)")
+_SELFNAME = re.compile(r"\$(SELFNAME|\{SELFNAME\})")
+
+
+class Function:
+    def __init__(
+        self,
+        name: str,
+        line: int,
+        body: str,
+        help_line: Optional[str] = None,
+        deps: Optional[List[str]] = None,
+        inputs: Optional[List[str]] = None,
+        outputs: Optional[List[str]] = None,
+        resources: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.name = name
+        self.line = line  # number of the line with function name, starts with 1
+        self.body = body  # text between the braces
+        self.help = help_line  # None means function without help, "usage" does not show it
+        self.deps: List[str] = deps if deps is not None else []
+        # files (or directories) the task reads and writes, see skeleton_state
+        self.inputs: List[str] = inputs if inputs is not None else []
+        self.outputs: List[str] = outputs if outputs is not None else []
+        # "name=value" arguments of "--resources" as is, see skeleton_resources
+        self.resources: Dict[str, str] = resources if resources is not None else {}
+
+    def __repr__(self) -> str:
+        return f"Function({self.name!r}, line={self.line}, help={self.help!r}, deps={self.deps!r})"
+
+    @property
+    def body_digest(self) -> str:
+        return hashlib.sha256(self.body.encode("UTF-8")).hexdigest()
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "line": self.line,
+            "help": self.help,
+            "deps": self.deps,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "resources": self.resources,
+            "body_digest": self.body_digest,
+        }
+
+
+def call_arguments(line: str, function: str) -> Optional[List[str]]:
+    # arguments of the first call of "function" in shell line up to "||", "&&", ";" etc.
+    position = line.find(function)
+    if position < 0:
+        return None
+    lexer = shlex.shlex(line[position + len(function) :], posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    arguments = []
+    try:
+        for token in lexer:
+            if token and all(x in lexer.punctuation_chars for x in token):
+                break
+            arguments.append(token)
+    except ValueError:  # no closing quotation
+        return None
+    return arguments
+
+
+def substitute(text: str, selfname: str) -> str:
+    text = _BASENAME_SELFNAME.sub(lambda _: os.path.basename(selfname), text)
+    return _SELFNAME.sub(lambda _: selfname, text)
+
+
+def parse_script(text: str, selfname: str = "./skeleton.sh") -> List[Function]:
+    functions: List[Function] = []
+    name: Optional[str] = None
+    start = 0
+    body: List[str] = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if name is None:
+            match = _FUNCTION_START.match(line)
+            if match is not None:
+                name, start, body = match.group(1), number, []
+            continue
+        if line != _FUNCTION_END:
+            body.append(line)
+            continue
+
+        function = Function(name, start, "\n".join(body))
+        for item in body:
+            if item.lstrip().startswith("#"):
+                continue
+            if function.help is None:
+                arguments = call_arguments(item, _HELP_CALL)
+                if arguments:
+                    function.help = substitute(arguments[0], selfname)
+            if not function.deps:
+                arguments = call_arguments(item, _DEPS_CALL)
+                if arguments:
+                    function.deps = arguments
+            if not function.inputs:
+                arguments = call_arguments(item, _INPUTS_CALL)
+                if arguments:
+                    function.inputs = [substitute(x, selfname) for x in arguments]
+            if not function.outputs:
+                arguments = call_arguments(item, _OUTPUTS_CALL)
+                if arguments:
+                    function.outputs = [substitute(x, selfname) for x in arguments]
+            if not function.resources:
+                arguments = call_arguments(item, _RESOURCES_CALL)
+                if arguments:
+                    function.resources = dict(x.partition("=")[::2] for x in arguments)
+        functions.append(function)
+        name = None
+    return functions
+
+
+def read_script(path: str, selfname: Optional[str] = None) -> List[Function]:
+    with open(path, encoding="UTF-8") as script:
+        return parse_script(script.read(), path if selfname is None else selfname)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", nargs="?", default="./skeleton.sh", help="path to skeleton.sh")
+    parser.add_argument("--selfname", help="value of $SELFNAME if differs from the path")
+    args = parser.parse_args()
+
+    functions = read_script(args.script, args.selfname)
+    json.dump([x.as_dict() for x in functions], sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import unittest
+
+import skeleton_meta
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "skeleton.sh")
+
+
+class TestFunctions(unittest.TestCase):
+    def test_call_arguments(self):
+        self.assertIsNone(skeleton_meta.call_arguments('echo "x"', "_deps_and_exit"))
+        self.assertIsNone(skeleton_meta.call_arguments('_deps_and_exit "x', "_deps_and_exit"))
+        self.assertEqual(
+            skeleton_meta.call_arguments('[ "$1" == "--deps" ] && _deps_and_exit "a" b || true', "_deps_and_exit"),
+            ["a", "b"],
+        )
+        self.assertEqual(skeleton_meta.call_arguments('_help_and_exit "x y";', "_help_and_exit"), ["x y"])
+
+    def test_substitute(self):
+        self.assertEqual(
+            skeleton_meta.substitute("[or $(basename $SELFNAME) --help] ${SELFNAME} $HOME", "./dir/x.sh"),
+            "[or x.sh --help] ./dir/x.sh $HOME",
+        )
+
+    def test_parse_script(self):
+        text = """\
+#!/usr/bin/env bash
+
+first() {
+    [ "$1" == "--help" ] && _help_and_exit "say \\"hi\\"" || true
+    # _deps_and_exit "commented"
+    [ "$1" == "--deps" ] && _deps_and_exit "second" || true
+    [ "$1" == "--resources" ] && _resources_and_exit "cpu=2" "memory=1G" || true
+    echo hi
+}
+
+ not_a_function() {
+}
+
+second() {
+    echo 2
+}
+"""
+        functions = skeleton_meta.parse_script(text)
+        self.assertEqual([x.name for x in functions], ["first", "second"])
+        self.assertEqual(functions[0].help, 'say "hi"')
+        self.assertEqual(functions[0].deps, ["second"])
+        self.assertEqual(functions[0].line, 3)
+        self.assertEqual(functions[0].resources, {"cpu": "2", "memory": "1G"})
+        self.assertEqual(functions[1].resources, {})
+        self.assertIsNone(functions[1].help)
+        self.assertEqual(functions[1].body, "    echo 2")
+        self.assertEqual(functions[1].as_dict()["body_digest"], functions[1].body_digest)
+
+    def test_as_usage(self):
+        # the same result as the script gives running itself for every function
+        usage = subprocess.check_output([_SCRIPT, "usage"]).decode().split("\n")
+        dot = subprocess.check_output([_SCRIPT, "_make_dot_file"]).decode()
+
+        functions = [x for x in skeleton_meta.read_script(_SCRIPT) if not x.name.startswith("_")]
+        self.assertEqual(
+            sorted("{:<20} {}".format(x.name, x.help) for x in functions if x.help),
+            sorted(x for x in usage if x),
+        )
+        edges = ['  "{}" -> "{}";'.format(x.name, dep) for x in functions for dep in x.deps]
+        self.assertEqual(sorted(edges), sorted(x for x in dot.split("\n") if "->" in x))
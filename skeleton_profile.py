@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Where the time of a run of dependent tasks goes.
+
+The critical path is the chain of dependencies with the largest total duration:
+nothing outside it can make the whole run shorter. The trace is in Chrome trace event format,
+open it in chrome://tracing or https://ui.perfetto.dev
+
+    $ ./skeleton.sh run --trace trace.json make_my_day
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+_MICROSECONDS = 1e6
+
+
+def critical_path(graph: Dict[str, List[str]], durations: Dict[str, float]) -> List[str]:
+    """The longest chain by durations, dependencies first. Unknown durations are zero, back edges of cycles are ignored."""
+    finish: Dict[str, float] = {}  # the earliest finish time if everything is run at once
+    best: Dict[str, Optional[str]] = {}  # the dependency which finishes last
+    visiting = set()
+
+    def visit(name: str) -> float:
+        if name in finish:
+            return finish[name]
+        visiting.add(name)
+        deps = [x for x in graph.get(name, []) if x not in visiting]
+        latest = max(deps, key=visit, default=None)
+        visiting.discard(name)
+        best[name] = latest
+        finish[name] = durations.get(name, 0.0) + (finish[latest] if latest is not None else 0.0)
+        return finish[name]
+
+    for task in graph:
+        visit(task)
+    if not finish or max(finish.values()) <= 0:
+        return []  # nothing has taken time
+
+    path: List[str] = []
+    current: Optional[str] = max(finish, key=lambda x: finish[x])
+    while current is not None:
+        path.append(current)
+        current = best[current]
+    return path[::-1]
+
+
+def assign_lanes(spans: Dict[str, Tuple[float, float]]) -> Dict[str, int]:
+    # rows of the trace: tasks run at the same time are on different rows, numbers start with 1
+    lanes: List[float] = []  # end of the last task of every lane
+    result = {}
+    for name, (started, finished) in sorted(spans.items(), key=lambda x: x[1]):
+        for index, end in enumerate(lanes):
+            if end <= started:
+                break
+        else:
+            index = len(lanes)
+            lanes.append(0.0)
+        lanes[index] = finished
+        result[name] = index + 1
+    return result
+
+
+def chrome_trace(runs: Dict[str, dict], critical: List[str]) -> dict:
+    """Trace events of tasks from "runs": name -> dict with "started", "finished" and any other arguments."""
+    spans = {x: (y["started"], y["finished"]) for x, y in runs.items() if y.get("started") and y.get("finished")}
+    origin = min((x[0] for x in spans.values()), default=0.0)
+    lanes = assign_lanes(spans)
+    events = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "skeleton.sh"}}]
+    for name, (started, finished) in spans.items():
+        arguments = {x: y for x, y in runs[name].items() if x not in ("started", "finished")}
+        arguments["critical"] = name in critical
+        events.append(
+            {
+                "name": name,
+                "cat": "critical" if name in critical else "task",
+                "ph": "X",
+                "ts": round((started - origin) * _MICROSECONDS),
+                "dur": round((finished - started) * _MICROSECONDS),
+                "pid": 1,
+                "tid": lanes[name],
+                "args": arguments,
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
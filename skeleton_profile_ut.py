@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import skeleton_profile
+
+
+class TestCriticalPath(unittest.TestCase):
+    def test_longest_chain(self):
+        graph = {"top": ["a", "b"], "a": ["base"], "b": ["base"], "base": [], "alone": []}
+        durations = {"top": 1.0, "a": 5.0, "b": 2.0, "base": 1.0, "alone": 6.0}
+        self.assertEqual(skeleton_profile.critical_path(graph, durations), ["base", "a", "top"])
+        durations["alone"] = 8.0
+        self.assertEqual(skeleton_profile.critical_path(graph, durations), ["alone"])
+
+    def test_degenerate(self):
+        self.assertEqual(skeleton_profile.critical_path({}, {}), [])
+        self.assertEqual(skeleton_profile.critical_path({"a": []}, {"a": 0.0}), [])
+        # cycles do not hang
+        path = skeleton_profile.critical_path({"a": ["b"], "b": ["a"]}, {"a": 1.0, "b": 2.0})
+        self.assertEqual(sorted(path), ["a", "b"])
+
+
+class TestTrace(unittest.TestCase):
+    def test_lanes(self):
+        spans = {"a": (0.0, 2.0), "b": (1.0, 3.0), "c": (2.0, 4.0), "d": (2.5, 3.0)}
+        self.assertEqual(skeleton_profile.assign_lanes(spans), {"a": 1, "b": 2, "c": 1, "d": 3})
+
+    def test_chrome_trace(self):
+        runs = {
+            "a": {"started": 100.0, "finished": 100.5, "cpu_time": 0.25},
+            "b": {"started": 100.5, "finished": 101.0, "cpu_time": 0.5},
+            "skipped": {"started": None, "finished": None},
+        }
+        trace = skeleton_profile.chrome_trace(runs, ["a", "b"])
+        events = {x["name"]: x for x in trace["traceEvents"] if x["ph"] == "X"}
+        self.assertEqual(sorted(events), ["a", "b"])
+        self.assertEqual((events["b"]["ts"], events["b"]["dur"]), (500000, 500000))
+        self.assertEqual(events["a"]["args"], {"cpu_time": 0.25, "critical": True})
+        self.assertEqual(events["a"]["cat"], "critical")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""CPU and memory of tasks of skeleton.sh: declared next to "--deps", admitted by skeleton_runner within the machine.
+
+    [ "$1" == "--resources" ] && _resources_and_exit "cpu=4" "memory=2G" "priority=10" || true
+
+"cpu" is the number of CPU slots the task keeps busy (1 by default), "-j N" of the runner is the number of slots.
+"memory" is the peak memory of the task (like 512M or 2G, nothing by default), the budget is the memory available
+at the start of the run (or "--memory"). A ready task starts when its slots and memory fit into the free ones,
+a task bigger than the whole machine starts alone. Ready tasks are started by "priority" (0 by default, higher first),
+then by the length of the chain of tasks waiting for them (durations of the last runs from the history),
+so the critical path is not delayed by tasks which could run later.
+
+With "--limit-memory" the memory of a task is also its limit: RLIMIT_AS (ulimit -v) of its process, which children
+inherit, so an allocation over it fails instead of pushing the machine into swap. The limit is per process and counts
+address space, not resident memory: JVM, Go and other programs reserving much more than they use need a bigger
+declaration or no limit, so it is off by default.
+
+    $ ./skeleton_resources.py skeleton.sh
+    $ ./skeleton.sh run -j 8 --memory 16G --limit-memory make_my_day
+"""
+
+import argparse
+import os
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from skeleton_artifacts import parse_size
+from skeleton_meta import Function, read_script
+
+
+class Resources:
+    def __init__(self, cpu: float = 1.0, memory: Optional[int] = None, priority: int = 0) -> None:
+        self.cpu = cpu
+        self.memory = memory  # bytes, None means not declared
+        self.priority = priority
+
+    def __repr__(self) -> str:
+        return f"Resources(cpu={self.cpu}, memory={self.memory}, priority={self.priority})"
+
+    def as_dict(self) -> dict:
+        return {"cpu": self.cpu, "memory": self.memory, "priority": self.priority}
+
+
+def parse_resources(function: Function) -> Resources:
+    result = Resources()
+    for name, value in function.resources.items():
+        try:
+            if name == "cpu":
+                result.cpu = float(value)
+                if result.cpu < 0:
+                    raise ValueError(f"negative: {value}")
+            elif name == "memory":
+                result.memory = parse_size(value)
+            elif name == "priority":
+                result.priority = int(value)
+            else:
+                raise RuntimeError(f"unknown resource of {function.name}: {name}")
+        except ValueError as exc:
+            raise RuntimeError(f"bad {name} of {function.name}: {exc}") from exc
+    return result
+
+
+def machine_memory() -> Optional[int]:
+    # available memory (free and reclaimable cache), total memory if unknown
+    try:
+        with open("/proc/meminfo", encoding="ascii") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class Pool:
+    """Free CPU slots and memory. Used by the single scheduling thread of the runner, so there is no lock."""
+
+    def __init__(self, cpu: float, memory: Optional[int] = None) -> None:
+        self.cpu = cpu
+        self.memory = memory  # None means memory is not counted
+        self.used_cpu = 0.0
+        self.used_memory = 0
+        self.tasks = 0
+
+    def fits(self, need: Resources) -> bool:
+        if self.tasks == 0:
+            return True  # even a task bigger than the machine has to run somehow
+        if self.used_cpu + need.cpu > self.cpu:
+            return False
+        return self.memory is None or need.memory is None or self.used_memory + need.memory <= self.memory
+
+    def take(self, need: Resources) -> None:
+        self.tasks += 1
+        self.used_cpu += need.cpu
+        self.used_memory += need.memory or 0
+
+    def give(self, need: Resources) -> None:
+        self.tasks -= 1
+        self.used_cpu -= need.cpu
+        self.used_memory -= need.memory or 0
+
+
+def remaining_path(order: List[str], graph: Dict[str, List[str]], durations: Dict[str, float]) -> Dict[str, float]:
+    """For every task: its duration plus the longest chain of tasks depending on it. Unknown durations are 1 s.
+
+    "order" has dependencies first, like skeleton_runner.topological_order.
+    """
+    dependents: Dict[str, List[str]] = {x: [] for x in order}
+    for name in order:
+        for dep in graph[name]:
+            dependents[dep].append(name)
+    result: Dict[str, float] = {}
+    for name in reversed(order):
+        after = max((result[x] for x in dependents[name]), default=0.0)
+        result[name] = durations.get(name, 1.0) + after
+    return result
+
+
+def limited_command(command: List[str], memory: Optional[int]) -> List[str]:
+    """The command started by sh after "ulimit -v": the limit holds from the first allocation of the task.
+
+    Unlike preexec_fn of Popen it is safe to start from threads, and it has no window like prlimit after the start.
+    """
+    if memory is None:
+        return command
+    # over the hard limit "ulimit" fails: run without it
+    script = f'ulimit -v {max(memory // 1024, 1)} 2>/dev/null; exec "$@"'
+    return ["sh", "-c", script, "sh"] + command
+
+
+def describe(functions: Iterable[Function]) -> str:
+    lines = []
+    for function in functions:
+        if function.name.startswith("_"):
+            continue
+        need = parse_resources(function)
+        memory = f"{need.memory / 1024 / 1024:.0f} MiB" if need.memory is not None else ""
+        lines.append(f"{function.name:<20} {need.cpu:>5g} {memory:>10} {need.priority:>8}")
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("script", nargs="?", default="./skeleton.sh", help="path to skeleton.sh")
+    args = parser.parse_args()
+
+    try:
+        text = describe(read_script(args.script))
+    except RuntimeError as exc:
+        parser.error(str(exc))
+    memory = machine_memory()
+    available = f"{memory / 1024 / 1024:.0f} MiB" if memory is not None else "unknown"
+    sys.stdout.write(f"CPUs: {os.cpu_count()}, available memory: {available}\n")
+    sys.stdout.write(f"{'task':<20} {'cpu':>5} {'memory':>10} {'priority':>8}\n" + text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import subprocess
+import unittest
+
+import skeleton_resources
+from skeleton_meta import Function
+
+
+class TestResources(unittest.TestCase):
+    def test_parse(self):
+        need = skeleton_resources.parse_resources(Function("build", 1, "", resources={"cpu": "2", "memory": "1G"}))
+        self.assertEqual(need.as_dict(), {"cpu": 2.0, "memory": 1024**3, "priority": 0})
+        self.assertEqual(skeleton_resources.parse_resources(Function("build", 1, "")).as_dict()["cpu"], 1.0)
+        with self.assertRaisesRegex(RuntimeError, "unknown resource of build: gpu"):
+            skeleton_resources.parse_resources(Function("build", 1, "", resources={"gpu": "1"}))
+        with self.assertRaisesRegex(RuntimeError, "bad memory of build"):
+            skeleton_resources.parse_resources(Function("build", 1, "", resources={"memory": "a lot"}))
+        with self.assertRaisesRegex(RuntimeError, "bad cpu of build"):
+            skeleton_resources.parse_resources(Function("build", 1, "", resources={"cpu": "-1"}))
+
+    def test_pool(self):
+        pool = skeleton_resources.Pool(cpu=4, memory=1000)
+        big = skeleton_resources.Resources(cpu=8)
+        self.assertTrue(pool.fits(big))  # alone
+        pool.take(big)
+        self.assertFalse(pool.fits(skeleton_resources.Resources()))
+        pool.give(big)
+        pool.take(skeleton_resources.Resources(cpu=2, memory=600))
+        self.assertTrue(pool.fits(skeleton_resources.Resources(cpu=2)))
+        self.assertFalse(pool.fits(skeleton_resources.Resources(cpu=1, memory=600)))
+        self.assertTrue(pool.fits(skeleton_resources.Resources(cpu=0.5, memory=400)))
+
+    def test_remaining_path(self):
+        graph = {"a": [], "b": ["a"], "c": ["a"], "d": ["b"]}
+        remaining = skeleton_resources.remaining_path(["a", "b", "c", "d"], graph, {"c": 5.0})
+        self.assertEqual(remaining, {"d": 1.0, "c": 5.0, "b": 2.0, "a": 6.0})
+
+    def test_limited_command(self):
+        command = ["sh", "-c", "ulimit -v"]
+        self.assertEqual(skeleton_resources.limited_command(command, None), command)
+        # the limit is there already when the command starts
+        output = subprocess.check_output(skeleton_resources.limited_command(command, 256 * 1024**2))
+        self.assertEqual(output.strip(), str(256 * 1024).encode())
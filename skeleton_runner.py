@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""Run tasks of skeleton.sh with their dependencies declared by "--deps".
+
+Ready tasks (all dependencies succeeded) are run in parallel within "-j" CPU slots and the memory budget,
+by priority and by the length of the critical path, see skeleton_resources.
+Every task is run once per invocation even if several targets depend on it.
+Like "set -e" the first failure stops everything: running tasks are terminated, the rest are not started.
+Tasks declaring "--inputs" or "--outputs" are skipped when they are up to date, see skeleton_state.
+
+    $ ./skeleton_runner.py -j 4 make_my_day print_hidden
+    $ ./skeleton.sh run -j 4 make_my_day print_hidden
+    $ ./skeleton.sh run --dry-run dependency_graph
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import signal
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from skeleton_artifacts import (
+    DirectoryStore,
+    HTTPStore,
+    artifact_key,
+    is_cacheable,
+    open_store,
+    pack,
+    parse_size,
+    unpack,
+)
+from skeleton_history import History, RunRecord
+from skeleton_meta import Function, read_script
+from skeleton_profile import chrome_trace, critical_path
+from skeleton_resources import Pool, Resources, limited_command, machine_memory, parse_resources, remaining_path
+from skeleton_state import State, current_record, outdated_reason
+
+OK = "ok"
+FAILED = "failed"
+CANCELLED = "cancelled"  # terminated because of failure of another task
+NOT_STARTED = "not started"
+SKIPPED = "skipped"  # up to date
+RESTORED = "restored"  # outputs are taken from artifact cache
+WOULD_RUN = "would run"  # for dry run
+
+# set for tasks started by the runner: their dependencies are done, a task running them itself may skip it
+RUNNER_ENV = "SKELETON_RUNNER"
+
+
+def resolve(functions: Dict[str, Function], targets: List[str]) -> Dict[str, List[str]]:
+    """Subgraph of tasks needed for targets: task name -> names of its dependencies."""
+    graph: Dict[str, List[str]] = {}
+    stack = list(reversed(targets))
+    while stack:
+        name = stack.pop()
+        if name in graph:
+            continue
+        if name not in functions:
+            raise RuntimeError(f"no such task: {name}")
+        graph[name] = list(functions[name].deps)
+        stack.extend(reversed(graph[name]))
+    topological_order(graph)  # to fail early on cycles
+    return graph
+
+
+def topological_order(graph: Dict[str, List[str]]) -> List[str]:
+    # dependencies first, otherwise the order of graph is kept
+    order: List[str] = []
+    state: Dict[str, bool] = {}  # False - in progress, True - done
+
+    def visit(name: str, path: List[str]) -> None:
+        done = state.get(name)
+        if done:
+            return
+        if done is False:
+            raise RuntimeError("dependency cycle: " + " -> ".join(path[path.index(name) :] + [name]))
+        state[name] = False
+        for dep in graph[name]:
+            visit(dep, path + [name])
+        state[name] = True
+        order.append(name)
+
+    for name in graph:
+        visit(name, [])
+    return order
+
+
+def exit_code(wait_status: int) -> int:
+    # like Popen.returncode: negative number of signal if killed by signal
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+class TaskRun:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.status = NOT_STARTED
+        self.returncode: Optional[int] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.reason: Optional[str] = None  # why the task is run or skipped
+        self.cpu_time: Optional[float] = None  # user and system, of the task and its children
+        self.max_rss: Optional[int] = None  # peak resident memory of the task or one of its children, bytes
+
+    def __repr__(self) -> str:
+        return f"TaskRun({self.name!r}, status={self.status!r}, returncode={self.returncode}, reason={self.reason!r})"
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "returncode": self.returncode,
+            "started": self.started,
+            "finished": self.finished,
+            "cpu_time": self.cpu_time,
+            "max_rss": self.max_rss,
+            "reason": self.reason,
+        }
+
+
+class Runner:
+    def __init__(
+        self,
+        script: str = "./skeleton.sh",
+        jobs: int = 1,
+        verbose: bool = True,
+        state: Optional[State] = None,
+        force: bool = False,
+        history: Optional[History] = None,
+        artifacts: Optional[Union[DirectoryStore, HTTPStore]] = None,
+        memory: Optional[int] = None,
+        limits: bool = False,
+    ) -> None:
+        self.script = script
+        self.jobs = max(jobs, 1)  # CPU slots
+        self.memory = memory  # budget of declared memory, None means available memory at the start of a run
+        self.limits = limits  # declared memory is RLIMIT_AS of the task process
+        self.verbose = verbose
+        self.state = state  # None means run every task
+        self.force = force  # run every task, but keep the state
+        self.history = history  # where to record runs of tasks
+        self.artifacts = artifacts  # shared cache of outputs, works together with state
+        self._lock = threading.Lock()
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._stopping = False
+        self.functions: Dict[str, Function] = {}  # of the script, read by the last "prepare"
+        self._fingerprints: Dict[str, str] = {}  # of results of tasks of the current invocation
+        self.resources: Dict[str, Resources] = {}  # of tasks of the last "prepare"
+        self._only: Optional[Set[str]] = None  # tasks to run, see "run"
+
+    def log(self, message: str) -> None:
+        if self.verbose:
+            print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+    def command(self, name: str) -> List[str]:
+        return [self.script, name]
+
+    def prepare(self, targets: List[str]) -> List[str]:
+        self.functions = {x.name: x for x in read_script(self.script)}
+        self._fingerprints = {}
+        self._stopping = False
+        order = topological_order(resolve(self.functions, targets))
+        self.resources = {x: parse_resources(self.functions[x]) for x in order}
+        return order
+
+    def ranks(self, order: List[str]) -> Dict[str, tuple]:
+        # ready tasks are started by priority, then the longest chain of tasks waiting for them first
+        durations = {}
+        if self.history is not None:
+            durations = {x: y.duration for x, y in self.history.latest(order).items()}
+        remaining = remaining_path(order, {x: self.functions[x].deps for x in order}, durations)
+        return {x: (-self.resources[x].priority, -remaining[x], index) for index, x in enumerate(order)}
+
+    def check(self, name: str) -> Tuple[Optional[str], dict, Optional[str]]:
+        # reason to run the task (None if it is up to date), the current record and the stored fingerprint
+        function = self.functions[name]
+        current = current_record(function, {x: self._fingerprints.get(x) for x in function.deps})
+        stored = self.state.get(name) if self.state is not None else None
+        if self.force:
+            return "forced", current, None
+        reason = outdated_reason(function, stored[0] if stored else None, current)
+        return reason, current, stored[1] if stored else None
+
+    def plan(self, targets: List[str]) -> Dict[str, TaskRun]:
+        """Dry run: what would be run and why."""
+        runs = {x: TaskRun(x) for x in self.prepare(targets)}
+        for name, run in runs.items():
+            function = self.functions[name]
+            will_run = [x for x in function.deps if runs[x].status == WOULD_RUN]
+            reason, _, stored = self.check(name)
+            if will_run and reason is not None and reason.startswith("dependency changed"):
+                # results of dependencies which would run are unknown
+                reason = f"dependency will run: {will_run[0]}"
+            if reason is None and stored is not None:
+                run.status, run.reason = SKIPPED, "up to date"
+                self._fingerprints[name] = stored
+            else:
+                run.status, run.reason = WOULD_RUN, reason
+        return runs
+
+    def run(self, targets: List[str], only: Optional[Iterable[str]] = None) -> Dict[str, TaskRun]:
+        """Run targets and their dependencies; with "only" the other tasks are taken as done (see skeleton_watch)."""
+        order = self.prepare(targets)
+        self._only = set(only) if only is not None else None
+        graph = {x: self.functions[x].deps for x in order}
+        runs = {x: TaskRun(x) for x in order}
+        waiting = {x: set(graph[x]) for x in order}
+        ranks = self.ranks(order)
+        slots = Pool(self.jobs, self.memory if self.memory is not None else machine_memory())
+
+        # a thread per task: tasks with fractional "cpu" may run more than "-j" at once
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(order) or 1) as pool:
+            running: Dict[concurrent.futures.Future, str] = {}
+            while True:
+                if not self._stopping:
+                    ready = [x for x in order if runs[x].status == NOT_STARTED and not waiting[x]]
+                    for name in sorted(set(ready) - set(running.values()), key=ranks.__getitem__):
+                        # smaller tasks may go ahead of a bigger one which does not fit yet
+                        if slots.fits(self.resources[name]):
+                            slots.take(self.resources[name])
+                            running[pool.submit(self.execute, runs[name])] = name
+                if not running:
+                    break
+
+                try:
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    self.stop()
+                    raise
+                for future in done:
+                    name = running.pop(future)
+                    slots.give(self.resources[name])
+                    future.result()  # errors of the runner itself, not of the task
+                    if runs[name].status in (OK, SKIPPED, RESTORED):
+                        for item in waiting.values():
+                            item.discard(name)
+                    elif not self._stopping:
+                        self.stop()
+        return runs
+
+    def execute(self, run: TaskRun) -> None:
+        with self._lock:
+            if self._stopping:
+                return
+
+        if self._only is not None and run.name not in self._only:
+            run.status, run.reason = SKIPPED, "not affected"
+            saved = self.state.get(run.name) if self.state is not None else None
+            if saved is not None:
+                self._fingerprints[run.name] = saved[1]
+            return
+
+        current: dict = {}  # record of inputs the task is run for
+        if self.state is not None:
+            run.reason, current, stored = self.check(run.name)
+            if run.reason is None and stored is not None:
+                run.status, run.reason = SKIPPED, "up to date"
+                self._fingerprints[run.name] = stored
+                self.log(f"skipped {run.name}: up to date")
+                return
+            if self.restore(run, current):
+                return
+
+        with self._lock:
+            if self._stopping:
+                return
+            run.started = time.time()
+            # own process group: on failure of another task the whole tree of the task is terminated
+            command = self.command(run.name)
+            if self.limits:
+                command = limited_command(command, self.resources[run.name].memory)
+            process = subprocess.Popen(command, start_new_session=True, env=dict(os.environ, **{RUNNER_ENV: "1"}))
+            self._processes[run.name] = process
+        self.log(f"started {run.name}")
+
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        process.returncode = exit_code(wait_status)
+        run.cpu_time = usage.ru_utime + usage.ru_stime
+        run.max_rss = usage.ru_maxrss * 1024  # KiB on Linux
+
+        with self._lock:
+            del self._processes[run.name]
+            run.finished = time.time()
+            run.returncode = process.returncode
+            if run.returncode == 0:
+                run.status = OK
+            else:
+                run.status = CANCELLED if self._stopping else FAILED
+        if self.state is not None:
+            if run.status == OK:
+                self._fingerprints[run.name] = self.state.success(self.functions[run.name], current)
+                self.save(run, current)
+            else:
+                self.state.forget(run.name)
+        if self.history is not None:
+            self.history.add(
+                RunRecord(
+                    run.name,
+                    "runner",
+                    run.started,
+                    run.finished,
+                    run.returncode,
+                    cpu_time=run.cpu_time,
+                    max_rss=run.max_rss,
+                )
+            )
+        self.log(f"{run.status} {run.name} (exit code {run.returncode}, {run.duration:.2f} s)")
+
+    def restore(self, run: TaskRun, record: dict) -> bool:
+        # True if outputs of the task are taken from artifact cache instead of running it
+        function = self.functions[run.name]
+        if self.state is None or self.artifacts is None or self.force or not is_cacheable(function):
+            return False
+        try:
+            blob = self.artifacts.get(artifact_key(function, record))
+            if blob is None:
+                return False
+            unpack(blob)
+        except (OSError, RuntimeError, tarfile.TarError) as exc:
+            self.log(f"artifact cache is not used for {run.name}: {exc}")
+            return False
+        run.status, run.reason = RESTORED, f"restored from cache (was: {run.reason})"
+        self._fingerprints[run.name] = self.state.success(function, record)
+        self.log(f"restored {run.name} from artifact cache")
+        return True
+
+    def save(self, run: TaskRun, record: dict) -> None:
+        function = self.functions[run.name]
+        if self.artifacts is None or not is_cacheable(function):
+            return
+        try:
+            self.artifacts.put(artifact_key(function, record), pack(function.outputs))
+        except (OSError, tarfile.TarError) as exc:  # e.g. the task has not created its outputs
+            self.log(f"outputs of {run.name} are not saved to artifact cache: {exc}")
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopping = True
+            for process in self._processes.values():
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+
+def profile(runs: Dict[str, TaskRun], graph: Dict[str, List[str]]) -> List[str]:
+    # critical path of the run: skipped and not started tasks take no time
+    return critical_path(graph, {x.name: x.duration or 0.0 for x in runs.values()})
+
+
+def report(runs: Dict[str, TaskRun], critical: Optional[List[str]] = None) -> str:
+    lines = []
+    for run in runs.values():
+        duration = f"{run.duration:.2f} s" if run.duration is not None else ""
+        cpu_time = f"{run.cpu_time:.2f} s" if run.cpu_time is not None else ""
+        max_rss = f"{run.max_rss / 1024 / 1024:.1f} MiB" if run.max_rss is not None else ""
+        mark = "*" if critical and run.name in critical else " "
+        reason = run.reason or ""
+        lines.append(f"{mark} {run.name:<20} {run.status:<12} {duration:>9} {cpu_time:>9} {max_rss:>10} {reason}")
+    if critical:
+        total = sum(runs[x].duration or 0.0 for x in critical)
+        lines.append(f"critical path (*): {' -> '.join(critical)}, {total:.2f} s")
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="+", help="tasks to run")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="CPU slots, a task takes 1 or its declared cpu"
+    )
+    parser.add_argument("--memory", help="budget of declared memory of tasks, like 16G, available memory by default")
+    parser.add_argument("--limit-memory", action="store_true", help="declared memory is RLIMIT_AS of the task")
+    parser.add_argument("--script", default="./skeleton.sh", help="path to skeleton.sh")
+    parser.add_argument("--state", default=".skeleton_state.sqlite", help="database with hashes of last runs")
+    parser.add_argument("--force", action="store_true", help="run all tasks, even up to date ones")
+    parser.add_argument("--dry-run", action="store_true", help="only show which tasks would be run and why")
+    parser.add_argument("--history", default=".skeleton_history.sqlite", help="database to record runs in")
+    parser.add_argument("--trace", help="save Chrome trace of the run (JSON) to this file")
+    parser.add_argument("--artifacts", help="directory or URL of skeleton_artifacts.py server to share outputs")
+    args = parser.parse_args()
+
+    try:
+        memory = parse_size(args.memory) if args.memory else None
+    except ValueError as exc:
+        parser.error(str(exc))
+    history = History(args.history) if not args.dry_run else None
+    artifacts = open_store(args.artifacts) if args.artifacts else None
+    runner = Runner(
+        args.script,
+        args.jobs,
+        state=State(args.state),
+        force=args.force,
+        history=history,
+        artifacts=artifacts,
+        memory=memory,
+        limits=args.limit_memory,
+    )
+    try:
+        runs = runner.plan(args.targets) if args.dry_run else runner.run(args.targets)
+    except RuntimeError as exc:  # unknown task, dependency cycle or bad resources
+        parser.error(str(exc))
+    if args.dry_run:
+        sys.stderr.write(report(runs))
+        return
+    critical = profile(runs, {x: runner.functions[x].deps for x in runs})
+    sys.stderr.write(report(runs, critical))
+    if args.trace:
+        with open(args.trace, "w", encoding="UTF-8") as trace:
+            json.dump(chrome_trace({x.name: x.as_dict() for x in runs.values()}, critical), trace, indent=1)
+    failed = [x for x in runs.values() if x.status == FAILED]
+    if failed:
+        sys.exit(failed[0].returncode if failed[0].returncode and failed[0].returncode > 0 else 1)
+    if any(x.status not in (OK, SKIPPED, RESTORED) for x in runs.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
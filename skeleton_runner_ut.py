@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+import skeleton_history
+import skeleton_runner
+import skeleton_state
+
+_SCRIPT = """\
+#!/usr/bin/env bash
+
+set -e -o pipefail
+
+OUT="$(dirname "$0")/out"
+SELFNAME="$0"
+
+slow_a() {
+    [ "$1" == "--deps" ] && _deps_and_exit "base" || true
+    sleep 0.4
+    echo slow_a >> "$OUT"
+}
+
+slow_b() {
+    [ "$1" == "--deps" ] && _deps_and_exit "base" || true
+    sleep 0.4
+    echo slow_b >> "$OUT"
+}
+
+base() {
+    echo base >> "$OUT"
+}
+
+top() {
+    [ "$1" == "--deps" ] && _deps_and_exit "slow_a" "slow_b" || true
+    echo top >> "$OUT"
+}
+
+broken() {
+    [ "$1" == "--deps" ] && _deps_and_exit "base" || true
+    exit 3
+}
+
+after_broken() {
+    [ "$1" == "--deps" ] && _deps_and_exit "broken" "slow_a" || true
+    echo after_broken >> "$OUT"
+}
+
+loop_a() {
+    [ "$1" == "--deps" ] && _deps_and_exit "loop_b" || true
+}
+
+loop_b() {
+    [ "$1" == "--deps" ] && _deps_and_exit "loop_a" || true
+}
+
+generate() {
+    [ "$1" == "--inputs" ] && _inputs_and_exit "$SELFNAME.in" || true
+    [ "$1" == "--outputs" ] && _outputs_and_exit "$SELFNAME.gen" || true
+    echo generate >> "$OUT"
+    cp "$SELFNAME.in" "$SELFNAME.gen"
+}
+
+use_generated() {
+    [ "$1" == "--deps" ] && _deps_and_exit "generate" || true
+    [ "$1" == "--outputs" ] && _outputs_and_exit "$SELFNAME.used" || true
+    echo use_generated >> "$OUT"
+    cat "$SELFNAME.gen" > "$SELFNAME.used"
+}
+
+heavy_a() {
+    [ "$1" == "--resources" ] && _resources_and_exit "memory=1G" || true
+    sleep 0.3
+    echo heavy_a >> "$OUT"
+}
+
+heavy_b() {
+    [ "$1" == "--resources" ] && _resources_and_exit "memory=1G" "priority=1" || true
+    sleep 0.3
+    echo heavy_b >> "$OUT"
+}
+
+heavy() {
+    [ "$1" == "--deps" ] && _deps_and_exit "heavy_a" "heavy_b" || true
+    [ -n "${SKELETON_RUNNER:-}" ] && return 0 || true
+    heavy_a
+    heavy_b
+}
+
+greedy() {
+    [ "$1" == "--resources" ] && _resources_and_exit "memory=64M" || true
+    python3 -c "bytearray(256 * 1024 * 1024)"
+}
+
+_deps_and_exit() {
+    exit 0
+}
+
+_resources_and_exit() {
+    exit 0
+}
+
+_inputs_and_exit() {
+    exit 0
+}
+
+_outputs_and_exit() {
+    exit 0
+}
+
+"$@"
+"""
+
+
+class TestGraph(unittest.TestCase):
+    def test_topological_order(self):
+        graph = {"a": ["b", "c"], "b": ["c"], "c": [], "d": []}
+        self.assertEqual(skeleton_runner.topological_order(graph), ["c", "b", "a", "d"])
+        with self.assertRaisesRegex(RuntimeError, "a -> b -> a"):
+            skeleton_runner.topological_order({"a": ["b"], "b": ["a"]})
+
+    def test_exit_code(self):
+        self.assertEqual(skeleton_runner.exit_code(3 << 8), 3)
+        self.assertEqual(skeleton_runner.exit_code(15), -15)
+
+
+class ScriptTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "skeleton.sh")
+        with open(self.script, "w") as script:
+            script.write(_SCRIPT)
+        os.chmod(self.script, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def output(self):
+        with open(os.path.join(self.tmpdir, "out")) as out:
+            return out.read().split()
+
+
+class TestRunner(ScriptTestCase):
+    def test_parallel(self):
+        started = time.monotonic()
+        runs = skeleton_runner.Runner(self.script, jobs=2, verbose=False).run(["top", "slow_a"])
+        self.assertLess(time.monotonic() - started, 0.75)  # slow_a and slow_b at the same time
+        self.assertTrue(all(x.status == skeleton_runner.OK for x in runs.values()))
+        output = self.output()
+        self.assertEqual(output[0], "base")
+        self.assertEqual(sorted(output[1:3]), ["slow_a", "slow_b"])
+        self.assertEqual(output[3:], ["top"])
+
+        self.assertEqual(skeleton_runner.profile(runs, {"top": ["slow_a", "slow_b"], "slow_a": ["base"]})[-1], "top")
+        self.assertGreater(runs["top"].max_rss, 0)
+
+    def test_sequential(self):
+        started = time.monotonic()
+        skeleton_runner.Runner(self.script, jobs=1, verbose=False).run(["top"])
+        self.assertGreater(time.monotonic() - started, 0.8)
+
+    def test_failure(self):
+        runs = skeleton_runner.Runner(self.script, jobs=2, verbose=False).run(["after_broken"])
+        self.assertEqual(runs["broken"].status, skeleton_runner.FAILED)
+        self.assertEqual(runs["broken"].returncode, 3)
+        # slow_a is started together with broken, it is terminated unless broken has failed before it started
+        self.assertIn(runs["slow_a"].status, (skeleton_runner.CANCELLED, skeleton_runner.NOT_STARTED))
+        self.assertIn(runs["slow_a"].returncode, (-15, None))
+        self.assertEqual(runs["after_broken"].status, skeleton_runner.NOT_STARTED)
+        self.assertEqual(self.output(), ["base"])
+
+    def test_history(self):
+        history = skeleton_history.History(os.path.join(self.tmpdir, "history.sqlite"))
+        try:
+            skeleton_runner.Runner(self.script, jobs=2, verbose=False, history=history).run(["after_broken"])
+            records = {x.task: x for x in history.page()}
+        finally:
+            history.close()
+        self.assertEqual(records["broken"].returncode, 3)
+        self.assertGreater(records["base"].max_rss, 0)
+        self.assertGreaterEqual(records["base"].cpu_time, 0)
+        self.assertEqual(records["base"].source, "runner")
+        self.assertGreaterEqual(records["base"].duration, 0)
+        self.assertNotIn("after_broken", records)  # was not started
+
+    def test_resources(self):
+        started = time.monotonic()
+        runs = skeleton_runner.Runner(self.script, jobs=2, verbose=False, memory=1024**3).run(["heavy"])
+        self.assertGreater(time.monotonic() - started, 0.55)  # both do not fit into memory at once
+        self.assertEqual(runs["heavy"].status, skeleton_runner.OK)
+        self.assertEqual(self.output(), ["heavy_b", "heavy_a"])  # by priority
+
+        runner = skeleton_runner.Runner(self.script, verbose=False)
+        self.assertEqual(runner.run(["greedy"])["greedy"].status, skeleton_runner.OK)  # not limited by default
+        runner.limits = True
+        self.assertEqual(runner.run(["greedy"])["greedy"].status, skeleton_runner.FAILED)  # over its limit
+
+    def test_runner_env(self):
+        # "heavy" runs its dependencies itself unless the runner has run them
+        skeleton_runner.Runner(self.script, verbose=False).run(["heavy"])
+        self.assertEqual(sorted(self.output()), ["heavy_a", "heavy_b"])
+        env = {x: y for x, y in os.environ.items() if x != skeleton_runner.RUNNER_ENV}
+        subprocess.run([self.script, "heavy"], env=env, check=True)
+        self.assertEqual(sorted(self.output()), ["heavy_a", "heavy_a", "heavy_b", "heavy_b"])
+
+    def test_resolve_errors(self):
+        runner = skeleton_runner.Runner(self.script, verbose=False)
+        with self.assertRaisesRegex(RuntimeError, "no such task"):
+            runner.run(["nothing"])
+        with self.assertRaisesRegex(RuntimeError, "cycle"):
+            runner.run(["loop_a"])
+
+
+class TestIncremental(ScriptTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(self.script + ".in", "w") as data:
+            data.write("one\n")
+        self.state = skeleton_state.State(os.path.join(self.tmpdir, "state.sqlite"))
+
+    def tearDown(self):
+        self.state.close()
+        super().tearDown()
+
+    def run_tasks(self, targets, **kwargs):
+        runner = skeleton_runner.Runner(self.script, verbose=False, state=self.state, **kwargs)
+        return {x.name: (x.status, x.reason) for x in runner.run(targets).values()}
+
+    def plan(self, targets):
+        runner = skeleton_runner.Runner(self.script, verbose=False, state=self.state)
+        return {x.name: (x.status, x.reason) for x in runner.plan(targets).values()}
+
+    def test_hash_path(self):
+        digest = skeleton_state.hash_path(self.script + ".in")
+        self.assertEqual(len(digest), 64)
+        self.assertIsNone(skeleton_state.hash_path(self.script + ".nothing"))
+        before = skeleton_state.hash_path(self.tmpdir)
+        with open(self.script + ".in", "w") as data:
+            data.write("two\n")
+        self.assertNotEqual(skeleton_state.hash_path(self.script + ".in"), digest)
+        self.assertNotEqual(skeleton_state.hash_path(self.tmpdir), before)
+
+    def test_skip_up_to_date(self):
+        first = self.run_tasks(["use_generated"])
+        self.assertEqual(first["generate"], (skeleton_runner.OK, "never succeeded"))
+        self.assertEqual(first["use_generated"], (skeleton_runner.OK, "never succeeded"))
+        second = self.run_tasks(["use_generated", "base"])
+        self.assertEqual(second["generate"], (skeleton_runner.SKIPPED, "up to date"))
+        self.assertEqual(second["use_generated"], (skeleton_runner.SKIPPED, "up to date"))
+        self.assertEqual(second["base"], (skeleton_runner.OK, "no inputs or outputs declared"))
+        self.assertEqual(self.output(), ["generate", "use_generated", "base"])
+
+    def test_input_changed(self):
+        self.run_tasks(["use_generated"])
+        with open(self.script + ".in", "w") as data:
+            data.write("two\n")
+        plan = self.plan(["use_generated"])
+        self.assertEqual(plan["generate"], (skeleton_runner.WOULD_RUN, f"input changed: {self.script}.in"))
+        self.assertEqual(plan["use_generated"], (skeleton_runner.WOULD_RUN, "dependency will run: generate"))
+        self.assertEqual(self.output(), ["generate", "use_generated"])  # dry run runs nothing
+
+        runs = self.run_tasks(["use_generated"])
+        self.assertEqual(runs["use_generated"], (skeleton_runner.OK, "dependency changed: generate"))
+        with open(self.script + ".used") as used:
+            self.assertEqual(used.read(), "two\n")
+
+    def test_output_changed(self):
+        self.run_tasks(["use_generated"])
+        os.unlink(self.script + ".used")
+        runs = self.run_tasks(["use_generated"])
+        self.assertEqual(runs["generate"][0], skeleton_runner.SKIPPED)
+        self.assertEqual(runs["use_generated"], (skeleton_runner.OK, f"output missing: {self.script}.used"))
+
+    def test_force(self):
+        self.run_tasks(["generate"])
+        self.assertEqual(self.run_tasks(["generate"], force=True)["generate"], (skeleton_runner.OK, "forced"))
+        self.assertEqual(self.output(), ["generate", "generate"])
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Content hashes of the last successful run of every task, to skip tasks which are up to date.
+
+Only tasks which declare "--inputs" or "--outputs" (see skeleton_meta) are ever skipped:
+the task is up to date if its function body, content of its inputs and results of its dependencies
+are the same as at the last success and its outputs are still there untouched.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from skeleton_meta import Function
+
+_READ_SIZE = 1024 * 1024
+
+
+def hash_path(path: str) -> Optional[str]:
+    # sha256 of file content, of names and content of all files for directory, None if there is nothing
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(os.path.relpath(full, path).encode("UTF-8") + b"\0")
+                digest.update((hash_path(full) or "").encode("ascii") + b"\0")
+        return digest.hexdigest()
+    try:
+        with open(path, "rb") as data:
+            for block in iter(lambda: data.read(_READ_SIZE), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def fingerprint(record: dict) -> str:
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode("UTF-8")).hexdigest()
+
+
+def current_record(function: Function, deps: Dict[str, Optional[str]]) -> dict:
+    # what the task depends on now, "deps" are fingerprints of results of dependencies
+    return {
+        "body": function.body_digest,
+        "inputs": {x: hash_path(x) for x in function.inputs},
+        "deps": deps,
+        "outputs": {},
+    }
+
+
+def outdated_reason(function: Function, stored: Optional[dict], current: dict) -> Optional[str]:
+    """Why the task has to be run, None if it is up to date."""
+    if not function.inputs and not function.outputs:
+        return "no inputs or outputs declared"
+    if stored is None:
+        return "never succeeded"
+    if stored["body"] != current["body"]:
+        return "function body changed"
+    for path, digest in current["inputs"].items():
+        if stored["inputs"].get(path, "") != digest:
+            return f"input changed: {path}" if digest is not None else f"input missing: {path}"
+    if set(stored["inputs"]) != set(current["inputs"]):
+        return "inputs list changed"
+    for name, digest in current["deps"].items():
+        if stored["deps"].get(name, "") != digest:
+            return f"dependency changed: {name}"
+    for path in function.outputs:
+        digest = hash_path(path)
+        if digest is None:
+            return f"output missing: {path}"
+        if stored["outputs"].get(path) != digest:
+            return f"output changed: {path}"
+    return None
+
+
+class State:
+    """Records of the last successful run of tasks in sqlite database."""
+
+    def __init__(self, path: str = ".skeleton_state.sqlite") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS task_state ("
+                " name TEXT PRIMARY KEY,"
+                " record TEXT NOT NULL,"
+                " fingerprint TEXT NOT NULL,"
+                " finished REAL NOT NULL)"
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get(self, name: str) -> Optional[Tuple[dict, str]]:
+        with self._lock:
+            row = self._db.execute("SELECT record, fingerprint FROM task_state WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def success(self, function: Function, record: dict) -> str:
+        # save record of just succeeded task together with its outputs, return fingerprint of the result
+        record = dict(record, outputs={x: hash_path(x) for x in function.outputs})
+        result = fingerprint(record)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO task_state (name, record, fingerprint, finished) VALUES (?, ?, ?, ?)",
+                (function.name, json.dumps(record, sort_keys=True), result, time.time()),
+            )
+        return result
+
+    def forget(self, name: str) -> None:
+        # after failure: outputs may be written partially
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM task_state WHERE name = ?", (name,))
@@ -0,0 +1,784 @@
+#!/usr/bin/env python3
+
+import email.utils
+import gzip
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+
+import skeleton
+
+
+class ExampleHandler(skeleton.JSONHandler):
+    protocol_version = "HTTP/1.1"
+    max_body_size = 1000
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        if self.route == "/json":
+            self.return_json(HTTPStatus.OK, {"b": [1, 2], "a": "ы"})
+        elif self.route == "/stream":
+            self.return_json_stream(HTTPStatus.OK, {"numbers": list(range(20000))})
+        elif self.route == "/echo":
+            self.return_content(HTTPStatus.OK, "application/octet-stream", self.read_data() or b"")
+        elif self.route == "/text":
+            size = int(self.query["size"][0])
+            self.return_content(HTTPStatus.OK, "text/plain", b"abc" * size)
+        elif self.route == "/png":
+            self.return_content(HTTPStatus.OK, "image/png", b"abc" * 1000)
+        elif self.route == "/cached":
+            self.show_cached()
+        elif self.route == "/metrics":
+            self.return_metrics()
+        elif self.route == "/lines":
+            self.return_json(HTTPStatus.OK, {"lines": list(self.read_json_lines())})
+        elif self.route == "/flight":
+            self.show_flight()
+        elif self.route == "/flight/cached":
+            self.show_flight_cached()
+        elif self.route == "/flight/error":
+            self.show_flight_error()
+        elif self.route == "/flight/slow":
+            self.show_flight_slow()
+        elif self.route == "/file":
+            if "copy" in self.query:
+                self.connection = None  # like a socket without sendfile
+            self.return_file(ExampleHandler.file_path)
+        else:
+            self.return_content(HTTPStatus.NOT_FOUND, "text/plain", b"")
+
+    def do_HEAD(self):
+        self.do_POST()
+
+    @skeleton.cached_response(ttl=60)
+    def show_cached(self):
+        ExampleHandler.calls += 1
+        self.return_content(HTTPStatus.OK, "text/plain", b"%d" % ExampleHandler.calls)
+
+    @skeleton.single_flight()
+    def show_flight(self):
+        time.sleep(0.3)
+        ExampleHandler.calls += 1
+        self.return_content(HTTPStatus.OK, "text/plain", b"%d" % ExampleHandler.calls)
+
+    @skeleton.single_flight()
+    @skeleton.cached_response(ttl=60)
+    def show_flight_cached(self):
+        self.show_flight.__wrapped__(self)
+
+    @skeleton.single_flight()
+    def show_flight_error(self):
+        time.sleep(0.3)
+        ExampleHandler.calls += 1
+        raise skeleton.HTTPError(HTTPStatus.CONFLICT, "broken")
+
+    @skeleton.single_flight(timeout=0.05)
+    def show_flight_slow(self):
+        self.show_flight.__wrapped__(self)
+
+    calls = 0
+    file_path = ""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    handler = ExampleHandler
+
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(("localhost", 0), self.handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.01,), daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection(*self.httpd.server_address[:2], timeout=10)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+
+class TestFunctions(unittest.TestCase):
+    def test_encode_chunks(self):
+        self.assertEqual(list(skeleton.encode_chunks([])), [])
+        self.assertEqual(list(skeleton.encode_chunks(["a", "b", "ы"], size=2)), [b"ab", "ы".encode()])
+        self.assertEqual(list(skeleton.encode_chunks(["abc", "d"], size=2)), [b"abc", b"d"])
+
+    def test_dump_json(self):
+        obj = {"b": 1, "a": ["ы"]}
+        self.assertEqual(json.loads(skeleton.dump_json(obj)), obj)
+        self.assertEqual(skeleton.dump_json(obj, pretty=False), '{"b":1,"a":["ы"]}'.encode())
+        self.assertEqual(skeleton.dump_json(obj), '{\n  "a": [\n    "ы"\n  ],\n  "b": 1\n}'.encode())
+        self.assertEqual(json.loads(skeleton.dump_json({1: 2**70}, pretty=False)), {"1": 2**70})
+
+    def test_parse_range(self):
+        self.assertIsNone(skeleton.parse_range(None, 100))
+        self.assertIsNone(skeleton.parse_range("bytes=1-2,5-6", 100))
+        self.assertIsNone(skeleton.parse_range("lines=1-2", 100))
+        self.assertIsNone(skeleton.parse_range("bytes=5-1", 100))
+        self.assertEqual(skeleton.parse_range("bytes=10-19", 100), (10, 20))
+        self.assertEqual(skeleton.parse_range("bytes=90-", 100), (90, 100))
+        self.assertEqual(skeleton.parse_range("bytes=90-1000", 100), (90, 100))
+        self.assertEqual(skeleton.parse_range("bytes=-10", 100), (90, 100))
+        self.assertEqual(skeleton.parse_range("bytes=-1000", 100), (0, 100))
+        with self.assertRaises(ValueError):
+            skeleton.parse_range("bytes=100-", 100)
+        with self.assertRaises(ValueError):
+            skeleton.parse_range("bytes=-0", 100)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = skeleton.LRUCache(max_size=10)
+        cache.put("a", 1, size=4)
+        cache.put("b", 2, size=4)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3, size=4)  # "b" is the least recently used
+        self.assertEqual(cache.keys(), ["a", "c"])
+        self.assertEqual(cache.size, 8)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.put("big", 0, size=11)
+        self.assertNotIn("big", cache.keys())
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertEqual(cache.size, 4)
+
+    def test_on_evict(self):
+        evicted = []
+        cache = skeleton.LRUCache(max_size=10, on_evict=lambda key, value: evicted.append((key, value)))
+        cache.put("a", 1, size=6)
+        cache.put("b", 2, size=6)
+        cache.put("big", 3, size=11)
+        self.assertEqual(evicted, [("a", 1), ("big", 3)])
+        self.assertEqual(cache.keys(), ["b"])
+
+
+class TestCompression(ServerTestCase):
+    def test_parse_accept_encoding(self):
+        self.assertEqual(skeleton.parse_accept_encoding(None), {})
+        self.assertEqual(
+            skeleton.parse_accept_encoding("gzip;q=0.5, Deflate ,br;q=x"), {"gzip": 0.5, "deflate": 1.0, "br": 0.0}
+        )
+
+    def test_compress(self):
+        for encoding, decompress in (("gzip", gzip.decompress), ("deflate", zlib.decompress)):
+            compressed = skeleton.compress(b"abc" * 100, encoding, 6)
+            self.assertEqual(decompress(compressed), b"abc" * 100)
+            compressed = b"".join(skeleton.compress_chunks([b"abc"] * 100, encoding, 6, flush=True))
+            self.assertEqual(decompress(compressed), b"abc" * 100)
+
+    def test_negotiation(self):
+        response, body = self.request("GET", "/text?size=1000", headers={"Accept-Encoding": "gzip;q=0.5, deflate"})
+        self.assertEqual(response.getheader("Content-Encoding"), "deflate")
+        self.assertEqual(response.getheader("Vary"), "Accept-Encoding")
+        self.assertEqual(zlib.decompress(body), b"abc" * 1000)
+
+        response, body = self.request("GET", "/text?size=1000", headers={"Accept-Encoding": "*;q=0.1, deflate;q=0"})
+        self.assertIn(response.getheader("Content-Encoding"), ("gzip", "br"))
+
+        response, body = self.request("GET", "/text?size=1000")
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual(body, b"abc" * 1000)
+
+    def test_not_compressed(self):
+        response, body = self.request("GET", "/text?size=10", headers={"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual(body, b"abc" * 10)
+
+        response, body = self.request("GET", "/png", headers={"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertIsNone(response.getheader("Vary"))
+
+    def test_cache(self):
+        hits = self.handler.compress_cache.hits
+        for _ in range(2):
+            _, body = self.request("GET", "/text?size=2000", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(gzip.decompress(body), b"abc" * 2000)
+        self.assertEqual(self.handler.compress_cache.hits, hits + 1)
+
+    def test_stream(self):
+        response, body = self.request("GET", "/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), {"numbers": list(range(20000))})
+
+
+class TestETag(ServerTestCase):
+    def test_etag_matches(self):
+        self.assertFalse(skeleton.etag_matches(None, '"a"'))
+        self.assertTrue(skeleton.etag_matches("*", '"a"'))
+        self.assertTrue(skeleton.etag_matches('"b", W/"a"', '"a"'))
+        self.assertFalse(skeleton.etag_matches('"b"', '"a"'))
+
+    def test_not_modified(self):
+        response, body = self.request("GET", "/text?size=10")
+        etag = response.getheader("ETag")
+        self.assertTrue(etag.startswith('"'))
+
+        response, body = self.request("GET", "/text?size=10", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(body, b"")
+
+        response, body = self.request("GET", "/text?size=11", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, HTTPStatus.OK)
+
+    def test_encoded(self):
+        response, _ = self.request("GET", "/text?size=1000")
+        response_gzip, _ = self.request("GET", "/text?size=1000", headers={"Accept-Encoding": "gzip"})
+        self.assertNotEqual(response.getheader("ETag"), response_gzip.getheader("ETag"))
+        self.assertTrue(response_gzip.getheader("ETag").endswith('-gzip"'))
+
+        headers = {"Accept-Encoding": "gzip", "If-None-Match": response_gzip.getheader("ETag")}
+        response, _ = self.request("GET", "/text?size=1000", headers=headers)
+        self.assertEqual(response.status, HTTPStatus.NOT_MODIFIED)
+
+    def test_response_cache(self):
+        cache = self.handler.response_cache
+        cache.invalidate()
+        _, first = self.request("GET", "/cached?a=1&b=2")
+        _, second = self.request("GET", "/cached?b=2&a=1")
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats()["items"], 1)
+
+        _, other = self.request("GET", "/cached?a=2")
+        self.assertNotEqual(first, other)
+
+        cache.invalidate("/cached")
+        self.assertEqual(cache.stats()["items"], 0)
+        _, third = self.request("GET", "/cached?a=1&b=2")
+        self.assertNotEqual(first, third)
+
+
+class TestFile(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        descriptor, ExampleHandler.file_path = tempfile.mkstemp(suffix=".txt")
+        self.content = bytes(range(256)) * 1000
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(self.content)
+        os.utime(ExampleHandler.file_path, (1_600_000_000, 1_600_000_000))
+
+    def tearDown(self):
+        os.unlink(ExampleHandler.file_path)
+        super().tearDown()
+
+    def test_whole(self):
+        for path in ("/file", "/file?copy=1"):
+            response, body = self.request("GET", path)
+            self.assertEqual(response.status, HTTPStatus.OK)
+            self.assertEqual(body, self.content)
+            self.assertEqual(response.getheader("Content-Type"), "text/plain")
+            self.assertEqual(response.getheader("Accept-Ranges"), "bytes")
+            self.assertEqual(response.getheader("Last-Modified"), "Sun, 13 Sep 2020 12:26:40 GMT")
+            self.assertIsNone(response.getheader("Content-Encoding"))  # files are sent as is
+
+        response, body = self.request("HEAD", "/file")
+        self.assertEqual(response.getheader("Content-Length"), str(len(self.content)))
+        self.assertEqual(body, b"")
+
+        os.unlink(ExampleHandler.file_path)
+        self.assertEqual(self.request("GET", "/file")[0].status, HTTPStatus.NOT_FOUND)
+        open(ExampleHandler.file_path, "w").close()
+
+    def test_range(self):
+        connection = http.client.HTTPConnection(*self.httpd.server_address[:2], timeout=10)
+        try:
+            for path in ("/file", "/file?copy=1"):
+                connection.request("GET", path, headers={"Range": "bytes=1000-1999"})
+                response = connection.getresponse()
+                self.assertEqual(response.status, HTTPStatus.PARTIAL_CONTENT)
+                self.assertEqual(response.getheader("Content-Range"), f"bytes 1000-1999/{len(self.content)}")
+                self.assertEqual(response.read(), self.content[1000:2000])
+
+                # the same connection is still usable: exactly Content-Length bytes are sent
+                connection.request("GET", path, headers={"Range": "bytes=-10"})
+                self.assertEqual(connection.getresponse().read(), self.content[-10:])
+        finally:
+            connection.close()
+
+        response, _ = self.request("GET", "/file", headers={"Range": f"bytes={len(self.content)}-"})
+        self.assertEqual(response.status, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response.getheader("Content-Range"), f"bytes */{len(self.content)}")
+
+        headers = {"Range": "bytes=0-9", "If-Range": '"other"'}
+        response, body = self.request("GET", "/file", headers=headers)
+        self.assertEqual(response.status, HTTPStatus.OK)  # the file has changed, the whole one is sent
+        self.assertEqual(body, self.content)
+
+    def test_empty(self):
+        open(ExampleHandler.file_path, "w").close()
+        connection = http.client.HTTPConnection(*self.httpd.server_address[:2], timeout=10)
+        try:
+            for path in ("/file", "/file?copy=1", "/file"):
+                connection.request("GET", path)
+                response = connection.getresponse()
+                self.assertEqual((response.status, response.read()), (HTTPStatus.OK, b""))
+                self.assertEqual(response.getheader("Content-Length"), "0")
+        finally:
+            connection.close()
+
+    def test_not_modified(self):
+        response, _ = self.request("GET", "/file")
+        etag, last_modified = response.getheader("ETag"), response.getheader("Last-Modified")
+
+        response, body = self.request("GET", "/file", headers={"If-None-Match": etag})
+        self.assertEqual((response.status, body), (HTTPStatus.NOT_MODIFIED, b""))
+        response, _ = self.request("GET", "/file", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(response.getheader("Last-Modified"), last_modified)
+
+        earlier = email.utils.formatdate(1_500_000_000, usegmt=True)
+        self.assertEqual(self.request("GET", "/file", headers={"If-Modified-Since": earlier})[0].status, HTTPStatus.OK)
+        # If-None-Match wins
+        headers = {"If-None-Match": '"other"', "If-Modified-Since": last_modified}
+        self.assertEqual(self.request("GET", "/file", headers=headers)[0].status, HTTPStatus.OK)
+
+        os.utime(ExampleHandler.file_path)
+        response, _ = self.request("GET", "/file", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, HTTPStatus.OK)
+
+
+class TestSingleFlight(ServerTestCase):
+    def burst(self, path, number=5):
+        results = [None] * number
+
+        def get(index):
+            response, body = self.request("GET", path)
+            results[index] = (response.status, body)
+
+        threads = [threading.Thread(target=get, args=(x,)) for x in range(number)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)  # all of them while the first is computing
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_shared(self):
+        calls = ExampleHandler.calls
+        followers = self.handler.single_flights.followers
+        results = self.burst("/flight?a=1")
+        self.assertEqual(ExampleHandler.calls, calls + 1)
+        self.assertEqual(set(results), {(HTTPStatus.OK, b"%d" % (calls + 1))})
+        self.assertEqual(self.handler.single_flights.followers, followers + 4)
+
+        # another query is another computation, the finished one is not reused
+        self.burst("/flight?a=2", 1)
+        self.burst("/flight?a=1", 1)
+        self.assertEqual(ExampleHandler.calls, calls + 3)
+
+    def test_cached(self):
+        calls = ExampleHandler.calls
+        self.burst("/flight/cached")
+        self.burst("/flight/cached")
+        self.assertEqual(ExampleHandler.calls, calls + 1)
+
+    def test_error(self):
+        calls = ExampleHandler.calls
+        results = self.burst("/flight/error")
+        self.assertEqual(ExampleHandler.calls, calls + 1)
+        self.assertEqual({x[0] for x in results}, {HTTPStatus.CONFLICT})
+
+    def test_timeout(self):
+        results = self.burst("/flight/slow", 3)
+        unavailable = HTTPStatus.SERVICE_UNAVAILABLE
+        self.assertEqual([x[0] for x in results], [HTTPStatus.OK, unavailable, unavailable])
+
+
+class TestMetrics(ServerTestCase):
+    def test_record(self):
+        metrics = skeleton.Metrics(buckets=(0.1, 1.0))
+        metrics.started()
+        self.assertEqual(metrics.in_flight, 1)
+        metrics.finished("GET", "/", 200, 10, 0.05)
+        metrics.started()
+        metrics.finished("GET", "/", 500, 5, 2.0)
+        self.assertEqual(metrics.in_flight, 0)
+
+        route = metrics.snapshot()[("GET", "/")]
+        self.assertEqual(route.statuses, {200: 1, 500: 1})
+        self.assertEqual(route.bytes_sent, 15)
+        self.assertEqual(route.latency_counts, [1, 0, 1])
+        self.assertEqual(route.quantile(metrics.buckets, 0.5), 0.1)
+        self.assertEqual(route.quantile(metrics.buckets, 0.99), float("inf"))
+
+        text = metrics.as_prometheus({"extra": 1})
+        self.assertIn('http_requests_total{method="GET",route="/",status="500"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/",le="1.0"} 1\n', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/",le="+Inf"} 2\n', text)
+        self.assertIn("extra 1\n", text)
+
+    def test_malformed_request(self):
+        with socket.create_connection(self.httpd.server_address[:2], timeout=10) as connection:
+            connection.sendall(b"GARBAGE\r\n\r\n")
+            self.assertIn(b"Error code: 400", connection.makefile("rb").read())  # HTTP/0.9: no status line
+        deadline = time.monotonic() + 5  # the response is sent before the request is counted
+        while self.handler.metrics.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.handler.metrics.in_flight, 0)
+        self.assertIn(("", "<unknown>"), self.handler.metrics.snapshot())
+
+    def test_labels(self):
+        self.assertEqual(skeleton.prometheus_labels(a='x"\\\n'), '{a="x\\"\\\\\\n"}')
+
+    def test_route_label(self):
+        self.assertEqual(skeleton.route_label("/job/12/events"), "/job/{id}/events")
+        self.assertEqual(skeleton.route_label("/history/7"), "/history/{id}")
+        self.assertEqual(skeleton.route_label("/artifact/" + "ab" * 32), "/artifact/{id}")
+        self.assertEqual(skeleton.route_label("/v2/json"), "/v2/json")
+
+    def test_endpoint(self):
+        self.request("GET", "/json")
+        self.request("GET", "/no/such/path")
+        response, body = self.request("GET", "/metrics")
+        self.assertTrue(response.getheader("Content-Type").startswith("text/plain"))
+        self.assertIn('route="/json",status="200"', body.decode())
+        self.assertIn('route="<unknown>",status="404"', body.decode())
+
+        response, body = self.request("GET", "/metrics", headers={"Accept": "text/html"})
+        self.assertEqual(response.getheader("Content-Type"), "text/html")
+        self.assertIn(b"&lt;unknown&gt;", body)
+
+
+class AccessLogHandler(ExampleHandler):
+    log_message = skeleton.PreHandler.log_message
+
+
+class TestAccessLog(ServerTestCase):
+    handler = AccessLogHandler
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "access.log")
+
+    def tearDown(self):
+        AccessLogHandler.access_log = None
+        shutil.rmtree(self.tmpdir)
+        super().tearDown()
+
+    def read(self, path):
+        with open(path) as log:
+            return [json.loads(x) for x in log]
+
+    def test_records(self):
+        AccessLogHandler.access_log = skeleton.AccessLog(self.path)
+        self.request("GET", "/json")
+        self.request("POST", "/no/such/path")
+        _, body = self.request("GET", "/metrics")
+        self.assertIn(b"http_access_log_dropped 0", body)
+        AccessLogHandler.access_log.close()
+
+        records = {x["path"]: x for x in self.read(self.path)}
+        self.assertEqual((records["/json"]["method"], records["/json"]["status"]), ("GET", 200))
+        self.assertEqual((records["/no/such/path"]["method"], records["/no/such/path"]["status"]), ("POST", 404))
+        self.assertGreater(records["/json"]["bytes"], 0)
+        self.assertGreaterEqual(records["/json"]["latency"], 0)
+        self.assertEqual(records["/json"]["client"], "127.0.0.1")
+        self.assertTrue(records["/json"]["thread"])
+
+    def test_rotation(self):
+        log = skeleton.AccessLog(self.path, max_bytes=100, backups=2, flush_interval=0)
+        for number in range(20):
+            log.add({"number": number})
+            time.sleep(0.002)
+        log.close()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["access.log", "access.log.1", "access.log.2"])
+        numbers = []
+        for name in ("access.log.2", "access.log.1", "access.log"):
+            numbers += [x["number"] for x in self.read(os.path.join(self.tmpdir, name))]
+        self.assertEqual(numbers, sorted(numbers))
+        self.assertEqual(numbers[-1], 19)
+
+    def test_drop(self):
+        writing, release = threading.Event(), threading.Event()
+
+        class SlowStream:
+            def write(self, _data):
+                writing.set()
+                release.wait()
+
+            def flush(self):
+                pass
+
+        log = skeleton.AccessLog(max_records=2, flush_interval=0)
+        log._stream = SlowStream()
+        log.add({"number": 0})
+        self.assertTrue(writing.wait(5))
+        started = time.perf_counter()
+        for number in range(1, 6):
+            log.add({"number": number})
+        self.assertLess(time.perf_counter() - started, 0.1)  # the handler does not wait for the writer
+        self.assertEqual((log.queued, log.dropped), (2, 3))
+        release.set()
+        log.close()
+
+
+class TestJSONHandler(ServerTestCase):
+    def test_compact(self):
+        response, body = self.request("GET", "/json")
+        self.assertEqual(response.status, HTTPStatus.OK)
+        self.assertEqual(body, '{"b":[1,2],"a":"ы"}'.encode())
+
+    def test_pretty(self):
+        _, body = self.request("GET", "/json?pretty=1")
+        self.assertIn(b"\n", body)
+        _, body = self.request("GET", "/json", headers={"Accept": "text/html,application/xhtml+xml"})
+        self.assertIn(b"\n", body)
+        _, body = self.request("GET", "/json?pretty=0", headers={"Accept": "text/html"})
+        self.assertNotIn(b"\n", body)
+
+    def test_stream(self):
+        response, body = self.request("GET", "/stream")
+        self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+        self.assertEqual(json.loads(body), {"numbers": list(range(20000))})
+
+
+class TestPreHandlerBody(ServerTestCase):
+    def test_sized(self):
+        response, body = self.request("POST", "/echo", body=b"x" * 1000)
+        self.assertEqual(response.status, HTTPStatus.OK)
+        self.assertEqual(body, b"x" * 1000)
+
+    def test_chunked(self):
+        response, body = self.request("POST", "/echo", body=iter([b"abc", b"", b"de" * 100]))
+        self.assertEqual(response.status, HTTPStatus.OK)
+        self.assertEqual(body, b"abc" + b"de" * 100)
+
+    def test_too_large(self):
+        response, _ = self.request("POST", "/echo", body=b"x" * 1001)
+        self.assertEqual(response.status, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        response, _ = self.request("POST", "/echo", body=iter([b"x" * 600, b"x" * 600]))
+        self.assertEqual(response.status, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+    def test_bad_chunk(self):
+        response, _ = self.request(
+            "POST", "/echo", body=b"zz\r\nabc\r\n0\r\n\r\n", headers={"Transfer-Encoding": "chunked"}
+        )
+        self.assertEqual(response.status, HTTPStatus.BAD_REQUEST)
+
+    def test_json_lines(self):
+        body = iter([b'{"a": 1}\n\n[2', b', 3]\n"x"'])
+        response, body = self.request("POST", "/lines", body=body, headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status, HTTPStatus.OK)
+        self.assertEqual(json.loads(body), {"lines": [{"a": 1}, [2, 3], "x"]})
+
+        response, _ = self.request("POST", "/lines", body=b"{]\n")
+        self.assertEqual(response.status, HTTPStatus.BAD_REQUEST)
+
+
+class AdmissionHandler(ExampleHandler):
+    admission = skeleton.Admission(rate=100, burst=100, routes={"/json": (1, 2)}, max_active=4)
+
+
+class TestAdmission(ServerTestCase):
+    handler = AdmissionHandler
+
+    def test_rate_limits(self):
+        admission = skeleton.Admission(rate=10, burst=3, routes={"/slow": (1, 1)})
+        self.assertFalse(admission.acquire("a", "/"))
+        admission.acquire("a", "/slow")
+        with self.assertRaises(skeleton.HTTPError) as error:
+            admission.acquire("a", "/slow")
+        self.assertEqual(error.exception.status, HTTPStatus.TOO_MANY_REQUESTS)
+        self.assertEqual(error.exception.headers, {"Retry-After": "1"})
+        admission.acquire("a", "/")  # the request rejected above has not taken a token of the client
+        with self.assertRaises(skeleton.HTTPError):
+            admission.acquire("a", "/")
+        admission.acquire("b", "/slow")  # other clients have their own buckets
+        time.sleep(0.15)
+        admission.acquire("a", "/")
+        self.assertEqual((admission.limited, admission.clients), (2, 4))
+
+    def test_fair_queue(self):
+        admission = skeleton.Admission(max_active=1, max_waiting=3, timeout=5)
+        self.assertTrue(admission.acquire("a", "/"))
+        order = []
+
+        def request(client):
+            admission.acquire(client, "/")
+            order.append(client)
+            admission.release()
+
+        threads = []
+        for number, client in enumerate("aaab"):
+            threads.append(threading.Thread(target=request, args=(client,)))
+            threads[-1].start()
+            while admission.waiting < number + 1:
+                time.sleep(0.001)
+        with self.assertRaises(skeleton.HTTPError) as error:
+            admission.acquire("a", "/")  # the queue of "a" is full, "b" still may wait
+        self.assertEqual(error.exception.status, HTTPStatus.TOO_MANY_REQUESTS)
+        admission.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["a", "b", "a", "a"])
+        self.assertEqual((admission.active, admission.waiting), (0, 0))
+
+    def test_timeout(self):
+        admission = skeleton.Admission(max_active=1, timeout=0.05)
+        admission.acquire("a", "/")
+        with self.assertRaises(skeleton.HTTPError) as error:
+            admission.acquire("b", "/")
+        self.assertEqual(error.exception.status, HTTPStatus.SERVICE_UNAVAILABLE)
+        admission.release()
+        self.assertTrue(admission.acquire("b", "/"))
+        self.assertEqual((admission.rejected, admission.waiting), (1, 0))
+
+    def test_server(self):
+        statuses = []
+        for _ in range(3):
+            response, body = self.request("GET", "/json")
+            statuses.append(response.status)
+        self.assertEqual(statuses, [HTTPStatus.OK, HTTPStatus.OK, HTTPStatus.TOO_MANY_REQUESTS])
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(body, b"retry after 1 s\n")
+        response, body = self.request("GET", "/metrics")
+        self.assertIn(b"http_admission_limited 1", body)
+        self.assertIn(b"http_admission_active 1", body)  # the request for metrics itself
+
+
+_RELOAD_HANDLER = """\
+import os
+import sys
+import time
+from http import HTTPStatus
+
+import skeleton
+
+VERSION = %r
+
+
+class Handler(skeleton.JSONHandler):
+    def do_GET(self):
+        time.sleep(0.02)
+        self.return_json(HTTPStatus.OK, {"version": VERSION, "pid": os.getpid()})
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    httpd = skeleton.serve("reload_handler:Handler", ("localhost", 0), drain_timeout=5)
+    sys.exit(0 if httpd.upgraded else 4)
+"""
+
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.module = os.path.join(self.tmpdir, "reload_handler.py")
+        self.write_module("one")
+        self.listener = socket.socket()
+        self.listener.bind(("localhost", 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        self.pids = []
+
+    def tearDown(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.listener.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_module(self, version):
+        with open(self.module, "w") as module:
+            module.write(_RELOAD_HANDLER % version)
+
+    def start(self):
+        ready_read, ready_write = os.pipe()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([self.tmpdir, os.path.dirname(os.path.abspath(skeleton.__file__))])
+        env[skeleton._LISTEN_FD_ENV] = str(self.listener.fileno())
+        env[skeleton._READY_FD_ENV] = str(ready_write)
+        process = subprocess.Popen(
+            [sys.executable, self.module], env=env, pass_fds=(self.listener.fileno(), ready_write), cwd=self.tmpdir
+        )
+        self.pids.append(process.pid)
+        os.close(ready_write)
+        with os.fdopen(ready_read, "rb") as ready:
+            self.assertEqual(ready.read(), b"ready")
+        return process
+
+    def get(self):
+        connection = http.client.HTTPConnection("localhost", self.port, timeout=10)
+        try:
+            connection.request("GET", "/")
+            response = connection.getresponse()
+            self.assertEqual(response.status, HTTPStatus.OK)
+            return json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_reload_and_upgrade(self):
+        process = self.start()
+        self.assertEqual(self.get(), {"version": "one", "pid": process.pid})
+
+        seen = []
+        errors = []
+        stop = threading.Event()
+
+        def load():
+            while not stop.is_set():
+                try:
+                    seen.append(self.get())
+                except Exception as exc:  # pylint: disable=broad-except
+                    errors.append(exc)
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+
+            def wait_for(predicate):
+                deadline = time.monotonic() + 10
+                while time.monotonic() < deadline:
+                    if seen and predicate(seen[-1]):
+                        return seen[-1]
+                    time.sleep(0.05)
+                raise self.failureException(f"not seen, last response: {seen[-1:]}")
+
+            self.write_module("second")  # another size: the cached bytecode is not used
+            os.kill(process.pid, signal.SIGHUP)
+            wait_for(lambda x: x == {"version": "second", "pid": process.pid})
+
+            os.kill(process.pid, signal.SIGUSR2)
+            new = wait_for(lambda x: x["pid"] != process.pid)
+            self.pids.append(new["pid"])
+            self.assertEqual(new["version"], "second")
+            # the old process has finished its requests and exited, knowing that another one serves now
+            self.assertEqual(process.wait(10), 0)
+            time.sleep(0.2)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(seen[-1]["pid"], new["pid"])
+        os.kill(new["pid"], signal.SIGTERM)
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""Run tasks of skeleton.sh again whenever skeleton.sh or their "--inputs" change.
+
+Changes are taken from inotify (through ctypes, Linux) or by polling modification times of the files elsewhere.
+After "--debounce" seconds without new changes the tasks whose inputs (or function in skeleton.sh) have changed
+are run again together with everything depending on them, a run still going on is terminated first.
+Declared "--outputs" are written by tasks themselves, their changes are ignored.
+Every run is recorded in the history and, with "--server", its report is sent to /watch/ of the HTML server.
+
+    $ ./skeleton_watch.py -j 4 dependency_graph
+    $ ./skeleton.sh watch --server http://localhost:8000 dependency_graph
+"""
+
+import argparse
+import ctypes
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from skeleton_history import History
+from skeleton_meta import Function, read_script
+from skeleton_runner import OK, RESTORED, SKIPPED, Runner, TaskRun, report, resolve
+from skeleton_state import State
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_MASK |= IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; the name follows
+_READ_SIZE = 64 * 1024
+
+
+class InotifyWatcher:
+    """Watches directories: editors often replace a file by renaming a new one over it, a watch of the file is lost."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("no inotify")
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._dirs: Dict[int, str] = {}  # watch descriptor -> directory
+        self._trees: List[str] = []  # watched directories with all their subdirectories
+        self._paths: List[str] = []
+
+    def watch(self, paths: Iterable[str]) -> None:
+        """Replace the watched paths, files and directories, absolute. A missing path is waited for."""
+        self._paths = sorted(set(paths))
+        self._trees = [x for x in self._paths if os.path.isdir(x)]
+        wanted: Set[str] = set()
+        for path in self._paths:
+            if os.path.isdir(path):
+                wanted.update(root for root, _, _ in os.walk(path))
+            wanted.add(_existing_parent(path))
+        for wd, directory in list(self._dirs.items()):
+            if directory not in wanted:
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self._dirs[wd]
+        for directory in wanted - set(self._dirs.values()):
+            self._add(directory)
+
+    def _add(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _MASK)
+        if wd >= 0:  # may be removed already
+            self._dirs[wd] = directory
+
+    def read(self, timeout: Optional[float]) -> Set[str]:
+        """Changed paths, waits at most "timeout" seconds for the first one."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, size = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size : offset + _EVENT.size + size].rstrip(b"\0")
+            offset += _EVENT.size + size
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self._paths)  # events are lost, anything may have changed
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._dirs[wd]
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            changed.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and any(_inside(path, x) for x in self._trees):
+                self._add(path)
+        if any(x not in self._dirs.values() for x in map(_existing_parent, self._paths)):
+            self.watch(self._paths)  # a directory is created or removed on the way to a watched path
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Compares modification times and sizes of the files every "interval" seconds."""
+
+    def __init__(self, interval: float = 1.0) -> None:
+        self.interval = interval
+        self._paths: List[str] = []
+        self._snapshot: Dict[str, tuple] = {}
+
+    def watch(self, paths: Iterable[str]) -> None:
+        self._paths = sorted(set(paths))
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, tuple]:
+        result: Dict[str, tuple] = {}
+        for path in self._paths:
+            if os.path.isdir(path):
+                items = [os.path.join(root, x) for root, dirs, files in os.walk(path) for x in dirs + files]
+            else:
+                items = [path]
+            for item in items:
+                try:
+                    stat = os.stat(item)
+                except OSError:
+                    continue
+                result[item] = (stat.st_mtime_ns, stat.st_size, stat.st_ino, stat.st_mode)
+        return result
+
+    def read(self, timeout: Optional[float]) -> Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {x for x in set(snapshot) | set(self._snapshot) if snapshot.get(x) != self._snapshot.get(x)}
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else min(self.interval, max(deadline - time.monotonic(), 0)))
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(poll: bool = False, interval: float = 1.0) -> Union[InotifyWatcher, PollingWatcher]:
+    if not poll:
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):  # not Linux or out of inotify instances
+            pass
+    return PollingWatcher(interval)
+
+
+def _inside(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+
+def _existing_parent(path: str) -> str:
+    parent = os.path.dirname(path)
+    while parent != os.path.dirname(parent) and not os.path.isdir(parent):
+        parent = os.path.dirname(parent)
+    return parent
+
+
+def affected(functions: Dict[str, Function], graph: Dict[str, List[str]], changed: Iterable[str]) -> Set[str]:
+    """Tasks of graph with an input among changed paths (a file of an input directory or a created parent)."""
+    outputs = [os.path.abspath(x) for name in graph for x in functions[name].outputs]
+    changed = [x for x in changed if not any(_inside(x, y) for y in outputs)]
+    result = set()
+    for name in graph:
+        for path in [os.path.abspath(x) for x in functions[name].inputs]:
+            if any(_inside(x, path) or _inside(path, x) for x in changed):
+                result.add(name)
+                break
+    return result
+
+
+def downstream(graph: Dict[str, List[str]], names: Iterable[str]) -> Set[str]:
+    """Tasks and everything depending on them."""
+    dependents: Dict[str, List[str]] = {x: [] for x in graph}
+    for name, deps in graph.items():
+        for dep in deps:
+            dependents[dep].append(name)
+    result: Set[str] = set()
+    stack = [x for x in names if x in graph]
+    while stack:
+        name = stack.pop()
+        if name not in result:
+            result.add(name)
+            stack.extend(dependents[name])
+    return result
+
+
+def changed_functions(old: Dict[str, Function], new: Dict[str, Function]) -> Set[str]:
+    # new functions and ones whose text or declarations differ; the line number does not matter
+    def key(function: Function) -> dict:
+        return dict(function.as_dict(), line=None)
+
+    return {x for x, y in new.items() if x not in old or key(old[x]) != key(y)}
+
+
+def check_report(data) -> None:
+    """ValueError if "data" is not a report sent by publish, the server shows only checked ones."""
+
+    def optional(value, types) -> bool:
+        return value is None or (isinstance(value, types) and not isinstance(value, bool))
+
+    if not isinstance(data, dict) or not isinstance(data.get("runs"), dict):
+        raise ValueError("no runs")
+    if not isinstance(data.get("targets", []), list) or not all(isinstance(x, str) for x in data.get("targets", [])):
+        raise ValueError("targets are not a list of names")
+    if not optional(data.get("started"), (int, float)) or not optional(data.get("finished"), (int, float)):
+        raise ValueError("started and finished are not times")
+    for name, run in data["runs"].items():
+        if not isinstance(run, dict) or not isinstance(run.get("status"), str):
+            raise ValueError(f"run of {name} has no status")
+        if not optional(run.get("started"), (int, float)) or not optional(run.get("finished"), (int, float)):
+            raise ValueError(f"started and finished of {name} are not times")
+        if not optional(run.get("returncode"), int) or not optional(run.get("reason"), str):
+            raise ValueError(f"bad returncode or reason of {name}")
+
+
+def publish(server: str, report_data: dict, timeout: float = 10.0) -> None:
+    request = urllib.request.Request(
+        server.rstrip("/") + "/watch/",
+        data=json.dumps(report_data).encode("UTF-8"),
+        method="POST",
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
+
+
+class Watch:
+    """Runs targets once, then again after every change, only the tasks which are not up to date."""
+
+    def __init__(
+        self,
+        runner: Runner,
+        targets: List[str],
+        watcher: Union[InotifyWatcher, PollingWatcher],
+        debounce: float = 0.3,
+        server: Optional[str] = None,
+    ) -> None:
+        self.runner = runner
+        self.targets = targets
+        self.watcher = watcher
+        self.debounce = debounce
+        self.server = server  # URL of the HTML server to send reports to
+        self.functions: Dict[str, Function] = {}
+        self.graph: Dict[str, List[str]] = {}
+        self.runs: Dict[str, TaskRun] = {}  # of the last finished run
+        self.generation = 0  # number of the current run
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()  # tasks to run: changed or not succeeded yet
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.finished = threading.Condition(self._lock)  # notified after every run
+
+    def load(self) -> Set[str]:
+        # tasks changed in skeleton.sh, the graph and watched paths are updated
+        functions = {x.name: x for x in read_script(self.runner.script)}
+        graph = resolve(functions, self.targets)
+        changed = changed_functions(self.functions, functions)
+        self.functions, self.graph = functions, graph
+        paths = [os.path.abspath(self.runner.script)]
+        paths.extend(os.path.abspath(x) for name in graph for x in functions[name].inputs)
+        self.watcher.watch(paths)
+        return {x for x in changed if x in graph}
+
+    def start(self) -> None:
+        with self._lock:
+            only = set(self._pending)
+            self.generation += 1
+            generation = self.generation
+        self._thread = threading.Thread(target=self._run, args=(only, generation), name="watch run")
+        self._thread.start()
+
+    def cancel(self) -> None:
+        # terminates the stale run, its unfinished tasks stay pending
+        with self._lock:
+            self.generation += 1  # the report of the run is not shown
+        while self._thread is not None and self._thread.is_alive():
+            self.runner.stop()  # again: the run may not have started its tasks yet
+            self._thread.join(0.1)
+
+    def _run(self, only: Set[str], generation: int) -> None:
+        started = time.time()
+        try:
+            runs = self.runner.run(self.targets, only)
+        except (OSError, RuntimeError) as exc:  # skeleton.sh has changed since "load"
+            self.runner.log(f"not run: {exc}")
+            runs = {}
+        with self._lock:
+            for name, run in runs.items():
+                if run.status in (OK, SKIPPED, RESTORED):
+                    self._pending.discard(name)
+            stale = generation != self.generation
+            if not stale:
+                self.runs = runs
+            self.finished.notify_all()
+        if stale:
+            return
+        if self.runner.verbose:
+            sys.stderr.write(report(runs))
+        if self.server is not None:
+            data = {"targets": self.targets, "started": started, "finished": time.time()}
+            data["runs"] = {x.name: x.as_dict() for x in runs.values()}
+            try:
+                publish(self.server, data)
+            except (OSError, urllib.error.URLError) as exc:
+                self.runner.log(f"report is not sent to {self.server}: {exc}")
+
+    def changed(self, paths: Set[str]) -> Set[str]:
+        """Run again what the changed paths affect, returns the tasks to run."""
+        names = set()
+        if os.path.abspath(self.runner.script) in paths:
+            try:
+                names = self.load()
+            except (OSError, RuntimeError) as exc:  # the script is being edited: a cycle or no such task
+                self.runner.log(f"skeleton.sh is not usable: {exc}")
+                return set()
+        names |= affected(self.functions, self.graph, paths)
+        if not names:
+            return set()
+        self.cancel()
+        with self._lock:
+            self._pending = (self._pending | downstream(self.graph, names)) & set(self.graph)
+            names = set(self._pending)
+        self.runner.log(f"changed: {', '.join(sorted(names))}")
+        self.start()
+        return names
+
+    def wait_changes(self) -> Set[str]:
+        # the first change and everything coming until "debounce" seconds of silence, empty when stopped
+        paths: Set[str] = set()
+        while not self._stop.is_set() and not paths:
+            paths = self.watcher.read(0.5)
+        while paths and not self._stop.is_set():
+            more = self.watcher.read(self.debounce)
+            if not more:
+                break
+            paths |= more
+        return paths
+
+    def loop(self) -> None:
+        self.load()
+        self._pending = set(self.graph)
+        self.start()
+        try:
+            while not self._stop.is_set():
+                paths = self.wait_changes()
+                if paths:
+                    self.changed(paths)
+        finally:
+            self.cancel()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="+", help="tasks to run")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="CPU slots, see skeleton_runner")
+    parser.add_argument("--script", default="./skeleton.sh", help="path to skeleton.sh")
+    parser.add_argument("--state", default=".skeleton_state.sqlite", help="database with hashes of last runs")
+    parser.add_argument("--history", default=".skeleton_history.sqlite", help="database to record runs in")
+    parser.add_argument("--debounce", type=float, default=0.3, help="seconds without changes before a run")
+    parser.add_argument("--poll", action="store_true", help="poll files instead of inotify")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between polls")
+    parser.add_argument("--server", help="URL of the HTML server to show results at its /watch/ page")
+    args = parser.parse_args()
+
+    runner = Runner(args.script, args.jobs, state=State(args.state), history=History(args.history))
+    watcher = open_watcher(args.poll, args.interval)
+    runner.log(f"watching with {type(watcher).__name__}, Ctrl+C to stop")
+    watch = Watch(runner, args.targets, watcher, args.debounce, args.server)
+    try:
+        watch.loop()
+    except RuntimeError as exc:  # unknown task or dependency cycle
+        parser.error(str(exc))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer
+from typing import List
+
+import skeleton_runner
+import skeleton_watch
+from skeleton import PreHandler
+from skeleton_meta import Function, parse_script
+
+_SCRIPT = """\
+#!/usr/bin/env bash
+
+set -e -o pipefail
+
+OUT="$(dirname "$0")/out"
+
+generate() {
+    [ "$1" == "--inputs" ] && _inputs_and_exit "source.txt" || true
+    [ "$1" == "--outputs" ] && _outputs_and_exit "generated.txt" || true
+    echo generate >> "$OUT"
+    cp source.txt generated.txt
+}
+
+use_generated() {
+    [ "$1" == "--deps" ] && _deps_and_exit "generate" || true
+    [ "$1" == "--inputs" ] && _inputs_and_exit "generated.txt" || true
+    echo use_generated >> "$OUT"
+}
+
+other() {
+    [ "$1" == "--inputs" ] && _inputs_and_exit "other" || true
+    echo other >> "$OUT"
+}
+
+all() {
+    [ "$1" == "--deps" ] && _deps_and_exit "use_generated" "other" || true
+    echo all >> "$OUT"
+}
+
+_deps_and_exit() {
+    exit 0
+}
+
+_inputs_and_exit() {
+    exit 0
+}
+
+_outputs_and_exit() {
+    exit 0
+}
+
+"$@"
+"""
+
+
+class ReportHandler(PreHandler):
+    reports: List[dict] = []
+
+    def do_POST(self):
+        self.reports.append(json.loads(self.read_data()))
+        self.return_content(HTTPStatus.OK, "text/plain", b"saved\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestGraph(unittest.TestCase):
+    def test_affected(self):
+        functions = {x.name: x for x in parse_script(_SCRIPT)}
+        graph = skeleton_runner.resolve(functions, ["all"])
+        here = os.path.abspath
+        self.assertEqual(skeleton_watch.affected(functions, graph, [here("source.txt")]), {"generate"})
+        self.assertEqual(skeleton_watch.affected(functions, graph, [here("other/deep/file")]), {"other"})
+        self.assertEqual(skeleton_watch.affected(functions, graph, [here("unrelated")]), set())
+        # written by "generate" itself
+        self.assertEqual(skeleton_watch.affected(functions, graph, [here("generated.txt")]), set())
+        self.assertEqual(skeleton_watch.downstream(graph, ["generate"]), {"generate", "use_generated", "all"})
+
+    def test_changed_functions(self):
+        old = {"a": Function("a", 1, "echo a"), "b": Function("b", 5, "echo b")}
+        new = {"a": Function("a", 3, "echo a"), "b": Function("b", 7, "echo B"), "c": Function("c", 9, "")}
+        self.assertEqual(skeleton_watch.changed_functions(old, new), {"b", "c"})
+
+
+class TestReport(unittest.TestCase):
+    def test_check(self):
+        run = {"status": "ok", "returncode": 0, "started": 1.0, "finished": 2.5, "reason": None}
+        skeleton_watch.check_report({"targets": ["all"], "started": 1, "finished": 3.0, "runs": {"all": run}})
+        for bad in (
+            [],
+            {"runs": []},
+            {"runs": {"x": 1}},
+            {"runs": {"x": {"status": None}}},
+            {"runs": {"x": dict(run, started="yesterday")}},
+            {"runs": {"x": dict(run, returncode="0")}},
+            {"runs": {}, "targets": "all"},
+            {"runs": {}, "finished": "now"},
+        ):
+            with self.assertRaises(ValueError, msg=bad):
+                skeleton_watch.check_report(bad)
+
+    def test_published(self):
+        # what the loop sends is accepted
+        runs = {"all": skeleton_runner.TaskRun("all").as_dict()}
+        skeleton_watch.check_report({"targets": ["all"], "started": 1.0, "finished": 2.0, "runs": runs})
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        with open("skeleton.sh", "w") as script:
+            script.write(_SCRIPT)
+        os.chmod("skeleton.sh", 0o755)
+        self.write("source.txt", "one\n")
+        os.mkdir("other")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, path, text):
+        with open(path, "w") as file:
+            file.write(text)
+
+    def output(self):
+        with open("out") as out:
+            return out.read().split()
+
+    def check_watcher(self, watcher):
+        try:
+            watcher.watch([os.path.abspath("source.txt"), os.path.abspath("other")])
+            self.assertEqual(watcher.read(0.05), set())
+            time.sleep(0.01)  # another modification time for polling
+            self.write("source.txt", "two\n")
+            self.assertIn(os.path.abspath("source.txt"), watcher.read(2))
+            os.makedirs("other/deep")
+            self.assertIn(os.path.abspath("other/deep"), watcher.read(2))
+            watcher.read(0.1)
+            self.write("other/deep/file", "x")
+            self.assertIn(os.path.abspath("other/deep/file"), watcher.read(2))
+        finally:
+            watcher.close()
+
+    def test_inotify(self):
+        try:
+            watcher = skeleton_watch.InotifyWatcher()
+        except OSError:
+            self.skipTest("no inotify")
+        self.check_watcher(watcher)
+
+    def test_polling(self):
+        self.check_watcher(skeleton_watch.PollingWatcher(interval=0.05))
+
+    def wait_run(self, watch):
+        with watch.finished:
+            self.assertTrue(watch.finished.wait_for(lambda: watch.runs, 10))
+            runs, watch.runs = watch.runs, {}
+        return runs
+
+    def test_loop(self):
+        ReportHandler.reports = []
+        httpd = ThreadingHTTPServer(("localhost", 0), ReportHandler)
+        server = threading.Thread(target=httpd.serve_forever)
+        server.start()
+        runner = skeleton_runner.Runner("./skeleton.sh", jobs=2, verbose=False)
+        watcher = skeleton_watch.PollingWatcher(interval=0.05)
+        watch = skeleton_watch.Watch(
+            runner, ["all"], watcher, debounce=0.1, server=f"http://localhost:{httpd.server_port}"
+        )
+        loop = threading.Thread(target=watch.loop)
+        loop.start()
+        try:
+            runs = self.wait_run(watch)
+            self.assertTrue(all(x.status == skeleton_runner.OK for x in runs.values()))
+            self.assertEqual(sorted(self.output()), ["all", "generate", "other", "use_generated"])
+
+            os.unlink("out")
+            time.sleep(0.01)
+            self.write("source.txt", "two\n")
+            runs = self.wait_run(watch)
+            self.assertEqual(self.output(), ["generate", "use_generated", "all"])
+            self.assertEqual(runs["other"].reason, "not affected")
+
+            os.unlink("out")
+            with open("skeleton.sh", "a") as script:
+                script.write("\n")  # nothing changed
+            with open("skeleton.sh") as script:
+                text = script.read()
+            self.write("skeleton.sh", text.replace("echo other >>", "echo changed other >>"))
+            self.wait_run(watch)
+            self.assertEqual(self.output(), ["changed", "other", "all"])
+        finally:
+            watch.stop()
+            loop.join()
+            httpd.shutdown()
+            httpd.server_close()
+            server.join()
+        self.assertEqual(len(ReportHandler.reports), 3)
+        self.assertEqual(ReportHandler.reports[-1]["runs"]["generate"]["reason"], "not affected")
+
+    def test_cancel(self):
+        self.write("skeleton.sh", _SCRIPT.replace("echo other >>", "sleep 5; echo other >>"))
+        runner = skeleton_runner.Runner("./skeleton.sh", jobs=2, verbose=False)
+        watch = skeleton_watch.Watch(runner, ["other"], skeleton_watch.PollingWatcher(interval=0.05))
+        watch.load()
+        watch._pending = {"other"}
+        watch.start()
+        time.sleep(0.3)
+        started = time.monotonic()
+        self.assertEqual(watch.changed({os.path.abspath("other/file")}), {"other"})  # stale run is terminated
+        self.assertLess(time.monotonic() - started, 2)
+        watch.cancel()
+        self.assertFalse(os.path.exists("out"))
@@ -2,12 +2,13 @@
 
 import copy
 import html
-from typing import List, Optional
+from typing import Callable, Iterable, Iterator, List, Optional, Union
 
 _INDENT_ATOM = "    "  # 4 spaces
 _UNSAFE_NAMES = {"id"}
 _SAFE_PREFIX = "_"
 _DEFAULT_X_FIX = ""
+_CHUNK_SIZE = 64 * 1024
 
 
 def to_safe_name(name: str, safe_prefix: str = _SAFE_PREFIX) -> str:
@@ -159,13 +160,21 @@ class HTMLTag:
         if raw is None:
             return params.line(prefix + "/>")
 
-        ret = params.line(prefix + ">")
+        ret = self.opening(params)
         ret += raw
         if params.newline and not ret.endswith(params.newline):
             ret += params.newline
-        ret += params.line("</{}>".format(self.name))
+        ret += self.closing(params)
         return ret
 
+    def opening(self, params: TextParams) -> str:
+        if self.name.startswith("!"):
+            raise RuntimeError('there may be no HTML in tag name starting with "!"')
+        return params.line("<{}{}>".format(self.name, self.text_attributes()))
+
+    def closing(self, params: TextParams) -> str:
+        return params.line("</{}>".format(self.name))
+
     def code_attributes(self):
         ret = ", ".join([x.as_code() for x in self.attributes])
         if ret:
@@ -242,6 +251,28 @@ class HTMLNode:
             result = self.node_tag.as_text(params, children_raw)
         return result if result is not None else ""
 
+    def iter_text(self, params: TextParams) -> Iterator[str]:
+        """The same text as "as_text" in pieces, lazy children are rendered and dropped one by one."""
+        if not self.children:
+            yield self.as_text(params)
+            return
+        self.verify()
+
+        children_params = params if self.node_tag is None else params.inner
+        last = ""
+        if self.node_tag is not None:
+            last = self.node_tag.opening(params)
+            yield last
+        for child in self.children:
+            for piece in child.iter_text(children_params):
+                if piece:
+                    last = piece
+                    yield piece
+        if self.node_tag is not None:
+            if params.newline and not last.endswith(params.newline):
+                yield params.newline
+            yield self.node_tag.closing(params)
+
     def as_code(self, params: TextParams):
         self.verify()
 
@@ -266,6 +297,44 @@ class HTMLNode:
         return result if result is not None else ""
 
 
+LazyItem = Union["HTMLDocument", HTMLNode, str]
+
+
+class HTMLLazyNode(HTMLNode):
+    """Children produced only while rendering: "source" is an iterable or a function returning one.
+
+    Items are documents (usually one per row), nodes or raw strings. Every item is rendered and dropped,
+    so with "iter_text" the whole output is never in memory. An iterator can be rendered once,
+    a function is called on every rendering.
+    """
+
+    def __init__(self, parent: HTMLNode, source: Union[Iterable[LazyItem], Callable[[], Iterable[LazyItem]]]) -> None:
+        super().__init__(parent=parent)
+        self.source = source
+
+    def items(self) -> Iterator[HTMLNode]:
+        for item in self.source() if callable(self.source) else self.source:
+            if isinstance(item, HTMLDocument):
+                yield item.node.root()
+            elif isinstance(item, HTMLNode):
+                yield item
+            elif isinstance(item, str):
+                yield HTMLNode(parent=self, raw=HTMLRaw(item))
+            else:
+                raise RuntimeError("HTMLDocument, HTMLNode or str expected as lazy item")
+
+    def iter_text(self, params: TextParams) -> Iterator[str]:
+        for item in self.items():
+            yield from item.iter_text(params)
+
+    def as_text(self, params: TextParams):
+        return "".join(self.iter_text(params))
+
+    def as_code(self, params: TextParams):
+        # the generated code is static: all items are there
+        return "".join(x.as_code(params) for x in self.items())
+
+
 class HTMLDocument:
     """Example:
 
@@ -346,6 +415,18 @@ class HTMLDocument:
             )
         )
 
+    def lazy(self, source: Union[Iterable[LazyItem], Callable[[], Iterable[LazyItem]]]) -> None:
+        # Rows of a big table without keeping them:
+        #   def rows():
+        #       for row in cursor:
+        #           row_doc = HTMLDocument(doctype=False)
+        #           row_doc("td", raw=escape(row[0]))
+        #           yield row_doc
+        #   with doc("table"):
+        #       doc.lazy(rows)
+        #   handler.return_stream(HTTPStatus.OK, "text/html", doc.iter_content())
+        self.node.children.append(HTMLLazyNode(parent=self.node, source=source))
+
     def __call__(self, name: str, raw: Optional[str] = None, **kwargs) -> "HTMLDocument":
         # It is more clear to write
         #   doc.add_tag(tag_name, ...)
@@ -384,3 +465,21 @@ class HTMLDocument:
 
     def content(self, params: TextParams = PROD_PARAMS, coding: str = "UTF-8") -> bytes:
         return bytes(self.as_text(params), coding)
+
+    def iter_text(self, params: TextParams) -> Iterator[str]:
+        return self.node.root().iter_text(params)
+
+    def iter_content(
+        self, params: TextParams = PROD_PARAMS, coding: str = "UTF-8", chunk_size: int = _CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        # pieces of text are tiny: join them into chunks for chunked transfer encoding
+        pieces: List[str] = []
+        size = 0
+        for piece in self.iter_text(params):
+            pieces.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                yield bytes("".join(pieces), coding)
+                pieces, size = [], 0
+        if pieces:
+            yield bytes("".join(pieces), coding)
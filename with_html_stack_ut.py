@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import unittest
+import weakref
 
 import with_html_stack
 
@@ -499,6 +500,80 @@ class TestHTMLNode(unittest.TestCase):
         )
 
 
+class TestHTMLLazyNode(unittest.TestCase):
+    @staticmethod
+    def row(number):
+        doc = with_html_stack.HTMLDocument(doctype=False)
+        with doc("tr"):
+            doc("td", raw=str(number))
+        return doc
+
+    def table(self, source):
+        doc = with_html_stack.HTMLDocument(doctype=False)
+        with doc("table", _class="rows"):
+            doc.lazy(source)
+            doc.comment("end")
+        return doc
+
+    def test_same_text(self):
+        static = with_html_stack.HTMLDocument(doctype=False)
+        with static("table", _class="rows"):
+            for number in range(3):
+                static.append(self.row(number))
+            static.raw("text")
+            static.comment("end")
+
+        lazy = self.table(lambda: [self.row(x) for x in range(3)] + ["text"])
+        for params in (with_html_stack.DEV_PARAMS, with_html_stack.PROD_PARAMS):
+            self.assertEqual(lazy.as_text(params), static.as_text(params))
+            self.assertEqual("".join(lazy.iter_text(params)), static.as_text(params))
+        self.assertEqual(lazy.as_code(), static.as_code())
+
+    def test_empty(self):
+        doc = self.table(lambda: [])
+        self.assertEqual("".join(doc.iter_text(with_html_stack.DEV_PARAMS)), doc.as_text(with_html_stack.DEV_PARAMS))
+        self.assertEqual(doc.as_text(with_html_stack.PROD_PARAMS), '<table class="rows"><!-- end --></table>')
+
+    def test_source(self):
+        calls = []
+
+        def rows():
+            calls.append(True)
+            yield self.row(1)
+
+        doc = self.table(rows)
+        self.assertEqual(calls, [])  # nothing is evaluated before rendering
+        doc.as_text(with_html_stack.PROD_PARAMS)
+        self.assertEqual(doc.as_text(with_html_stack.PROD_PARAMS).count("<tr>"), 1)
+        self.assertEqual(len(calls), 2)
+
+        once = self.table(iter([self.row(1)]))
+        self.assertEqual(once.as_text(with_html_stack.PROD_PARAMS).count("<tr>"), 1)
+        self.assertEqual(once.as_text(with_html_stack.PROD_PARAMS).count("<tr>"), 0)
+
+        with self.assertRaisesRegex(RuntimeError, "lazy item"):
+            self.table([1]).as_text(with_html_stack.PROD_PARAMS)
+
+    def test_rows_are_dropped(self):
+        alive = weakref.WeakSet()
+        most = []
+
+        def rows():
+            for number in range(1000):
+                doc = self.row(number)
+                alive.add(doc)
+                most.append(len(alive))
+                yield doc
+
+        chunks = list(self.table(rows).iter_content(chunk_size=1024))
+        self.assertLessEqual(max(most), 2)
+        self.assertGreater(len(chunks), 10)
+        self.assertTrue(all(len(x) >= 1024 for x in chunks[:-1]))
+        text = b"".join(chunks).decode()
+        self.assertTrue(text.startswith('<table class="rows"><tr><td>0</td></tr>'))
+        self.assertTrue(text.endswith("<tr><td>999</td></tr><!-- end --></table>"))
+
+
 class TestHTMLDocument(unittest.TestCase):
     def setUp(self):
         doc = with_html_stack.HTMLDocument()